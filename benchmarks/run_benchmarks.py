@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# This file measures how fast, and with how much memory, the PDRS variables are calculated.
+#
+# Synthetic `Building` populations of increasing sizes are generated with realistic
+# distributions of the AC, motors and appliance inputs. For each size, every PDRS
+# variable with a formula is calculated in a fresh simulation, so that its time includes
+# the intermediate variables it depends on. Each size runs in a fresh process, whose peak
+# resident memory is recorded along with the times. Results are written as JSON, and a
+# previous results file can be compared against with `--compare`:
+#
+#     python benchmarks/run_benchmarks.py --output results.json
+#     python benchmarks/run_benchmarks.py --sizes 1000 100000 --compare results.json
+
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+import openfisca_core
+from openfisca_core.simulation_builder import SimulationBuilder
+
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+from openfisca_nsw_pdrs_tools.testing import generate_population
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+PERIOD = '2021'
+DEFAULT_SIZES = [10 ** exponent for exponent in range(8)]
+DEFAULT_OUTPUT = 'benchmark-results.json'
+
+
+def build_simulation(tax_benefit_system, columns, count):
+    simulation = SimulationBuilder().build_default_simulation(tax_benefit_system, count)
+    for name, values in columns.items():
+        simulation.set_input(name, PERIOD, values)
+    return simulation
+
+
+def benchmarked_variables(tax_benefit_system):
+    """Return the names of the PDRS variables which have a formula."""
+    return sorted(
+        name for name, variable in tax_benefit_system.variables.items()
+        if name.startswith('PDRS__') and variable.formulas
+        )
+
+
+def measure(function, repeat, setup = None):
+    """Return `(best time in seconds, peak traced bytes)` of `function()`.
+
+    The function is timed `repeat` times, then run once more under `tracemalloc`, which
+    tracks numpy allocations but would slow down the timed runs. If `setup` is given, it
+    is called untimed before each run, and its result is passed to `function`.
+    """
+    def run_once():
+        arguments = () if setup is None else (setup(),)
+        gc.collect()
+        start = time.perf_counter()
+        function(*arguments)
+        return time.perf_counter() - start
+
+    best = min(run_once() for _ in range(repeat))
+
+    arguments = () if setup is None else (setup(),)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def benchmark_system(system_options, repeat):
+    seconds, peak = measure(lambda: build_tax_benefit_system(**system_options), repeat)
+    return {'seconds': seconds, 'peak_traced_bytes': peak}
+
+
+def benchmark_size(tax_benefit_system, variables, count, repeat):
+    columns = generate_population(tax_benefit_system, count)
+    results = []
+
+    seconds, peak = measure(lambda: build_simulation(tax_benefit_system, columns, count), repeat)
+    results.append(_result('simulation_setup', count, seconds, peak))
+
+    for name in variables:
+        seconds, peak = measure(
+            lambda simulation: simulation.calculate(name, PERIOD),
+            repeat,
+            setup = lambda: build_simulation(tax_benefit_system, columns, count),
+            )
+        results.append(_result(name, count, seconds, peak))
+        log.info('%10d rows  %-55s %10.4fs  %12.0f rows/s', count, name, seconds, results[-1]['rows_per_second'])
+    return results
+
+
+def max_rss_bytes():
+    """Return the peak resident memory of this process in bytes, or None where unknown."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _benchmark_size_in_process(system_options, variables, count, repeat):
+    # Run in a fresh process: its peak resident memory is that of this size alone
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    tax_benefit_system = build_tax_benefit_system(**system_options)
+    results = benchmark_size(tax_benefit_system, variables, count, repeat)
+    return results, max_rss_bytes()
+
+
+def _result(name, count, seconds, peak):
+    return {
+        'variable': name,
+        'rows': count,
+        'seconds': seconds,
+        'rows_per_second': count / seconds if seconds else None,
+        'peak_traced_bytes': peak,
+        'peak_traced_bytes_per_row': peak / count,
+        }
+
+
+def run(sizes = DEFAULT_SIZES, variables = None, repeat = 3, system_options = None):
+    """Run the benchmarks and return their results as a JSON-serialisable dict."""
+    system_options = system_options or {}
+    system = benchmark_system(system_options, repeat)
+    log.info('System built in %.3fs.', system['seconds'])
+
+    variables = variables or benchmarked_variables(build_tax_benefit_system(**system_options))
+    results = []
+    memory = []
+    # Spawned rather than forked, so that a process does not start with the memory of its parent
+    context = multiprocessing.get_context('spawn')
+    for count in sizes:
+        with context.Pool(1) as pool:
+            size_results, max_rss = pool.apply(_benchmark_size_in_process, (system_options, variables, count, repeat))
+        results.extend(size_results)
+        memory.append({'rows': count, 'max_rss_bytes': max_rss})
+        if max_rss is not None:
+            log.info('%10d rows  peak resident memory %.1f MiB', count, max_rss / 2 ** 20)
+
+    return {
+        'metadata': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'openfisca_core': getattr(openfisca_core, '__version__', None) or _distribution_version('OpenFisca-Core'),
+            'openfisca_nsw_pdrs': _distribution_version('openfisca_nsw_pdrs'),
+            'period': PERIOD,
+            'repeat': repeat,
+            'system_options': system_options,
+            },
+        'system': system,
+        'results': results,
+        'memory': memory,
+        }
+
+
+def _distribution_version(name):
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Log the time ratio of `results` to `baseline` for each variable and size.
+
+    Returns the list of `(variable, rows, ratio)` slower than `threshold` times the baseline.
+    """
+    baseline_seconds = dict(((result['variable'], result['rows']), result['seconds']) for result in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        before = baseline_seconds.get((result['variable'], result['rows']))
+        if not before or not result['seconds']:
+            continue
+        ratio = result['seconds'] / before
+        log.info('%10d rows  %-55s %6.2fx', result['rows'], result['variable'], ratio)
+        if ratio > threshold:
+            regressions.append((result['variable'], result['rows'], ratio))
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description = 'Benchmark the PDRS variables on synthetic populations.')
+    parser.add_argument('--sizes', nargs = '+', type = int, default = DEFAULT_SIZES,
+        help = 'population sizes to benchmark (default: 1 to 10^7 rows)')
+    parser.add_argument('-v', '--variables', nargs = '+', default = None,
+        help = 'variables to benchmark (default: every PDRS variable with a formula)')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+        help = 'timed runs per measurement, the best one is kept (default: %(default)s)')
+    parser.add_argument('-o', '--output', default = DEFAULT_OUTPUT, help = 'JSON file to write (default: %(default)s)')
+    parser.add_argument('--compare', default = None, help = 'JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type = float, default = 1.5,
+        help = 'with --compare, fail if a measurement is this many times slower (default: %(default)s)')
+    parser.add_argument('--cache-dir', default = None, help = 'directory caching the parsed parameters between runs')
+    parser.add_argument('--fold-constants', action = 'store_true',
+        help = 'benchmark the system with constant folding enabled')
+    parser.add_argument('--compact', action = 'store_true',
+        help = 'benchmark the system in compact mode, with enums stored on one byte')
+    parser.add_argument('--compile', action = 'store_true',
+        help = 'benchmark the system with compiled formulas')
+    return parser
+
+
+def main(argv = None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    system_options = {'cache_dir': args.cache_dir, 'fold_constants': args.fold_constants, 'compact': args.compact,
+        'compile_formulas': args.compile}
+    # Read the baseline first: it may be the output file of the previous run
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run(args.sizes, args.variables, args.repeat, system_options)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent = 2)
+    log.info('Results written to %s.', args.output)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, count, ratio in regressions:
+            log.error('Regression: %s is %.2fx slower on %d rows.', name, ratio, count)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
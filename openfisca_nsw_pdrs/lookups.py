@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# This file compiles parameter tables into dense numpy arrays for use in formulas.
+#
+# Fancy indexing a parameter node (e.g. `table[installation_type][AC_type][band]`) builds
+# intermediate vectorial nodes and string keys for every row at every level. The
+# functions below instead read the table once per parameter instant into a numpy array,
+# so that a formula can look its values up with a single gather.
+
+import threading
+import weakref
+
+import numpy as np
+
+# Compiled tables, memoised per parameter node at instant. OpenFisca keeps one node per
+# instant, so a table is compiled once per instant, and dropped with the node.
+_compiled_tables = weakref.WeakKeyDictionary()
+_lock = threading.RLock()
+
+
+def compile_once(node, key, build):
+    """Return `build()`, memoised for the parameter node at instant `node` under `key`."""
+    with _lock:
+        tables = _compiled_tables.get(node)
+        if tables is None:
+            tables = _compiled_tables[node] = {}
+        table = tables.get(key)
+        if table is None:
+            table = tables[key] = build()
+    return table
+
+
+def enum_table(node, *enums):
+    """Return the values of `node` as a read-only array indexed by members of `enums`.
+
+    `node` must be a parameter node at instant whose children are named after the members
+    of `enums[0]`, their children after the members of `enums[1]`, and so on. The array
+    axes follow the declaration order of each enum, which is also the order of the indices
+    stored in an `EnumArray`, so enum arrays can be used to index the array directly:
+
+        table = enum_table(parameters(period).AC.AC_load_factors_table, installation_purpose)
+        load_factor = table[building('PDRS__Appliance__installation_purpose', period)]
+    """
+    if hasattr(node, 'per_version'):
+        # Rows reading different versions of the parameters (see `timeline`)
+        return node.per_version(lambda version: enum_table(version, *enums))
+    if hasattr(node, 'per_row'):
+        # Some parameters hold one value per row (see `overlays.VaryingParameterNode`)
+        return node.per_row(lambda base: enum_table(base, *enums), enums)
+    key = ('enum_table',) + tuple(tuple(item.name for item in enum) for enum in enums)
+    return compile_once(node, key, lambda: _build_enum_table(node, enums))
+
+
+def _build_enum_table(node, enums):
+    table = np.array(_enum_table_values(node, enums), dtype = float)
+    table.flags.writeable = False
+    return table
+
+
+def _enum_table_values(node, enums):
+    if not enums:
+        return node
+    return [_enum_table_values(node[item.name], enums[1:]) for item in enums[0]]
+
+
+def stacked_scale(node, enum, scale_name):
+    """Return the `scale_name` scales of the children of `node` as a `StackedScale`.
+
+    The children of `node` must be named after the members of `enum`, and the rows of the
+    stacked scale follow the enum declaration order, so an `EnumArray` selects each row's
+    own scale:
+
+        scales = stacked_scale(parameters(period).motors.motors_baseline_efficiency_table, motor_poles_number, 'rated_output')
+        efficiency = scales.calc(poles, rated_output, interpolate = True)
+    """
+    if hasattr(node, 'per_version'):
+        return node.per_version(lambda version: stacked_scale(version, enum, scale_name))
+    if hasattr(node, 'per_row'):
+        return node.per_row(lambda base: stacked_scale(base, enum, scale_name))
+    key = ('stacked_scale', tuple(item.name for item in enum), scale_name)
+    return compile_once(node, key, lambda: StackedScale([getattr(node[item.name], scale_name) for item in enum]))
+
+
+class StackedScale(object):
+    """Single amount scales stacked into one threshold array and one amount array.
+
+    Scales with fewer brackets are padded by repeating their last bracket. Each scale is
+    shifted by its own offset, so that the thresholds of all scales, flattened, form one
+    sorted array: one `np.searchsorted` then finds every row's bracket in its own scale.
+    """
+
+    def __init__(self, scales):
+        width = max(len(scale.thresholds) for scale in scales)
+        thresholds = np.array([_pad(scale.thresholds, width) for scale in scales], dtype = float)
+        amounts = np.array([_pad(scale.amounts, width) for scale in scales], dtype = float)
+
+        self.width = width
+        self.lowest = thresholds.min()
+        self.highest = thresholds.max()
+        # Consecutive scales are at least 1 apart once shifted
+        self.offsets = np.arange(len(scales)) * (self.highest - self.lowest + 1)
+        self.first_thresholds = thresholds[:, 0]
+        self.last_thresholds = thresholds[:, -1]
+        self.thresholds = (thresholds + self.offsets[:, np.newaxis]).ravel()
+        self.amounts = amounts.ravel()
+
+    def calc(self, scale_index, tax_base, interpolate = False, right = False):
+        """Evaluate each row of `tax_base` against the scale selected by `scale_index`.
+
+        Without `interpolate`, this returns the amount of the bracket containing the tax
+        base, as `SingleAmountTaxScale.calc` does. With `interpolate`, amounts are linearly
+        interpolated between thresholds, and tax bases out of the scale take the amount of
+        its first or last threshold.
+        """
+        scale_index = np.asarray(scale_index)
+        offset = np.take(self.offsets, scale_index)
+        row_start = scale_index * self.width
+
+        if not interpolate:
+            # Keep out-of-scale tax bases within reach of their own scale only
+            tax_base = np.clip(tax_base, self.lowest - 0.5, self.highest + 0.5)
+            side = 'left' if right else 'right'
+            bracket_count = np.searchsorted(self.thresholds, tax_base + offset, side = side) - row_start
+            amount = np.take(self.amounts, np.maximum(row_start + bracket_count - 1, 0))
+            return np.where(bracket_count > 0, amount, 0)
+
+        tax_base = np.clip(tax_base, np.take(self.first_thresholds, scale_index), np.take(self.last_thresholds, scale_index))
+        shifted_base = tax_base + offset
+        lower = np.searchsorted(self.thresholds, shifted_base, side = 'right') - 1
+        lower = np.clip(lower, row_start, row_start + self.width - 2)
+        lower_threshold = np.take(self.thresholds, lower)
+        width = np.take(self.thresholds, lower + 1) - lower_threshold
+        weight = np.where(width > 0, (shifted_base - lower_threshold) / np.where(width > 0, width, 1), 0)
+        lower_amount = np.take(self.amounts, lower)
+        return lower_amount + weight * (np.take(self.amounts, lower + 1) - lower_amount)
+
+
+def _pad(values, width):
+    values = list(values)
+    return values + values[-1:] * (width - len(values))
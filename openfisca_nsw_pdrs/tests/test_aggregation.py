@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Tests of portfolio aggregation, run with pytest.
+
+
+def test_mixed_portfolio_totals_each_activity_on_its_own_rows(tmp_path):
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.aggregation import ACTIVITIES, ACTIVITY_COLUMN, aggregate_file
+    from openfisca_nsw_pdrs_tools.batch import calculate_columns
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system, write_population
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 600)
+    activities = np.array(list(ACTIVITIES))[np.random.RandomState(0).choice(3, 600, p = [0.5, 0.3, 0.2])]
+    columns[ACTIVITY_COLUMN] = activities
+    input_path = str(tmp_path / 'portfolio.csv')
+    write_population(input_path, columns)
+
+    aggregator, _ = aggregate_file(input_path, str(tmp_path / 'totals.csv'), chunk_size = 250, tax_benefit_system = tax_benefit_system)
+    rows = aggregator.to_rows()
+    assert all(row[ACTIVITY_COLUMN] in ACTIVITIES for row in rows)
+
+    total = 0
+    for activity, name in ACTIVITIES.items():
+        # The savings of the activity's own rows, calculated on their own
+        own_rows = dict((column, values[activities == activity]) for column, values in columns.items())
+        expected = calculate_columns(tax_benefit_system, own_rows, [name])[name].astype(float).sum()
+        np.testing.assert_allclose(sum(row[name + '__sum'] for row in rows), expected, rtol = 1e-9)
+        assert all(row[name + '__sum'] == 0 for row in rows if row[ACTIVITY_COLUMN] != activity)
+        assert sum(row['rows'] for row in rows if row[ACTIVITY_COLUMN] == activity) == (activities == activity).sum()
+        total += expected
+    np.testing.assert_allclose(sum(row['total__sum'] for row in rows), total, rtol = 1e-9)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the batch calculator, run with pytest.
+#
+# OpenFisca runs this module when it loads the extension, as it does every module under
+# it: the tools are only imported by the tests themselves.
+
+
+def test_workers_match_single_process(tmp_path):
+    from openfisca_nsw_pdrs_tools.batch import calculate_batch
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system, write_population
+
+    tax_benefit_system = shared_system()
+    input_path = str(tmp_path / 'installations.csv')
+    write_population(input_path, generate_population(tax_benefit_system, 2500))
+
+    single_path = str(tmp_path / 'single.csv')
+    parallel_path = str(tmp_path / 'parallel.csv')
+    single = calculate_batch(input_path, single_path, chunk_size = 400, tax_benefit_system = tax_benefit_system)
+    parallel = calculate_batch(input_path, parallel_path, chunk_size = 400, workers = 2)
+
+    assert (single.rows, single.chunks) == (parallel.rows, parallel.chunks) == (2500, 7)
+    with open(single_path) as single_file, open(parallel_path) as parallel_file:
+        assert single_file.read() == parallel_file.read()
+
+
+def test_deduplicated_chunk_matches_full_simulation():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_chunk
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 300)
+    # Few distinct rows: the numeric inputs are rounded to a handful of values
+    for name in ['PDRS__Air_Conditioner__cooling_capacity', 'PDRS__motors__new_motor_rated_output']:
+        columns[name] = np.round(columns[name], -1)
+    for name in ['PDRS__Air_Conditioner__power_input', 'PDRS__motors__new_efficiency', 'PDRS__motors__old_efficiency']:
+        columns[name] = np.full(300, 90.0)
+
+    full, full_rows, _ = calculate_chunk(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    deduplicated, evaluated_rows, _ = calculate_chunk(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES, deduplicate = True)
+    assert full_rows == 300 and evaluated_rows < 300
+    for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+        np.testing.assert_array_equal(deduplicated[name], full[name])
+
+
+def test_deduplication_of_object_columns_with_missing_values():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import calculate_chunk, unique_rows
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    tax_benefit_system = shared_system()
+    variable = tax_benefit_system.get_variable('PDRS__Air_Conditioner__AC_type')
+    # e.g. an Arrow string column with nulls
+    ac_types = np.array(['type_6', None, 'type_2', None, 'type_6', 'type_2'], dtype = object)
+    columns = {
+        'PDRS__Air_Conditioner__AC_type': ac_types,
+        'PDRS__Air_Conditioner__cooling_capacity': np.full(6, 7.0),
+        'PDRS__Air_Conditioner__power_input': np.full(6, 2.0),
+        }
+    indices, inverse = unique_rows(columns, ['PDRS__Air_Conditioner__AC_type'], 6)
+    assert len(indices) == 3
+    assert inverse[0] == inverse[4] and inverse[1] == inverse[3] and inverse[2] == inverse[5]
+
+    results, evaluated_rows, _ = calculate_chunk(
+        tax_benefit_system, columns, ['PDRS__Air_Conditioner__peak_demand_savings'], deduplicate = True)
+    explicit = dict(columns, PDRS__Air_Conditioner__AC_type = np.where(
+        np.equal(ac_types, None), variable.default_value.name, ac_types).astype(str))
+    expected, _, _ = calculate_chunk(tax_benefit_system, explicit, ['PDRS__Air_Conditioner__peak_demand_savings'])
+    assert evaluated_rows == 3
+    np.testing.assert_array_equal(results['PDRS__Air_Conditioner__peak_demand_savings'], expected['PDRS__Air_Conditioner__peak_demand_savings'])
+
+
+def test_arrow_nulls_take_the_default_value(tmp_path):
+    import numpy as np
+    import pytest
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_chunk, read_chunks
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    pyarrow = pytest.importorskip('pyarrow')
+    parquet = pytest.importorskip('pyarrow.parquet')
+    tax_benefit_system = shared_system()
+    ac_type = tax_benefit_system.get_variable('PDRS__Air_Conditioner__AC_type')
+    zone_type = tax_benefit_system.get_variable('PDRS__Appliance__zone_type')
+    power_input = tax_benefit_system.get_variable('PDRS__Air_Conditioner__power_input')
+    path = str(tmp_path / 'installations.parquet')
+    parquet.write_table(pyarrow.table({
+        # A plain string column, a dictionary-encoded one, and a float column, all with nulls
+        'PDRS__Air_Conditioner__AC_type': pyarrow.array(['type_6', None, 'type_2']),
+        'PDRS__Appliance__zone_type': pyarrow.array(['hot', None, 'cold']).dictionary_encode(),
+        'PDRS__Air_Conditioner__cooling_capacity': pyarrow.array([7.1, 3.5, 12.0]),
+        'PDRS__Air_Conditioner__power_input': pyarrow.array([2.2, None, 4.0]),
+        }), path)
+
+    columns = next(read_chunks(path, tax_benefit_system = tax_benefit_system))
+    assert list(columns['PDRS__Air_Conditioner__AC_type']) == ['type_6', ac_type.default_value.name, 'type_2']
+    assert columns['PDRS__Appliance__zone_type'].decode_to_str()[1] == zone_type.default_value.name
+    assert columns['PDRS__Air_Conditioner__power_input'][1] == power_input.default_value
+
+    results, _, _ = calculate_chunk(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    assert all(np.isfinite(results[name]).all() for name in PEAK_DEMAND_SAVINGS_VARIABLES)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the compact mode, run with pytest.
+
+
+def test_evicting_calculation_matches_normal_results():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD, PEAK_DEMAND_SAVINGS_VARIABLES, build_simulation
+    from openfisca_nsw_pdrs_tools.compact import calculate_evicting
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 1000)
+    normal = build_simulation(tax_benefit_system, columns)
+    evicting = build_simulation(tax_benefit_system, columns)
+
+    results = calculate_evicting(evicting, PEAK_DEMAND_SAVINGS_VARIABLES, DEFAULT_PERIOD)
+    for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+        np.testing.assert_array_equal(results[name], normal.calculate(name, DEFAULT_PERIOD))
+    # Intermediate variables are gone, inputs are kept
+    assert evicting.get_holder('PDRS__Air_Conditioner__baseline_power_input').get_array(DEFAULT_PERIOD) is None
+    assert evicting.get_holder('PDRS__Air_Conditioner__power_input').get_array(DEFAULT_PERIOD) is not None
+
+
+def test_compact_system_matches_normal_results():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 1000)
+    normal = calculate_columns(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    compact = calculate_columns(shared_system(compact = True), columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+        np.testing.assert_array_equal(compact[name], normal[name])
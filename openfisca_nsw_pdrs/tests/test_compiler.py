@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+# Tests of compiled formulas, run with pytest.
+
+
+def test_compiled_formulas_match_simulation_results():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    compiled_system = shared_system(compile_formulas = True)
+    for seed, count in [(1, 1), (2, 37), (3, 2000)]:
+        columns = generate_population(tax_benefit_system, count, seed = seed)
+        expected = calculate_columns(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+        compiled = calculate_columns(compiled_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+        for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+            assert compiled[name].dtype == expected[name].dtype
+            np.testing.assert_array_equal(compiled[name], expected[name], err_msg = '{} (seed {})'.format(name, seed))
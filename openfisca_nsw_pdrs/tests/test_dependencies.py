@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the static analysis of formulas, run with pytest.
+
+import ast
+import textwrap
+
+
+def dependencies_of(source):
+    from openfisca_nsw_pdrs_tools.dependencies import function_dependencies
+
+    return function_dependencies(ast.parse(textwrap.dedent(source)).body[0])
+
+
+def test_variables_and_parameters_read_at_the_formula_period():
+    dependencies = dependencies_of('''
+        def formula(building, period, parameters):
+            params = parameters(period).AC
+            capacity = building('PDRS__Air_Conditioner__cooling_capacity', period)
+            return capacity * params.AC_load_factors_table['residential']
+        ''')
+    assert dependencies.variables == {'PDRS__Air_Conditioner__cooling_capacity'}
+    assert dependencies.parameters == {('AC', 'AC_load_factors_table', 'residential')}
+    assert not dependencies.opaque
+
+
+def test_reading_another_period_is_opaque():
+    for body in [
+            "return building('PDRS__motors__new_efficiency', period.last_year)",
+            "return parameters(period.last_year).PDRS_wide_constants.CONTRIBUTION_FACTOR",
+            "return parameters('2021-01-01').PDRS_wide_constants.CONTRIBUTION_FACTOR",
+            "return building('PDRS__motors__new_efficiency', period) * (period.start.year > 2022)",
+            ]:
+        source = 'def formula(building, period, parameters):\n    {}\n'.format(body)
+        assert dependencies_of(source).opaque, body
+
+
+def test_folding_only_considers_extension_variables():
+    from openfisca_nsw_pdrs_tools.dependencies import extension_variables
+    from openfisca_nsw_pdrs_tools.folding import foldable_variables
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    tax_benefit_system = shared_system()
+    extension = set(extension_variables(tax_benefit_system))
+    assert 'PDRS__ROOA__peak_demand_savings' in extension
+    assert set(foldable_variables(tax_benefit_system)) <= extension
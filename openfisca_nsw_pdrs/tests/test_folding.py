@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Tests of constant folding, run with pytest.
+
+
+def test_dependency_before_its_first_formula_has_its_default_value():
+    import numpy as np
+    from openfisca_core.periods import YEAR
+    from openfisca_core.variables import Variable
+    from openfisca_nsw_base.entities import Building
+    from openfisca_nsw_pdrs_tools.batch import calculate_columns
+    from openfisca_nsw_pdrs_tools.folding import fold_constants
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+    # Defined here rather than at module level, where the extension loader would register them
+    class later_contribution_factor(Variable):
+        value_type = float
+        entity = Building
+        definition_period = YEAR
+        default_value = 0.5
+
+        def formula_2023_01_01(building, period, parameters):
+            return parameters(period).PDRS_wide_constants.CONTRIBUTION_FACTOR * 2
+
+    class contribution_total(Variable):
+        value_type = float
+        entity = Building
+        definition_period = YEAR
+
+        def formula(building, period):
+            return building('later_contribution_factor', period) + 1
+
+    systems = []
+    for fold in (False, True):
+        tax_benefit_system = build_tax_benefit_system()
+        tax_benefit_system.add_variable(later_contribution_factor)
+        tax_benefit_system.add_variable(contribution_total)
+        if fold:
+            assert 'contribution_total' in fold_constants(tax_benefit_system)
+        systems.append(tax_benefit_system)
+
+    for period in ('2021', '2023'):
+        expected, folded = [calculate_columns(system, {}, ['contribution_total'], period, count = 3)['contribution_total'] for system in systems]
+        np.testing.assert_array_equal(folded, expected, err_msg = period)
+    np.testing.assert_array_equal(expected, [3, 3, 3])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the GEMS register lookups, run with pytest.
+
+import csv
+
+REGISTER = [
+    ['Brand', 'Model No', 'PDRS__Air_Conditioner__power_input', 'PDRS__Air_Conditioner__cooling_capacity', 'PDRS__Air_Conditioner__AC_type'],
+    ['Acme', 'AC-100', '2.0', '7.0', 'type_6'],
+    ['Acme', 'AC-200', '', '9.0', 'type_7'],
+    ['Zenith', 'Z-1', '1.5', '5.0', 'type_2'],
+    # Sold under two brands
+    ['Zenith', 'SHARED-9', '3.0', '10.0', 'type_6'],
+    ['Acme', 'SHARED-9', '3.1', '10.5', 'type_6'],
+    # Listed twice under the same brand: not ambiguous
+    ['Zenith', 'Z-2', '1.1', '4.0', 'type_1'],
+    ['Zenith', 'Z-2', '1.2', '4.5', 'type_1'],
+    ]
+
+
+def write_register(path, rows):
+    with open(path, 'w', newline = '') as register_file:
+        csv.writer(register_file).writerows(rows)
+
+
+def test_resolve_joins_products_and_keeps_own_inputs(tmp_path):
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.gems_registry import ProductRegistry
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    tax_benefit_system = shared_system()
+    path = str(tmp_path / 'register.csv')
+    write_register(path, REGISTER)
+    registry = ProductRegistry.load(tax_benefit_system, path)
+
+    columns = {
+        # e.g. Parquet string columns with nulls
+        'brand': np.array([' acme', 'Acme', None, 'Zenith', 'Acme'], dtype = object),
+        'model': np.array(['ac-100 ', 'AC-200', 'Z-1', None, 'UNKNOWN'], dtype = object),
+        'PDRS__Air_Conditioner__power_input': np.array([9.0, 8.0, 7.0, 6.0, 5.0]),
+        }
+    resolved, found = registry.resolve(tax_benefit_system, columns)
+    assert found.tolist() == [True, True, False, False, False]
+    # AC-200 has no power input in the register: it keeps its own
+    np.testing.assert_array_equal(resolved['PDRS__Air_Conditioner__power_input'], np.array([2.0, 8.0, 7.0, 6.0, 5.0], dtype = np.float32))
+    np.testing.assert_array_equal(resolved['PDRS__Air_Conditioner__cooling_capacity'], np.array([7.0, 9.0, 0, 0, 0], dtype = np.float32))
+    ac_types = resolved['PDRS__Air_Conditioner__AC_type'].decode_to_str()
+    default = tax_benefit_system.get_variable('PDRS__Air_Conditioner__AC_type').default_value.name
+    assert ac_types.tolist() == ['type_6', 'type_7', default, default, default]
+
+
+def test_models_sold_under_several_brands_are_ambiguous(tmp_path):
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.gems_registry import AMBIGUOUS, ProductRegistry
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    tax_benefit_system = shared_system()
+    path = str(tmp_path / 'register.csv')
+    write_register(path, REGISTER)
+    registry = ProductRegistry.load(tax_benefit_system, path)
+
+    rows = registry.rows(np.array(['shared-9', 'Z-2', 'Z-1', 'NOPE']))
+    assert rows[0] == AMBIGUOUS
+    # The first listing of a product is used
+    assert rows[1:].tolist() == [5, 2, -1]
+    assert registry.rows(np.array(['SHARED-9']), np.array(['Acme'])).tolist() == [4]
+
+    resolved, found = registry.resolve(tax_benefit_system, {'model': np.array(['SHARED-9'])})
+    assert not found[0]
+
+
+def test_index_is_reused_until_the_register_changes(tmp_path, monkeypatch):
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.gems_registry import ProductRegistry
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    parsed = []
+    from_columns = ProductRegistry.from_columns.__func__
+
+    def counting_from_columns(cls, *args, **kwargs):
+        parsed.append(args)
+        return from_columns(cls, *args, **kwargs)
+
+    monkeypatch.setattr(ProductRegistry, 'from_columns', classmethod(counting_from_columns))
+    tax_benefit_system = shared_system()
+    path = str(tmp_path / 'register.csv')
+    index_path = str(tmp_path / 'index')
+    write_register(path, REGISTER)
+    ProductRegistry.load(tax_benefit_system, path, index_path)
+    assert len(parsed) == 1
+
+    reused = ProductRegistry.load(tax_benefit_system, path, index_path)
+    assert len(parsed) == 1
+    assert reused.rows(np.array(['Z-1'])).tolist() == [2]
+
+    write_register(path, REGISTER[:1] + [['Acme', 'AC-300', '2.5', '8.0', 'type_6']])
+    changed = ProductRegistry.load(tax_benefit_system, path, index_path)
+    assert len(parsed) == 2
+    assert changed.rows(np.array(['Z-1', 'AC-300'])).tolist() == [-1, 0]
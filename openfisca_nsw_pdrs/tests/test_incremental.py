@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# Tests of incremental simulations, run with pytest.
+
+OUTPUTS = ['PDRS__Air_Conditioner__peak_demand_savings', 'PDRS__motors__peak_demand_savings']
+
+
+def test_updates_only_recalculate_dependent_variables():
+    from openfisca_core.periods import ETERNITY
+    from openfisca_core.variables import Variable
+    from openfisca_nsw_base.entities import Building
+    from openfisca_nsw_pdrs_tools.incremental import IncrementalSimulation
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.testing import generate_population
+
+    # Defined here rather than at module level, where the extension loader would register it
+    class previous_motor_efficiency(Variable):
+        value_type = float
+        entity = Building
+        definition_period = ETERNITY
+
+        def formula(building, period):
+            # Reading another period cannot be analysed
+            return building('PDRS__motors__new_efficiency', period.last_year)
+
+    tax_benefit_system = build_tax_benefit_system()
+    tax_benefit_system.add_variable(previous_motor_efficiency)
+    portfolio = IncrementalSimulation(tax_benefit_system, generate_population(tax_benefit_system, 200), variables = OUTPUTS)
+    assert not portfolio.opaque
+    portfolio.calculate(OUTPUTS)
+
+    stale = portfolio.update_input('PDRS__Air_Conditioner__power_input', [2.1, 3.4], rows = [10, 42])
+    assert stale == {'PDRS__Air_Conditioner__peak_demand_savings'}
+    portfolio.calculate(OUTPUTS)
+    # The motors savings, which do not read the AC power input, are not recalculated
+    assert portfolio.last_formula_runs == {'PDRS__Air_Conditioner__peak_demand_savings'}
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the lazy loading of the extension, run with pytest.
+
+
+def test_motors_run_only_parses_motors_parameters():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import calculate_columns
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    columns = generate_population(shared_system(), 500)
+    motors_columns = dict((name, values) for name, values in columns.items() if name.startswith('PDRS__motors__'))
+    name = 'PDRS__motors__peak_demand_savings'
+    expected = calculate_columns(shared_system(), motors_columns, [name])[name]
+
+    tax_benefit_system = build_tax_benefit_system(lazy = True)
+    loader = tax_benefit_system.variables.loader
+    assert not loader.loaded_parameters
+    results = calculate_columns(tax_benefit_system, motors_columns, [name])
+
+    np.testing.assert_array_equal(results[name], expected)
+    assert loader.loaded_parameters == {'motors', 'PDRS_wide_constants'}
+    assert not set(tax_benefit_system.parameters.children) & {'AC', 'ROOA_fridge'}
+    groups = loader.groups()
+    assert groups['PDRS_motors'] and not groups['PDRS_AirConditioner'] and not groups['PDRS_ROOA']
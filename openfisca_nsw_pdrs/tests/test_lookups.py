@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the compiled parameter lookups, run with pytest.
+
+# (thresholds, amounts) of scales with different numbers of brackets, so that the
+# shorter ones are padded when stacked
+BRACKETS = [
+    ([0, 0.75, 1.1, 3, 7.5], [0, 77.4, 79.6, 84.6, 89.3]),
+    ([0.5, 2], [80, 85]),
+    ([1, 1.5, 4], [82.5, 84.1, 88.2]),
+    ]
+# Below the first threshold, above the last, on each threshold and between thresholds
+TAX_BASES = [-1, 0, 0.25, 0.5, 0.75, 0.9, 1, 1.1, 1.5, 2, 2.5, 3, 4, 5, 7.5, 10]
+
+
+def _scales():
+    from openfisca_core.taxscales import SingleAmountTaxScale
+
+    scales = []
+    for thresholds, amounts in BRACKETS:
+        scale = SingleAmountTaxScale()
+        for threshold, amount in zip(thresholds, amounts):
+            scale.add_bracket(threshold, amount)
+        scales.append(scale)
+    return scales
+
+
+def _rows():
+    import numpy as np
+
+    scale_index = np.repeat(np.arange(len(BRACKETS)), len(TAX_BASES))
+    tax_base = np.tile(np.array(TAX_BASES, dtype = float), len(BRACKETS))
+    return scale_index, tax_base
+
+
+def test_stacked_scale_interpolates_each_row_in_its_own_scale():
+    import numpy as np
+    from openfisca_nsw_pdrs.lookups import StackedScale
+
+    scale_index, tax_base = _rows()
+    stacked = StackedScale(_scales()).calc(scale_index, tax_base, interpolate = True)
+    for index, (thresholds, amounts) in enumerate(BRACKETS):
+        rows = scale_index == index
+        # np.interp takes the amount of the first or last threshold out of the scale
+        expected = np.interp(tax_base[rows], thresholds, amounts)
+        np.testing.assert_allclose(stacked[rows], expected, rtol = 1e-12, err_msg = 'scale {}'.format(index))
+
+
+def test_stacked_scale_matches_single_amount_scales():
+    import numpy as np
+    from openfisca_nsw_pdrs.lookups import StackedScale
+
+    scales = _scales()
+    scale_index, tax_base = _rows()
+    for right in (False, True):
+        stacked = StackedScale(scales).calc(scale_index, tax_base, right = right)
+        for index, scale in enumerate(scales):
+            rows = scale_index == index
+            np.testing.assert_array_equal(stacked[rows], scale.calc(tax_base[rows], right = right),
+                err_msg = 'scale {}, right = {}'.format(index, right))
+
+
+def test_motors_efficiency_table_matches_per_pole_scales():
+    import numpy as np
+    from openfisca_nsw_pdrs.lookups import stacked_scale
+    from openfisca_nsw_pdrs.variables.PDRS_motors.existing_motor_efficiency import motor_poles_number
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    table = shared_system().get_parameters_at_instant('2021-01-01').motors.motors_baseline_efficiency_table
+    for index, poles in enumerate(motor_poles_number):
+        scale = table[poles.name].rated_output
+        tax_base = np.concatenate([[-1, 1000], scale.thresholds, np.linspace(0, max(scale.thresholds), 50)])
+        stacked = stacked_scale(table, motor_poles_number, 'rated_output').calc(np.full(len(tax_base), index), tax_base, interpolate = True)
+        np.testing.assert_allclose(stacked, np.interp(tax_base, scale.thresholds, scale.amounts), rtol = 1e-12, err_msg = poles.name)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Tests of Monte Carlo uncertainty propagation, run with pytest.
+
+TABLE_CELL = 'AC.AC_baseline_power_per_capacity_reference_table.new.type_1.between_4_and_10'
+
+
+def test_varying_a_table_cell_matches_separate_runs():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import calculate_columns
+    from openfisca_nsw_pdrs_tools.monte_carlo import Normal, monte_carlo
+    from openfisca_nsw_pdrs_tools.overlays import get_parameter
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 200)
+    # Make sure some rows read the varied cell
+    columns['PDRS__Appliance__installation_type'][:50] = 0
+    columns['PDRS__Air_Conditioner__AC_type'][:50] = 0
+    columns['PDRS__Air_Conditioner__cooling_capacity'][:50] = 5.0
+    distribution = Normal(0.01)
+    name = 'PDRS__Air_Conditioner__peak_demand_savings'
+    summary = monte_carlo(tax_benefit_system, columns, name, 3, parameters = {TABLE_CELL: distribution},
+        max_rows = 400, keep_samples = True)[name]
+
+    base = tax_benefit_system.get_parameters_at_instant('2021-01-01').AC.AC_baseline_power_per_capacity_reference_table.new.type_1.between_4_and_10
+    for index in range(3):
+        # Sample `index` reads the value drawn first from its own generator
+        value = distribution.sample(np.random.RandomState([0, index]), base)
+        changed = build_tax_benefit_system()
+        get_parameter(changed.parameters, TABLE_CELL).update(start = '1900-01-01', value = value)
+        expected = calculate_columns(changed, columns, [name])[name]
+        np.testing.assert_array_equal(summary.samples[index], expected.astype(np.float32))
+    assert summary.std[:50].max() > 0
+
+
+def test_std_is_stable_across_chunks():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.monte_carlo import MonteCarloSummary
+
+    # A large mean and a small spread: a sum of squares would cancel out
+    values = 1e8 + np.random.RandomState(0).standard_normal((60, 4))
+    summary = MonteCarloSummary('savings', 4)
+    for first in range(0, 60, 7):
+        summary.add(values[first:first + 7])
+    np.testing.assert_allclose(summary.mean, values.mean(axis = 0), rtol = 1e-12)
+    np.testing.assert_allclose(summary.std, values.std(axis = 0), rtol = 1e-6)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the parameter snapshot cache, run with pytest.
+
+
+def test_instants_periods_and_strings_share_snapshots():
+    from openfisca_core import periods
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    cache = shared_system(parameter_cache_size = 2).get_parameters_at_instant
+    cache.cache_clear()
+    snapshot = cache('2021-01-01')
+    assert cache(periods.instant('2021-01-01')) is snapshot
+    assert cache(periods.period('2021')) is snapshot
+    assert cache.cache_info() == (2, 1, 2, 1)
+
+
+def test_least_recently_used_snapshot_is_evicted():
+    from openfisca_nsw_pdrs_tools.testing import shared_system
+
+    cache = shared_system(parameter_cache_size = 2).get_parameters_at_instant
+    cache.cache_clear()
+    for instant in ['2021-01-01', '2022-01-01', '2021-01-01', '2023-01-01']:
+        cache(instant)
+    assert cache.cache_info() == (1, 3, 2, 2)
+    # 2022 was the least recently used when 2023 came in
+    cache('2021-01-01')
+    cache('2022-01-01')
+    assert cache.cache_info() == (2, 4, 2, 2)
+
+
+def test_simulations_read_cached_snapshots():
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system(parameter_cache_size = 2)
+    cache = tax_benefit_system.get_parameters_at_instant
+    cache.cache_clear()
+    columns = generate_population(tax_benefit_system, 100)
+    calculate_columns(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    first = cache.cache_info()
+    assert first.misses == 1 and first.hits > 0
+
+    calculate_columns(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+    second = cache.cache_info()
+    assert second.misses == 1 and second.hits == 2 * first.hits + 1
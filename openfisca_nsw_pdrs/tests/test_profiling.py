@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the formula profiler, run with pytest.
+
+
+def test_profiled_formulas_keep_their_arity():
+    import numpy as np
+    from openfisca_core.periods import ETERNITY
+    from openfisca_core.variables import Variable
+    from openfisca_nsw_base.entities import Building
+    from openfisca_nsw_pdrs_tools.batch import build_simulation
+    from openfisca_nsw_pdrs_tools.profiling import profile
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+    # Defined here rather than at module level, where the extension loader would register it
+    class doubled_cooling_capacity(Variable):
+        value_type = float
+        entity = Building
+        definition_period = ETERNITY
+
+        def formula(building, period):
+            return building('PDRS__Air_Conditioner__cooling_capacity', period) * 2
+
+    tax_benefit_system = build_tax_benefit_system()
+    tax_benefit_system.add_variable(doubled_cooling_capacity)
+    simulation = build_simulation(tax_benefit_system, {'PDRS__Air_Conditioner__cooling_capacity': np.array([1.5, 7.0])})
+    with profile(tax_benefit_system) as profiler:
+        result = simulation.calculate('doubled_cooling_capacity', '2021')
+        simulation.calculate('PDRS__ROOA__peak_demand_savings', '2021')
+
+    np.testing.assert_array_equal(result, [3.0, 14.0])
+    stats = profiler.stats()
+    assert stats['doubled_cooling_capacity'].calls == 1
+    assert stats['PDRS__ROOA__peak_demand_savings'].calls == 1
+
+
+def test_only_extension_formulas_are_wrapped():
+    from openfisca_nsw_pdrs_tools.dependencies import extension_variables
+    from openfisca_nsw_pdrs_tools.profiling import Profiler
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+    tax_benefit_system = build_tax_benefit_system()
+    extension = set(extension_variables(tax_benefit_system))
+    profiler = Profiler(tax_benefit_system)
+    profiler.install()
+    try:
+        for name, variable in tax_benefit_system.variables.items():
+            wrapped = any(hasattr(formula, '__wrapped__') for formula in variable.formulas.values())
+            assert wrapped == (name in extension and bool(variable.formulas)), name
+    finally:
+        profiler.uninstall()
+    assert not any(hasattr(formula, '__wrapped__') for variable in tax_benefit_system.variables.values() for formula in variable.formulas.values())
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the asynchronous calculation service, run with pytest.
+
+import asyncio
+
+SCENARIOS = [
+    {'PDRS__Air_Conditioner__cooling_capacity': 7.1, 'PDRS__Air_Conditioner__power_input': 2.2},
+    {'PDRS__Air_Conditioner__cooling_capacity': 3.5, 'PDRS__Air_Conditioner__power_input': 1.1},
+    ]
+VARIABLES = ['PDRS__Air_Conditioner__peak_demand_savings']
+
+
+async def _calculate_then_stop(service):
+    await service.start()
+    # A window longer than the test: the scenarios are still pending when the service stops
+    calculations = [asyncio.ensure_future(service.calculate(scenario, VARIABLES)) for scenario in SCENARIOS]
+    await asyncio.sleep(0)
+    await service.stop()
+    assert all(calculation.done() for calculation in calculations)
+    return [calculation.result() for calculation in calculations]
+
+
+def test_stop_calculates_pending_scenarios():
+    from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD
+    from openfisca_nsw_pdrs_tools.service import CalculationService
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.web_api import calculate_scenarios
+
+    service = CalculationService(workers = 1, batch_window = 60)
+    results = asyncio.run(_calculate_then_stop(service))
+
+    expected = calculate_scenarios(build_tax_benefit_system(), SCENARIOS, VARIABLES, DEFAULT_PERIOD)
+    assert results == expected
+    assert service.metrics.errors == 0
+
+
+async def _post_variables(app, variables_list):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    statuses = []
+    async with TestClient(TestServer(app)) as client:
+        for variables in variables_list:
+            response = await client.post('/calculate/batch', json = {'variables': variables, 'scenarios': SCENARIOS})
+            body = await response.json()
+            statuses.append((response.status, 'error' in body))
+    return statuses
+
+
+def test_invalid_variables_are_bad_requests():
+    import pytest
+    pytest.importorskip('aiohttp')
+    from openfisca_nsw_pdrs_tools.service import CalculationService, create_app
+
+    app = create_app(CalculationService(workers = 1))
+    invalid = [5, [1], [['x']], [{'a': 1}], {}, ['not_a_variable']]
+    statuses = asyncio.run(_post_variables(app, invalid + [VARIABLES]))
+    assert statuses == [(400, True)] * len(invalid) + [(200, False)]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Tests of parameter sweeps, run with pytest.
+
+GRID = {
+    'PDRS_wide_constants.CONTRIBUTION_FACTOR': [0.8, 1.2],
+    'PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS': [5, 6],
+    }
+
+
+def test_sweep_matches_separate_runs():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns
+    from openfisca_nsw_pdrs_tools.overlays import get_parameter
+    from openfisca_nsw_pdrs_tools.sweep import sweep
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.testing import generate_population, shared_system
+
+    tax_benefit_system = shared_system()
+    columns = generate_population(tax_benefit_system, 500)
+    scenarios, results = sweep(tax_benefit_system, columns, PEAK_DEMAND_SAVINGS_VARIABLES, GRID)
+    assert len(scenarios) == 4
+    assert not np.array_equal(results['PDRS__ROOA__peak_demand_savings'][0], results['PDRS__ROOA__peak_demand_savings'][-1])
+
+    for index, scenario in enumerate(scenarios):
+        # A separate run on a system whose parameters hold the scenario values
+        changed = build_tax_benefit_system()
+        for path, value in scenario.items():
+            get_parameter(changed.parameters, path).update(start = '1900-01-01', value = value)
+        expected = calculate_columns(changed, columns, PEAK_DEMAND_SAVINGS_VARIABLES)
+        for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+            np.testing.assert_array_equal(results[name][index], expected[name], err_msg = '{} {}'.format(name, dict(scenario)))
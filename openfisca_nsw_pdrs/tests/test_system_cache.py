@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the on-disk parameter cache, run with pytest.
+
+import os
+import shutil
+
+
+def _copy_parameters(tmp_path):
+    from openfisca_nsw_pdrs_tools.paths import PARAMETERS_DIR
+
+    parameters_dir = str(tmp_path / 'parameters')
+    shutil.copytree(PARAMETERS_DIR, parameters_dir, ignore = shutil.ignore_patterns('__pycache__'))
+    return parameters_dir
+
+
+def _count_parses(monkeypatch):
+    from openfisca_nsw_pdrs_tools import system_cache
+
+    parses = []
+    parameter_node = system_cache.ParameterNode
+
+    def counting_parameter_node(*args, **kwargs):
+        parses.append(kwargs.get('directory_path'))
+        return parameter_node(*args, **kwargs)
+
+    monkeypatch.setattr(system_cache, 'ParameterNode', counting_parameter_node)
+    return parses
+
+
+def _cache_files(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def _contribution_factor(parameters):
+    return parameters('2021-01-01').PDRS_wide_constants.CONTRIBUTION_FACTOR
+
+
+def test_second_load_reads_the_cache(tmp_path, monkeypatch):
+    from openfisca_nsw_pdrs_tools.system_cache import load_parameters
+
+    parameters_dir = _copy_parameters(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    parses = _count_parses(monkeypatch)
+    parsed = load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    cached = load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    assert parses == [parameters_dir]
+    assert cached is not parsed
+    assert _contribution_factor(cached) == _contribution_factor(parsed)
+    assert len(_cache_files(cache_dir)) == 1
+
+
+def test_editing_a_parameter_evicts_the_old_entry(tmp_path, monkeypatch):
+    from openfisca_nsw_pdrs_tools.system_cache import load_parameters
+
+    parameters_dir = _copy_parameters(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    old_files = _cache_files(cache_dir)
+
+    path = os.path.join(parameters_dir, 'PDRS_wide_constants.yaml')
+    with open(path) as parameter_file:
+        content = parameter_file.read()
+    with open(path, 'w') as parameter_file:
+        parameter_file.write(content.replace('            value: 1\n', '            value: 0.5\n', 1))
+
+    parses = _count_parses(monkeypatch)
+    parameters = load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    assert parses == [parameters_dir]
+    assert _contribution_factor(parameters) == 0.5
+    new_files = _cache_files(cache_dir)
+    assert len(new_files) == 1 and new_files != old_files
+
+
+def test_corrupt_cache_is_ignored(tmp_path, monkeypatch):
+    from openfisca_nsw_pdrs_tools.system_cache import load_parameters
+
+    parameters_dir = _copy_parameters(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    cache_path = os.path.join(cache_dir, _cache_files(cache_dir)[0])
+    with open(cache_path, 'wb') as cache_file:
+        cache_file.write(b'not a pickle')
+
+    parses = _count_parses(monkeypatch)
+    parameters = load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    assert parses == [parameters_dir]
+    assert _contribution_factor(parameters) == 1
+    # The entry is rewritten, and read on the next load
+    load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    assert len(parses) == 1
+
+
+def test_unpicklable_parameters_leave_no_temporary_file(tmp_path, monkeypatch):
+    import pickle
+    from openfisca_nsw_pdrs_tools import system_cache
+
+    def failing_dump(*args, **kwargs):
+        raise pickle.PicklingError('cannot pickle')
+
+    parameters_dir = _copy_parameters(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(system_cache.pickle, 'dump', failing_dump)
+    parameters = system_cache.load_parameters(parameters_dir, [parameters_dir], cache_dir)
+    assert _contribution_factor(parameters) == 1
+    assert _cache_files(cache_dir) == []
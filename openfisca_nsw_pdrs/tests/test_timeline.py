@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Tests of per-row implementation dates, run with pytest.
+
+DATES = ['2021-03-01', '2022-08-15', '2023-07-01', '2024-01-01']
+
+# New values of some parameters, from some dates on: (path, start, value or scale factor)
+VINTAGES = [
+    ('ROOA_fridge.ROOA_related_constants.AVERAGE_SUMMER_DEMAND', '2022-07-01', 1.1),
+    ('PDRS_wide_constants.CONTRIBUTION_FACTOR', '2023-07-01', 0.9),
+    ('PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS', '2024-01-01', 1.5),
+    ('AC.AC_load_factors_table', '2023-07-01', 1.1),
+    ('AC.AC_baseline_power_per_capacity_reference_table', '2022-07-01', 0.9),
+    ('motors', '2022-07-01', 1.05),
+    ]
+
+
+def _scale(node, factor, start):
+    from openfisca_core.parameters import Parameter
+
+    if isinstance(node, Parameter):
+        value = node.values_list[-1].value
+        if isinstance(value, float):
+            node.update(start = start, value = value * factor)
+        elif isinstance(value, int) and not isinstance(value, bool):
+            node.update(start = start, value = int(round(value * factor)))
+        return
+    for child in getattr(node, 'children', {}).values():
+        _scale(child, factor, start)
+    for bracket in getattr(node, 'brackets', ()):
+        for name in ('threshold', 'amount'):
+            if hasattr(bracket, name):
+                _scale(getattr(bracket, name), factor, start)
+
+
+def test_mixed_dates_match_separate_runs():
+    import numpy as np
+    from openfisca_nsw_pdrs_tools.batch import PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.testing import generate_population
+
+    tax_benefit_system = build_tax_benefit_system(implementation_dates = True)
+    for path, start, factor in VINTAGES:
+        node = tax_benefit_system.parameters
+        for name in path.split('.'):
+            node = node.children[name]
+        _scale(node, factor, start)
+    # Snapshots taken before the new values do not have them
+    get_parameters_at_instant = tax_benefit_system.get_parameters_at_instant
+    if hasattr(get_parameters_at_instant, 'cache_clear'):
+        get_parameters_at_instant.cache_clear()
+    tax_benefit_system._parameters_at_instant_cache = {}
+
+    columns = generate_population(tax_benefit_system, 2000)
+    dates = np.array(DATES)[np.random.RandomState(0).randint(0, len(DATES), 2000)]
+    mixed = calculate_columns(tax_benefit_system, dict(columns, implementation_date = dates), PEAK_DEMAND_SAVINGS_VARIABLES)
+
+    for date in DATES:
+        rows = dates == date
+        separate = calculate_columns(tax_benefit_system, dict(columns, implementation_date = np.full(2000, date)), PEAK_DEMAND_SAVINGS_VARIABLES)
+        for name in PEAK_DEMAND_SAVINGS_VARIABLES:
+            assert mixed[name].dtype == separate[name].dtype
+            np.testing.assert_array_equal(mixed[name][rows], separate[name][rows], err_msg = '{} at {}'.format(name, date))
+
+
+def test_int_parameters_do_not_wrap_around():
+    import numpy as np
+    from openfisca_core.periods import ETERNITY
+    from openfisca_core.variables import Variable
+    from openfisca_nsw_base.entities import Building
+    from openfisca_nsw_pdrs_tools.batch import calculate_columns
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+    # Defined here rather than at module level, where the extension loader would register it
+    class peak_window_product(Variable):
+        value_type = int
+        entity = Building
+        definition_period = ETERNITY
+
+        def formula(building, period, parameters):
+            # Past the range of int16 with either version's value
+            return parameters(period).PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS * 200 * 200
+
+    tax_benefit_system = build_tax_benefit_system(implementation_dates = True)
+    tax_benefit_system.add_variable(peak_window_product)
+    hours = tax_benefit_system.parameters.PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
+    hours.update(start = '2021-01-01', value = 200)
+    hours.update(start = '2023-07-01', value = 300)
+    dates = np.array(['2022-08-15', '2024-01-01', '2022-08-15'])
+    results = calculate_columns(tax_benefit_system, {'implementation_date': dates}, ['peak_window_product'], count = 3)
+    np.testing.assert_array_equal(results['peak_window_product'], [8000000, 12000000, 8000000])
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Tests of the batch web API endpoint, run with pytest.
+
+import json
+
+
+def _reject_constant(name):
+    raise ValueError('{} is not valid JSON.'.format(name))
+
+
+def create_client():
+    import numpy as np
+    from openfisca_core.periods import ETERNITY
+    from openfisca_core.variables import Variable
+    from openfisca_nsw_base.entities import Building
+    from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+    from openfisca_nsw_pdrs_tools.web_api import create_app
+
+    # Defined here rather than at module level, where the extension loader would register it
+    class cooling_capacity_ratio(Variable):
+        value_type = float
+        entity = Building
+        definition_period = ETERNITY
+
+        def formula(building, period):
+            capacity = building('PDRS__Air_Conditioner__cooling_capacity', period)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                return capacity / capacity
+
+    tax_benefit_system = build_tax_benefit_system()
+    tax_benefit_system.add_variable(cooling_capacity_ratio)
+    return create_app(tax_benefit_system).test_client()
+
+
+def test_invalid_variables_are_bad_requests():
+    client = create_client()
+    for variables in [5, [1], [['PDRS__ROOA__peak_demand_savings']], [{'name': 'PDRS__ROOA__peak_demand_savings'}], {}]:
+        response = client.post('/calculate/batch', json = {'variables': variables, 'scenarios': [{}]})
+        assert response.status_code == 400, variables
+        assert 'error' in response.get_json()
+
+
+def test_non_finite_results_are_null():
+    client = create_client()
+    response = client.post('/calculate/batch', json = {
+        'variables': ['cooling_capacity_ratio'],
+        'scenarios': [{'PDRS__Air_Conditioner__cooling_capacity': 0}, {'PDRS__Air_Conditioner__cooling_capacity': 7.1}],
+        })
+    assert response.status_code == 200
+    body = json.loads(response.get_data(as_text = True), parse_constant = _reject_constant)
+    assert [result['cooling_capacity_ratio'] for result in body['results']] == [None, 1.0]
@@ -4,6 +4,7 @@ from openfisca_core.variables import Variable
 from openfisca_core.periods import ETERNITY
 from openfisca_core.indexed_enums import Enum
 from openfisca_nsw_base.entities import Building
+from openfisca_nsw_pdrs.lookups import enum_table
 
 class AC_Type(Enum):
     type_1 = 'Wall mounted, unitary, and double duct'
@@ -42,6 +43,9 @@ class AC_cooling_capacity(Enum):
     more_than_65="cooling capacity >= 65kW"
 
 
+# Lower bounds of the AC_cooling_capacity bands after the first one, in kW
+AC_COOLING_CAPACITY_BAND_EDGES = np.array([4, 10, 39, 65])
+
 
 class PDRS__Air_Conditioner__cooling_capacity(Variable):
     # name="Air Conditioner Cooling Capacity in kW"
@@ -99,27 +103,15 @@ class PDRS__Air_Conditioner__baseline_power_input(Variable):
 
     def formula(building, period, parameters):
         cooling_capacity = building('PDRS__Air_Conditioner__cooling_capacity', period)
-
-        cooling_capacity_enum=np.select(
-            [
-                cooling_capacity < 4,
-                (cooling_capacity < 10) & (cooling_capacity >= 4),
-                (cooling_capacity < 39) & (cooling_capacity >= 10),
-                (cooling_capacity < 65) & (cooling_capacity >= 39),
-                cooling_capacity>65
-            ],
-            [
-                AC_cooling_capacity.less_than_4,
-                AC_cooling_capacity.between_4_and_10,
-                AC_cooling_capacity.between_10_and_39,
-                AC_cooling_capacity.between_39_and_65,
-                AC_cooling_capacity.more_than_65
-            ])
-
-
         replace_or_new = building('PDRS__Appliance__installation_type', period)
         AC_type = building('PDRS__Air_Conditioner__AC_type', period)
-        baseline_unit=parameters(period).AC.AC_baseline_power_per_capacity_reference_table[replace_or_new]
-        scale = baseline_unit[AC_type]
 
-        return scale[cooling_capacity_enum]*cooling_capacity
+        # Bands include their lower bound, e.g. 4kW falls in between_4_and_10
+        cooling_capacity_band = np.searchsorted(AC_COOLING_CAPACITY_BAND_EDGES, cooling_capacity, side='right')
+
+        baseline_unit = enum_table(
+            parameters(period).AC.AC_baseline_power_per_capacity_reference_table,
+            installation_type, AC_Type, AC_cooling_capacity
+            )
+
+        return baseline_unit[replace_or_new, AC_type, cooling_capacity_band]*cooling_capacity
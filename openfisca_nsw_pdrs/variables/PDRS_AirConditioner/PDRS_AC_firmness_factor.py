@@ -20,10 +20,11 @@ class PDRS__Air_Conditioner__duration_factor(Variable):
     def formula(building, period, parameters):
         installation_purpose=building('PDRS__Appliance__installation_purpose', period)
         zone_type = building('PDRS__Appliance__zone_type', period)
-        operation_hrs = parameters(period).AC.AC_hours_of_operation_by_zone_table[zone_type]
-        ratio = parameters(period).AC.AC_peak_operation_hrs_to_all_operation_hrs_by_zone_table[zone_type]
+        params = parameters(period)
+        operation_hrs = params.AC.AC_hours_of_operation_by_zone_table[zone_type]
+        ratio = params.AC.AC_peak_operation_hrs_to_all_operation_hrs_by_zone_table[zone_type]
         weekdays_ratio = float(5/7)
-        peak_hours = parameters(period).PDRS_wide_constants.ANNUAL_PEAK_WINDOW_HOURS
+        peak_hours = params.PDRS_wide_constants.ANNUAL_PEAK_WINDOW_HOURS
 
 
         return operation_hrs[installation_purpose]*ratio[installation_purpose]*weekdays_ratio/peak_hours
@@ -43,8 +44,9 @@ class PDRS__Air_Conditioner__firmness_factor(Variable):
     def formula(building, period, parameters):
         installation_purpose=building('PDRS__Appliance__installation_purpose', period)
         zone_type = building('PDRS__Appliance__zone_type', period)
-        load_factor = parameters(period).AC.AC_load_factors_table[installation_purpose]
-        contribution_factor = parameters(period).PDRS_wide_constants.CONTRIBUTION_FACTOR
+        params = parameters(period)
+        load_factor = params.AC.AC_load_factors_table[installation_purpose]
+        contribution_factor = params.PDRS_wide_constants.CONTRIBUTION_FACTOR
         duration_factor=building('PDRS__Air_Conditioner__duration_factor', period)
 
         return contribution_factor*load_factor*duration_factor
\ No newline at end of file
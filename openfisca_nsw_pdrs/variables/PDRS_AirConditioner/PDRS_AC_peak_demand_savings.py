@@ -35,8 +35,9 @@ class PDRS__Air_Conditioner__peak_demand_savings(Variable):
         power_input = building('PDRS__Air_Conditioner__power_input', period)
         baseline_power_input = building('PDRS__Air_Conditioner__baseline_power_input', period)
         firmness_factor = building('PDRS__Air_Conditioner__firmness_factor', period)
-        daily_peak_hours = parameters(period).PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
-        forward_creation_period=parameters(period).AC.AC_related_constants.FORWARD_CREATION_PERIOD
+        params = parameters(period)
+        daily_peak_hours = params.PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
+        forward_creation_period = params.AC.AC_related_constants.FORWARD_CREATION_PERIOD
 
         diff = np.where((baseline_power_input - power_input)> 0, baseline_power_input - power_input, 0)
 
@@ -19,10 +19,11 @@ class PDRS__ROOA__peak_demand_savings(Variable):
     }
 
     def formula(building, period, parameters):
-        average_summer_demand = parameters(period).ROOA_fridge.ROOA_related_constants.AVERAGE_SUMMER_DEMAND
+        params = parameters(period)
+        average_summer_demand = params.ROOA_fridge.ROOA_related_constants.AVERAGE_SUMMER_DEMAND
         firmness_factor = building('PDRS__ROOA__firmness_factor', period)
-        daily_peak_hours = parameters(period).PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
-        forward_creation_period=parameters(period).ROOA_fridge.ROOA_related_constants.FORWARD_CREATION_PERIOD
+        daily_peak_hours = params.PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
+        forward_creation_period = params.ROOA_fridge.ROOA_related_constants.FORWARD_CREATION_PERIOD
 
 
         return average_summer_demand*firmness_factor*daily_peak_hours*forward_creation_period
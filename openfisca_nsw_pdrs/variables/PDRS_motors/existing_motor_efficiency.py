@@ -4,6 +4,7 @@ from openfisca_core.periods import ETERNITY
 from openfisca_core.indexed_enums import Enum
 from openfisca_nsw_base.entities import Building
 from openfisca_core.parameters import load_parameter_file
+from openfisca_nsw_pdrs.lookups import stacked_scale
 
 class motor_poles_number(Enum):
     poles_2="poles_2"
@@ -64,22 +65,12 @@ class PDRS__motors__baseline_motor_efficiency(Variable):
 
         node = parameters(period).motors.motors_baseline_efficiency_table
 
-        # Here we fetch value for each "pole_#" node
-        # NOTE - this is a hacky workaround required because 'fancy indexing' doesn't work on SingleAmountTaxScales
+        # The four "poles_#" scales are stacked so that each row is interpolated against the
+        # scale of its own number of poles only, in a single vectorised pass.
+        # NOTE - 'fancy indexing' doesn't work on SingleAmountTaxScales, hence the stacked scale
         # See more at <https://openfisca.org/doc/coding-the-legislation/legislation_parameters#computing-a-parameter-that-depends-on-a-variable-fancy-indexing>
-
-        # NOTE (Ram) - The `interpolate=True` keyword argument is functionality I've newly added to openfisca-core
-        poles_2_value = node["poles_2"].rated_output.calc(rated_output, interpolate=True)
-        poles_4_value = node["poles_4"].rated_output.calc(rated_output, interpolate=True)
-        poles_6_value = node["poles_6"].rated_output.calc(rated_output, interpolate=True)
-        poles_8_value = node["poles_8"].rated_output.calc(rated_output, interpolate=True)
-
-        baseline_motor_efficiency = np.select([poles == PDRS__motors__number_of_poles.possible_values.poles_2,
-                          poles == PDRS__motors__number_of_poles.possible_values.poles_4,
-                          poles == PDRS__motors__number_of_poles.possible_values.poles_6,
-                          poles == PDRS__motors__number_of_poles.possible_values.poles_8,
-                         ],
-                         [poles_2_value, poles_4_value, poles_6_value, poles_8_value], 0)
+        scales = stacked_scale(node, motor_poles_number, 'rated_output')
+        baseline_motor_efficiency = scales.calc(poles, rated_output, interpolate=True)
 
         return baseline_motor_efficiency
 
@@ -38,8 +38,9 @@ class PDRS__motors__firmness_factor(Variable):
     }
 
     def formula(building, period, parameters):
-        contribution_factor = parameters(period).PDRS_wide_constants.CONTRIBUTION_FACTOR
+        params = parameters(period)
+        contribution_factor = params.PDRS_wide_constants.CONTRIBUTION_FACTOR
         motor_type=building('PDRS__motors__motor_type', period)
-        load_factor = parameters(period).motors.motors_load_factor_table[motor_type]
-        duration_factor = parameters(period).motors.motors_duration_factor_table[motor_type]
+        load_factor = params.motors.motors_load_factor_table[motor_type]
+        duration_factor = params.motors.motors_duration_factor_table[motor_type]
         return duration_factor*load_factor*contribution_factor
\ No newline at end of file
@@ -51,8 +51,9 @@ class PDRS__motors__peak_demand_savings(Variable):
         new_efficiency = building('PDRS__motors__new_efficiency', period)
         existing_efficiency = building('PDRS__motors__existing_motor_efficiency', period)
         firmness = building('PDRS__motors__firmness_factor', period)
-        daily_window = parameters(period).PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
-        asset_life_table=parameters(period).motors.motors_asset_life_table
+        params = parameters(period)
+        daily_window = params.PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS
+        asset_life_table = params.motors.motors_asset_life_table
         forward_creation_period=asset_life_table.calc(rated_output, right=False)
        
 
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+# Bulk calculation tools for the PDRS extension: batch files, aggregation, services,
+# test runner and performance options. They are kept out of the `openfisca_nsw_pdrs`
+# directory, as OpenFisca runs every module under an extension's directory when loading it.
+
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system  # noqa: F401
+from openfisca_nsw_pdrs_tools.batch import calculate_batch  # noqa: F401
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+# This file rolls PDRS results of a whole portfolio up into grouped totals.
+#
+# An `Aggregator` is fed chunk after chunk of inputs and calculated results, and keeps
+# only per-group totals: rows, sums and rows with savings of each variable, and optional
+# histograms. Groups are the distinct combinations of key columns, typically enum inputs
+# such as the zone or the installation purpose, so memory use depends on the number of
+# groups, not of rows. `aggregate_file` streams an input file through the batch
+# calculator into an aggregator and writes one row per group:
+#
+#     openfisca-pdrs-aggregate portfolio.csv totals.csv --group-by PDRS__Appliance__zone_type
+#
+# Each PDRS activity has its own peak demand savings variable. A portfolio mixes rows of
+# several activities, named by the `activity` column (or `--activity` for a file of a
+# single activity): each row only counts towards the savings variable of its own
+# activity, so the default variables give the totals of each activity, and `total__sum`
+# their certificate roll-up.
+
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core.indexed_enums import Enum, EnumArray
+
+from openfisca_nsw_pdrs_tools.batch import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_PERIOD,
+    PEAK_DEMAND_SAVINGS_VARIABLES,
+    BatchStats,
+    calculate_chunks,
+    read_chunks,
+    to_input_array,
+    unique_rows,
+    )
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+from openfisca_nsw_pdrs_tools.timeline import IMPLEMENTATION_DATE_COLUMN
+
+log = logging.getLogger(__name__)
+
+# Column naming the activity of each row, one of `ACTIVITIES`
+ACTIVITY_COLUMN = 'activity'
+
+# Peak demand savings variable of each activity
+ACTIVITIES = OrderedDict([
+    ('Air_Conditioner', 'PDRS__Air_Conditioner__peak_demand_savings'),
+    ('motors', 'PDRS__motors__peak_demand_savings'),
+    ('ROOA', 'PDRS__ROOA__peak_demand_savings'),
+    ])
+
+DEFAULT_KEYS = [
+    ACTIVITY_COLUMN,
+    'PDRS__Appliance__zone_type',
+    'PDRS__Appliance__installation_purpose',
+    'PDRS__Air_Conditioner__AC_type',
+    'PDRS__motors__motor_type',
+    ]
+
+
+class Aggregator(object):
+    """Grouped sums, counts and histograms of `variables`, by distinct values of `keys`.
+
+    `keys` are input columns, or variables whose values are read from the results. Rows
+    missing a key input take its default value. With `bins` (a list of bin edges), a
+    histogram of each variable is kept per group, with an underflow and an overflow bin.
+
+    The savings variable of an activity (see `ACTIVITIES`) only counts the rows of that
+    activity, read from the `ACTIVITY_COLUMN` column, or `activity` for chunks without it.
+    """
+
+    def __init__(self, tax_benefit_system, keys = DEFAULT_KEYS, variables = PEAK_DEMAND_SAVINGS_VARIABLES, bins = None,
+            activity = None):
+        if activity is not None and activity not in ACTIVITIES:
+            raise ValueError("Unknown activity '{}': expected one of {}.".format(activity, ', '.join(ACTIVITIES)))
+        self.tax_benefit_system = tax_benefit_system
+        self.keys = list(keys)
+        self.variables = list(variables)
+        self.activity = activity
+        self.bins = None if bins is None else np.asarray(sorted(bins), dtype = float)
+        self.groups = []
+        self._group_ids = {}
+        self.rows = np.zeros(0, dtype = np.int64)
+        self.sums = dict((name, np.zeros(0)) for name in self.variables)
+        self.nonzero = dict((name, np.zeros(0, dtype = np.int64)) for name in self.variables)
+        self.histograms = dict((name, np.zeros((0, self._bin_count()), dtype = np.int64)) for name in self.variables)
+
+    def _bin_count(self):
+        return 0 if self.bins is None else len(self.bins) + 1
+
+    def add(self, columns, results):
+        """Add a chunk of input `columns` and their calculated `results`."""
+        count = len(np.asarray(results[self.variables[0]]))
+        activities = None
+        if ACTIVITY_COLUMN in self.keys or any(name in ACTIVITIES.values() for name in self.variables):
+            activities = self._activities(columns, count)
+        labels = [
+            activities if key == ACTIVITY_COLUMN else self._labels(key, columns, results, count)
+            for key in self.keys
+            ]
+        local_groups, group_ids = _group(labels, count)
+        ids = np.array([self._group_id(group) for group in local_groups], dtype = np.int64)
+        self._grow(len(self.groups))
+
+        local_count = len(local_groups)
+        np.add.at(self.rows, ids, np.bincount(group_ids, minlength = local_count))
+        activity_of = dict((name, activity) for activity, name in ACTIVITIES.items())
+        for name in self.variables:
+            values = np.asarray(results[name], dtype = float)
+            counted = None
+            if name in activity_of:
+                # The other rows' values of this variable are meaningless: count them as 0
+                counted = activities == activity_of[name]
+                values = np.where(counted, values, 0)
+            np.add.at(self.sums[name], ids, np.bincount(group_ids, weights = values, minlength = local_count))
+            np.add.at(self.nonzero[name], ids, np.bincount(group_ids, weights = values != 0, minlength = local_count).astype(np.int64))
+            if self.bins is not None:
+                bin_count = self._bin_count()
+                cells = group_ids * bin_count + np.searchsorted(self.bins, values, side = 'right')
+                counts = np.bincount(cells, weights = counted, minlength = local_count * bin_count)
+                np.add.at(self.histograms[name], ids, counts.astype(np.int64).reshape(local_count, bin_count))
+
+    def _activities(self, columns, count):
+        values = columns.get(ACTIVITY_COLUMN)
+        if values is None:
+            if self.activity is None:
+                raise ValueError("The input has no '{}' column naming the activity of each row, among {}.".format(
+                    ACTIVITY_COLUMN, ', '.join(ACTIVITIES)))
+            return np.full(count, self.activity)
+        values = np.asarray(values).astype(str)
+        unknown = set(np.unique(values)) - set(ACTIVITIES)
+        if unknown:
+            raise ValueError("Unknown activities in the '{}' column: {}. Expected one of {}.".format(
+                ACTIVITY_COLUMN, ', '.join(sorted(unknown)), ', '.join(ACTIVITIES)))
+        return values
+
+    def _labels(self, key, columns, results, count):
+        values = results.get(key) if key in results else columns.get(key)
+        variable = self.tax_benefit_system.variables.get(key)
+        if values is None:
+            if variable is None:
+                raise ValueError("Unknown group key '{}'.".format(key))
+            default = variable.default_value
+            return np.full(count, default.name if variable.value_type == Enum else str(default))
+        if variable is not None and not isinstance(values, EnumArray):
+            values = to_input_array(variable, values)
+        if isinstance(values, EnumArray):
+            return values.decode_to_str()
+        return np.asarray(values).astype(str)
+
+    def _group_id(self, group):
+        group_id = self._group_ids.get(group)
+        if group_id is None:
+            group_id = self._group_ids[group] = len(self.groups)
+            self.groups.append(group)
+        return group_id
+
+    def _grow(self, size):
+        extra = size - len(self.rows)
+        if extra <= 0:
+            return
+        self.rows = np.concatenate([self.rows, np.zeros(extra, dtype = np.int64)])
+        for name in self.variables:
+            self.sums[name] = np.concatenate([self.sums[name], np.zeros(extra)])
+            self.nonzero[name] = np.concatenate([self.nonzero[name], np.zeros(extra, dtype = np.int64)])
+            self.histograms[name] = np.concatenate([self.histograms[name], np.zeros((extra, self._bin_count()), dtype = np.int64)])
+
+    def to_rows(self):
+        """Return one `OrderedDict` per group: its keys, rows, and sums of each variable, sorted by keys."""
+        table = []
+        for index in sorted(range(len(self.groups)), key = lambda index: self.groups[index]):
+            row = OrderedDict(zip(self.keys, self.groups[index]))
+            row['rows'] = int(self.rows[index])
+            total = 0.0
+            for name in self.variables:
+                row[name + '__sum'] = float(self.sums[name][index])
+                row[name + '__nonzero'] = int(self.nonzero[name][index])
+                total += self.sums[name][index]
+            row['total__sum'] = float(total)
+            table.append(row)
+        return table
+
+    def histograms_to_dict(self):
+        """Return the bin edges, and the histogram of each variable in each group."""
+        if self.bins is None:
+            return None
+        return OrderedDict([
+            ('bins', self.bins.tolist()),
+            ('groups', [
+                OrderedDict([
+                    ('keys', OrderedDict(zip(self.keys, self.groups[index]))),
+                    ('histograms', OrderedDict((name, self.histograms[name][index].tolist()) for name in self.variables)),
+                    ])
+                for index in sorted(range(len(self.groups)), key = lambda index: self.groups[index])
+                ]),
+            ])
+
+
+def _group(labels, count):
+    """Return the distinct tuples of `labels` columns, and each row's index among them."""
+    columns = dict(enumerate(labels))
+    indices, group_ids = unique_rows(columns, list(columns), count)
+    return [tuple(str(column[index]) for column in labels) for index in indices], group_ids
+
+
+def aggregate_file(input_path, output_path, keys = DEFAULT_KEYS, variables = None, period = DEFAULT_PERIOD,
+        chunk_size = DEFAULT_CHUNK_SIZE, bins = None, histograms_path = None, tax_benefit_system = None,
+        workers = 1, system_options = None, deduplicate = False, trace_memory = False, registry = None,
+        activity = None):
+    """Calculate `variables` for every row of `input_path` and write their totals by `keys` to `output_path`.
+
+    The per-row results are never written nor kept: each chunk is added to an `Aggregator`
+    and dropped. With `bins` and `histograms_path`, histograms are written there as JSON.
+    `activity` is the activity of every row of an input without an `ACTIVITY_COLUMN`.
+    See `calculate_batch` for the other options. Returns `(aggregator, stats)`.
+    """
+    system_options = system_options or {}
+    if tax_benefit_system is None:
+        tax_benefit_system = build_tax_benefit_system(**system_options)
+    variables = list(variables or PEAK_DEMAND_SAVINGS_VARIABLES)
+    aggregator = Aggregator(tax_benefit_system, keys, variables, bins, activity)
+
+    stats = BatchStats()
+    start = time.time()
+    chunks = read_chunks(input_path, chunk_size, tax_benefit_system)
+    if registry is not None:
+        chunks = registry.resolve_chunks(tax_benefit_system, chunks)
+    for columns, results, evaluated_rows, peak_memory in calculate_chunks(
+            tax_benefit_system, chunks, variables, period, workers, system_options, deduplicate, trace_memory):
+        aggregator.add(columns, results)
+        stats.add_chunk(len(next(iter(columns.values()))), evaluated_rows, peak_memory)
+        log.info('Chunk %d done: %d rows in %.1fs.', stats.chunks, stats.rows, time.time() - start)
+    stats.seconds = time.time() - start
+
+    rows = aggregator.to_rows()
+    with open(output_path, 'w', newline = '') as output_file:
+        writer = csv.writer(output_file)
+        if rows:
+            writer.writerow(list(rows[0].keys()))
+            writer.writerows(list(row.values()) for row in rows)
+    if histograms_path is not None and bins is not None:
+        with open(histograms_path, 'w') as histograms_file:
+            json.dump(aggregator.histograms_to_dict(), histograms_file, indent = 2)
+    return aggregator, stats
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description = 'Calculate PDRS totals by group for a file of installations.')
+    parser.add_argument('input', help = 'CSV, Parquet, Arrow or Feather file with one column per input variable, '
+        'or directory of one .npy file per input variable')
+    parser.add_argument('output', help = 'CSV file to write one row per group to')
+    parser.add_argument('-g', '--group-by', nargs = '*', default = DEFAULT_KEYS,
+        help = 'input columns to group by (default: activity, zone, installation purpose, AC type and motor type)')
+    parser.add_argument('-a', '--activity', choices = list(ACTIVITIES), default = None,
+        help = "activity of every row, for inputs without an '{}' column".format(ACTIVITY_COLUMN))
+    parser.add_argument('-v', '--variables', nargs = '+', default = None,
+        help = 'variables to total (default: the PDRS peak demand savings of every activity)')
+    parser.add_argument('-p', '--period', default = DEFAULT_PERIOD, help = 'period to calculate (default: %(default)s)')
+    parser.add_argument('-c', '--chunk-size', type = int, default = DEFAULT_CHUNK_SIZE,
+        help = 'rows per simulation (default: %(default)s)')
+    parser.add_argument('--bins', nargs = '+', type = float, default = None, help = 'histogram bin edges')
+    parser.add_argument('--histograms', default = None, help = 'JSON file to write the histograms to')
+    parser.add_argument('-j', '--workers', type = int, default = 1,
+        help = 'number of worker processes (default: %(default)s)')
+    parser.add_argument('--cache-dir', default = None,
+        help = 'directory caching the parsed parameters between runs (default: $OPENFISCA_NSW_PDRS_CACHE_DIR)')
+    parser.add_argument('--fold-constants', action = 'store_true',
+        help = 'compute variables depending only on parameters and enum inputs once per combination of inputs')
+    parser.add_argument('--dedup', action = 'store_true',
+        help = 'only simulate the distinct rows of each chunk')
+    parser.add_argument('--compact', action = 'store_true',
+        help = 'store enums on one byte and drop intermediate variables as soon as they are no longer needed')
+    parser.add_argument('--compile', action = 'store_true',
+        help = 'run the formulas of each variable and of everything it reads as one compiled kernel')
+    parser.add_argument('--trace-memory', action = 'store_true',
+        help = 'measure the peak memory used to calculate each chunk, and report it per row')
+    parser.add_argument('--implementation-dates', action = 'store_true',
+        help = "read each row's parameters at the date of its {} column, instead of at the period".format(IMPLEMENTATION_DATE_COLUMN))
+    parser.add_argument('--registry', default = None, metavar = 'REGISTER',
+        help = "GEMS register export (CSV, Parquet, Arrow or Feather) to read the inputs of each row's brand and model from")
+    parser.add_argument('--registry-index', default = None, metavar = 'DIR',
+        help = 'directory to save the indexed register to, and to read it from while the export is unchanged')
+    return parser
+
+
+def main(argv = None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    system_options = {'cache_dir': args.cache_dir, 'fold_constants': args.fold_constants, 'compact': args.compact,
+        'compile_formulas': args.compile, 'implementation_dates': args.implementation_dates}
+    tax_benefit_system = None
+    registry = None
+    if args.registry:
+        tax_benefit_system = build_tax_benefit_system(**system_options)
+        # Imported here, as in `batch.main`: the registry is only needed with --registry
+        from openfisca_nsw_pdrs_tools.gems_registry import ProductRegistry
+        registry = ProductRegistry.load(tax_benefit_system, args.registry, args.registry_index)
+    aggregator, stats = aggregate_file(
+        args.input,
+        args.output,
+        keys = args.group_by,
+        variables = args.variables,
+        period = args.period,
+        chunk_size = args.chunk_size,
+        bins = args.bins,
+        histograms_path = args.histograms,
+        tax_benefit_system = tax_benefit_system,
+        workers = args.workers,
+        system_options = system_options,
+        deduplicate = args.dedup,
+        trace_memory = args.trace_memory,
+        registry = registry,
+        activity = args.activity,
+        )
+    log.info('Aggregated %d rows into %d groups in %.1fs (%.0f rows/s).',
+        stats.rows, len(aggregator.groups), stats.seconds, stats.rows_per_second)
+    if args.trace_memory:
+        log.info('Peak memory: %.0f bytes per row (%.1f MB for a chunk of %d rows).',
+            stats.peak_memory_per_row, stats.peak_memory / 1e6, stats.peak_memory_rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,652 @@
+# -*- coding: utf-8 -*-
+
+# This file streams large PDRS activity files through vectorised simulations.
+#
+# An input file holds one row per installation and one column per input variable
+# (e.g. `PDRS__Air_Conditioner__cooling_capacity`). It is read in fixed-size chunks,
+# one `Building` simulation is built per chunk, and the requested output variables are
+# appended to the output file before the next chunk is read, so memory use is bounded
+# by the chunk size rather than by the file size.
+#
+# Arrow IPC and Feather files, and directories of `.npy` files, are memory-mapped: their
+# numeric columns are passed to the simulation as views of the file, without copies.
+
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import weakref
+from collections import OrderedDict, deque
+from datetime import date
+
+import numpy as np
+
+from openfisca_core.indexed_enums import Enum, EnumArray
+from openfisca_core.simulation_builder import SimulationBuilder
+
+from openfisca_nsw_pdrs_tools.compact import calculate_evicting, is_compact, traced_peak_memory
+from openfisca_nsw_pdrs_tools.dependencies import closure, dependency_graph
+from openfisca_nsw_pdrs_tools.profiling import profile
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+from openfisca_nsw_pdrs_tools.timeline import IMPLEMENTATION_DATE_COLUMN, TimelineOverlay, uses_implementation_dates
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PERIOD = '2021'
+DEFAULT_CHUNK_SIZE = 100000
+
+PEAK_DEMAND_SAVINGS_VARIABLES = [
+    'PDRS__Air_Conditioner__peak_demand_savings',
+    'PDRS__motors__peak_demand_savings',
+    'PDRS__ROOA__peak_demand_savings',
+    ]
+
+TRUE_STRINGS = ['true', '1', 'yes']
+
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+
+class BatchStats(object):
+    """Counters collected while running a batch calculation."""
+
+    def __init__(self):
+        self.rows = 0
+        self.evaluated_rows = 0
+        self.chunks = 0
+        self.seconds = 0.0
+        self.peak_memory = 0
+        self.peak_memory_rows = 0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def dedup_ratio(self):
+        """Rows read per row actually simulated: above 1 when duplicate rows were collapsed."""
+        return self.rows / self.evaluated_rows if self.evaluated_rows else 1.0
+
+    @property
+    def peak_memory_per_row(self):
+        """Peak memory allocated to calculate a chunk, per row of that chunk, if traced."""
+        return self.peak_memory / self.peak_memory_rows if self.peak_memory_rows else 0.0
+
+    def add_chunk(self, rows, evaluated_rows, peak_memory = None):
+        self.rows += rows
+        self.evaluated_rows += evaluated_rows
+        self.chunks += 1
+        if peak_memory is not None and peak_memory > self.peak_memory:
+            self.peak_memory = peak_memory
+            self.peak_memory_rows = rows
+
+    def __repr__(self):
+        return '<BatchStats rows={} evaluated_rows={} chunks={} seconds={:.3f} rows_per_second={:.0f}>'.format(
+            self.rows, self.evaluated_rows, self.chunks, self.seconds, self.rows_per_second)
+
+
+# ----- Reading inputs ----- #
+
+def read_chunks(path, chunk_size = DEFAULT_CHUNK_SIZE, tax_benefit_system = None):
+    """Yield the rows of an input file as dicts of column name -> numpy array.
+
+    `path` is a CSV, Parquet, Arrow IPC or Feather file, or a directory holding one `.npy`
+    file per column. With `tax_benefit_system`, dictionary-encoded Arrow columns of enum
+    variables are read as `EnumArray`s (see `arrow_columns`).
+    """
+    if os.path.isdir(path):
+        return _read_npy_chunks(path, chunk_size)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return _read_csv_chunks(path, chunk_size)
+    if extension in ('.parquet', '.pq'):
+        return _read_parquet_chunks(path, chunk_size, tax_benefit_system)
+    if extension in ARROW_EXTENSIONS:
+        return _read_arrow_chunks(path, chunk_size, tax_benefit_system)
+    raise ValueError("Unsupported input file '{}': expected a .csv, .parquet, {} file or a directory of .npy files.".format(
+        path, ', '.join(ARROW_EXTENSIONS)))
+
+
+def _read_csv_chunks(path, chunk_size):
+    with open(path, newline = '') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield _csv_rows_to_columns(header, rows)
+                rows = []
+        if rows:
+            yield _csv_rows_to_columns(header, rows)
+
+
+def _csv_rows_to_columns(header, rows):
+    return OrderedDict(
+        (name, np.array(values))
+        for name, values in zip(header, zip(*rows))
+        )
+
+
+def _read_parquet_chunks(path, chunk_size, tax_benefit_system):
+    parquet = _import_pyarrow_parquet()
+    parquet_file = parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size = chunk_size):
+        yield arrow_columns(batch, tax_benefit_system)
+
+
+def _read_arrow_chunks(path, chunk_size, tax_benefit_system):
+    feather = _import_pyarrow_feather()
+    # Uncompressed files are memory-mapped, and their batches sliced without copies
+    table = feather.read_table(path, memory_map = True)
+    for batch in table.to_batches(max_chunksize = chunk_size):
+        yield arrow_columns(batch, tax_benefit_system)
+
+
+def _read_npy_chunks(path, chunk_size):
+    columns = OrderedDict(
+        (file_name[:-len('.npy')], np.load(os.path.join(path, file_name), mmap_mode = 'r'))
+        for file_name in sorted(os.listdir(path))
+        if file_name.endswith('.npy')
+        )
+    if not columns:
+        raise ValueError("No .npy file in '{}'.".format(path))
+    count = len(next(iter(columns.values())))
+    lengths = set(len(values) for values in columns.values())
+    if len(lengths) > 1:
+        raise ValueError("The .npy files of '{}' have different lengths: {}.".format(path, sorted(lengths)))
+    for start in range(0, count, chunk_size):
+        yield OrderedDict((name, values[start:start + chunk_size]) for name, values in columns.items())
+
+
+def _import_pyarrow_parquet():
+    # pyarrow is an optional dependency: it is only needed to read or write Parquet files.
+    try:
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise ImportError("Parquet files require pyarrow. Install it with `pip install openfisca_nsw_pdrs[parquet]`.")
+    return parquet
+
+
+def _import_pyarrow_feather():
+    try:
+        import pyarrow.feather as feather
+    except ImportError:
+        raise ImportError("Arrow and Feather files require pyarrow. Install it with `pip install openfisca_nsw_pdrs[parquet]`.")
+    return feather
+
+
+def arrow_columns(batch, tax_benefit_system = None):
+    """Return the columns of an Arrow record batch or table as a dict of column name -> numpy array.
+
+    Numeric columns without missing values are views of the Arrow buffers, not copies.
+    With `tax_benefit_system`, dictionary-encoded columns of enum variables are converted
+    to `EnumArray`s by looking up their indices in a table of the enum index of each
+    dictionary entry, so that enum names are parsed once per dictionary entry rather
+    than once per row. Other dictionary-encoded columns are decoded.
+    """
+    columns = OrderedDict()
+    for name, column in zip(batch.schema.names, batch.columns):
+        variable = None if tax_benefit_system is None else tax_benefit_system.variables.get(name)
+        columns[name] = _arrow_to_numpy(column, variable)
+    return columns
+
+
+def _arrow_to_numpy(array, variable):
+    import pyarrow
+
+    if isinstance(array, pyarrow.ChunkedArray):
+        array = array.combine_chunks()
+    if pyarrow.types.is_dictionary(array.type):
+        if variable is not None and variable.value_type == Enum:
+            table = enum_code_table(variable, array.dictionary.to_numpy(zero_copy_only = False))
+            # Missing values point past the dictionary, to the default value
+            indices = array.indices.fill_null(len(array.dictionary)).to_numpy(zero_copy_only = False)
+            return EnumArray(table[indices], variable.possible_values)
+        array = array.dictionary_decode()
+    if variable is not None and array.null_count:
+        # As empty CSV cells, missing values take the default value
+        array = array.fill_null(_null_fill_value(variable, array.type))
+    return array.to_numpy(zero_copy_only = False)
+
+
+def _null_fill_value(variable, arrow_type):
+    import pyarrow
+
+    default = variable.default_value
+    if variable.value_type == Enum:
+        return default.index if pyarrow.types.is_integer(arrow_type) else default.name
+    if pyarrow.types.is_string(arrow_type) or pyarrow.types.is_large_string(arrow_type):
+        return str(default)
+    return default
+
+
+def enum_code_table(variable, names):
+    """Return the enum index of each of `names` for the enum `variable`, then the index of its default value.
+
+    Empty names take the default value.
+    """
+    names = to_input_array(variable, np.asarray(names).astype(str))
+    members = variable.possible_values.__members__
+    unknown = sorted(set(names) - set(members))
+    if unknown:
+        raise ValueError("Unknown values {} for '{}'.".format(', '.join(unknown), variable.name))
+    indices = [members[name].index for name in names] + [variable.default_value.index]
+    return np.array(indices, dtype = variable.dtype)
+
+
+def to_input_array(variable, values):
+    """Convert a raw input column into an array OpenFisca accepts for `variable`.
+
+    CSV columns arrive as strings: empty cells take the variable default value, and enum
+    columns are kept as names (e.g. `type_1`), which OpenFisca encodes itself. Integer
+    enum columns, e.g. `EnumArray`s or `.npy` files of indices, hold enum indices. In
+    object columns, missing values (`None`) are empty cells.
+    """
+    values = np.asarray(values)
+    if variable.value_type == Enum and values.dtype.kind in ('i', 'u'):
+        if len(values) and (values.min() < 0 or values.max() >= len(variable.possible_values)):
+            raise ValueError("Enum indices of '{}' must be between 0 and {}.".format(variable.name, len(variable.possible_values) - 1))
+        return EnumArray(values.astype(variable.dtype, copy = False), variable.possible_values)
+    if values.dtype.kind == 'O':
+        values = np.where(np.equal(values, None), '', values).astype(str)
+    if values.dtype.kind not in ('U', 'S'):
+        return values
+
+    missing = values == ''
+    if missing.any():
+        default = variable.default_value
+        values = np.where(missing, default.name if variable.value_type == Enum else str(default), values)
+
+    if variable.value_type in (Enum, str):
+        return values
+    if variable.value_type == bool:
+        return np.isin(np.char.lower(values), TRUE_STRINGS)
+    if variable.value_type == date:
+        return values.astype('datetime64[D]')
+    return values.astype(variable.dtype)
+
+
+# ----- Calculating ----- #
+
+def build_simulation(tax_benefit_system, columns, period = DEFAULT_PERIOD, count = None):
+    """Build one simulation with one `Building` per row of `columns`.
+
+    Columns which are not variables of `tax_benefit_system` are ignored. `count` is only
+    needed when `columns` is empty. If the system uses implementation dates (see
+    `timeline`), each row reads the parameters in force at the date of its
+    `implementation_date` column.
+    """
+    if count is None:
+        count = len(next(iter(columns.values())))
+    simulation = SimulationBuilder().build_default_simulation(tax_benefit_system, count)
+    for name, values in columns.items():
+        variable = tax_benefit_system.variables.get(name)
+        if variable is not None:
+            simulation.set_input(name, period, to_input_array(variable, values))
+    if uses_implementation_dates(tax_benefit_system):
+        if IMPLEMENTATION_DATE_COLUMN not in columns:
+            raise ValueError("Implementation dates are on, but the input has no '{}' column.".format(IMPLEMENTATION_DATE_COLUMN))
+        simulation.tax_benefit_system = TimelineOverlay(tax_benefit_system, columns[IMPLEMENTATION_DATE_COLUMN])
+    return simulation
+
+
+def to_output_array(value):
+    if isinstance(value, EnumArray):
+        return value.decode_to_str()
+    return value
+
+
+def calculate_columns(tax_benefit_system, columns, variables, period = DEFAULT_PERIOD, count = None):
+    """Calculate `variables` for every row of `columns` in a single vectorised simulation.
+
+    With a compact system (see `compact`), intermediate variables are evicted from the
+    simulation as soon as they are no longer needed.
+    """
+    simulation = build_simulation(tax_benefit_system, columns, period, count)
+    if is_compact(tax_benefit_system):
+        values = calculate_evicting(simulation, variables, period)
+    else:
+        values = OrderedDict((name, simulation.calculate(name, period)) for name in variables)
+    return OrderedDict((name, to_output_array(value)) for name, value in values.items())
+
+
+def calculate_chunk(tax_benefit_system, columns, variables, period = DEFAULT_PERIOD, deduplicate = False,
+        trace_memory = False):
+    """Calculate `variables` for every row of `columns`.
+
+    Returns `(results, evaluated_rows, peak_memory)`. With `deduplicate`, rows are first
+    collapsed to their distinct values of the input columns `variables` depend on (see
+    `deduplication_keys`): only these rows are simulated, and their results are copied
+    back to every row sharing them. `evaluated_rows` is the number of rows simulated.
+    With `trace_memory`, `peak_memory` is the peak memory in bytes allocated by the
+    calculation (see `compact.traced_peak_memory`), otherwise None.
+    """
+    if trace_memory:
+        (results, evaluated_rows), peak_memory = traced_peak_memory(
+            _calculate_chunk, tax_benefit_system, columns, variables, period, deduplicate)
+        return results, evaluated_rows, peak_memory
+    return _calculate_chunk(tax_benefit_system, columns, variables, period, deduplicate) + (None,)
+
+
+def _calculate_chunk(tax_benefit_system, columns, variables, period, deduplicate):
+    count = len(next(iter(columns.values())))
+    keys = deduplication_keys(tax_benefit_system, variables, columns) if deduplicate else None
+    if keys is None:
+        return calculate_columns(tax_benefit_system, columns, variables, period), count
+
+    indices, inverse = unique_rows(columns, keys, count)
+    unique_columns = OrderedDict((name, np.asarray(columns[name])[indices]) for name in keys)
+    results = calculate_columns(tax_benefit_system, unique_columns, variables, period, count = len(indices))
+    return OrderedDict((name, np.take(values, inverse)) for name, values in results.items()), len(indices)
+
+
+# ----- Deduplicating rows ----- #
+
+# Variables read by each list of output variables, per tax and benefit system
+_dependency_closures = weakref.WeakKeyDictionary()
+
+
+def deduplication_keys(tax_benefit_system, variables, columns):
+    """Return the names of the `columns` which `variables` depend on, directly or not.
+
+    Two rows with the same values in these columns get the same results. Returns None if
+    a formula cannot be analysed (see `dependencies`), in which case every column may matter.
+    If the system uses implementation dates (see `timeline`), their column is a key too.
+    """
+    closures = _dependency_closures.setdefault(tax_benefit_system, {})
+    key = tuple(variables)
+    if key not in closures:
+        graph = dependency_graph(tax_benefit_system, variables)
+        opaque = any(dependencies.opaque for dependencies in graph.values())
+        closures[key] = None if opaque else closure(graph, variables)
+    read = closures[key]
+    if read is None:
+        return None
+    dated = uses_implementation_dates(tax_benefit_system)
+    return [name for name in columns if name in read or (dated and name == IMPLEMENTATION_DATE_COLUMN)]
+
+
+def unique_rows(columns, names, count):
+    """Return `(indices, inverse)` for the distinct tuples of values of `columns[names]`.
+
+    `indices` holds the first row of each distinct tuple, and `inverse` the position in
+    `indices` of each row's tuple.
+    """
+    codes = np.zeros(count, dtype = np.int64)
+    size = 1
+    for name in names:
+        distinct, inverse = factorise(columns[name])
+        codes = codes * distinct + inverse
+        size *= distinct
+        if size > count:
+            # Renumber the tuples seen so far, so that codes cannot overflow
+            _, codes = np.unique(codes, return_inverse = True)
+            codes = codes.reshape(-1).astype(np.int64)
+            size = int(codes.max()) + 1
+    _, indices, inverse = np.unique(codes, return_index = True, return_inverse = True)
+    return indices, inverse.reshape(-1)
+
+
+def factorise(values):
+    """Return `(distinct, codes)`: the number of distinct `values`, and the code of each value among them.
+
+    Object columns, e.g. strings with missing values (`None`) read from Arrow, cannot be
+    sorted: their values are numbered in order of appearance instead.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'O':
+        numbers = {}
+        codes = np.fromiter((numbers.setdefault(value, len(numbers)) for value in values), dtype = np.int64, count = len(values))
+        return len(numbers), codes
+    distinct, inverse = np.unique(values, return_inverse = True)
+    return len(distinct), inverse.reshape(-1).astype(np.int64)
+
+
+# ----- Parallel calculation ----- #
+
+# Tax and benefit system of a worker process, built once when the worker starts.
+_worker_tax_benefit_system = None
+
+
+def _init_worker(system_options):
+    global _worker_tax_benefit_system
+    if _worker_tax_benefit_system is None:
+        _worker_tax_benefit_system = build_tax_benefit_system(**system_options)
+
+
+def _calculate_chunk_in_worker(columns, variables, period, deduplicate, trace_memory):
+    return calculate_chunk(_worker_tax_benefit_system, columns, variables, period, deduplicate, trace_memory)
+
+
+def calculate_chunks(tax_benefit_system, chunks, variables, period = DEFAULT_PERIOD, workers = 1,
+        system_options = None, deduplicate = False, trace_memory = False):
+    """Yield `(columns, results, evaluated_rows, peak_memory)` for each chunk of `chunks`, in input order.
+
+    With several `workers`, chunks are sharded across a pool of processes which each hold
+    their own tax and benefit system, built with `system_options` when it cannot be
+    inherited from the current process. At most two chunks per worker are in flight, so
+    memory stays bounded, and results are yielded in input order, so the output is the
+    same as with a single process. See `calculate_chunk` for `deduplicate` and `trace_memory`.
+    """
+    if workers <= 1:
+        for columns in chunks:
+            yield (columns,) + calculate_chunk(tax_benefit_system, columns, variables, period, deduplicate, trace_memory)
+        return
+
+    global _worker_tax_benefit_system
+    # Forked workers inherit the system already built here instead of building their own.
+    previous, _worker_tax_benefit_system = _worker_tax_benefit_system, tax_benefit_system
+    try:
+        pool = multiprocessing.Pool(workers, initializer = _init_worker, initargs = (system_options or {},))
+    finally:
+        _worker_tax_benefit_system = previous
+
+    pending = deque()
+    try:
+        for columns in chunks:
+            arguments = (columns, variables, period, deduplicate, trace_memory)
+            pending.append((columns, pool.apply_async(_calculate_chunk_in_worker, arguments)))
+            if len(pending) >= 2 * workers:
+                columns, result = pending.popleft()
+                yield (columns,) + result.get()
+        while pending:
+            columns, result = pending.popleft()
+            yield (columns,) + result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# ----- Writing outputs ----- #
+
+def open_writer(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return CsvChunkWriter(path)
+    if extension in ('.parquet', '.pq'):
+        return ParquetChunkWriter(path)
+    raise ValueError("Unsupported output file '{}': expected a .csv or .parquet file.".format(path))
+
+
+class CsvChunkWriter(object):
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline = '')
+        self.writer = csv.writer(self.file)
+        self.header_written = False
+
+    def write(self, columns):
+        if not self.header_written:
+            self.writer.writerow(list(columns.keys()))
+            self.header_written = True
+        self.writer.writerows(zip(*(np.asarray(to_output_array(values)).tolist() for values in columns.values())))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter(object):
+
+    def __init__(self, path):
+        self.parquet = _import_pyarrow_parquet()
+        self.path = path
+        self.writer = None
+
+    def write(self, columns):
+        import pyarrow
+
+        table = pyarrow.Table.from_pydict(OrderedDict((name, np.asarray(to_output_array(values))) for name, values in columns.items()))
+        if self.writer is None:
+            self.writer = self.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# ----- Batch entry points ----- #
+
+def calculate_batch(input_path, output_path, variables = None, period = DEFAULT_PERIOD,
+        chunk_size = DEFAULT_CHUNK_SIZE, passthrough = (), tax_benefit_system = None, workers = 1,
+        system_options = None, deduplicate = False, trace_memory = False, registry = None):
+    """Calculate `variables` for every row of `input_path` and write them to `output_path`.
+
+    `passthrough` columns (e.g. a record identifier) are copied from the input file to the
+    output file ahead of the calculated variables. With several `workers`, chunks are
+    calculated in parallel processes (see `calculate_chunks`). `system_options` are passed
+    to `build_tax_benefit_system` when no `tax_benefit_system` is given. With `deduplicate`,
+    only the distinct rows of each chunk are simulated, and with `trace_memory`, the peak
+    memory of each chunk is measured (see `calculate_chunk`). With a `registry` (see
+    `gems_registry`), the inputs of each row's product are read from the register.
+    Returns a `BatchStats`.
+    """
+    system_options = system_options or {}
+    if tax_benefit_system is None:
+        tax_benefit_system = build_tax_benefit_system(**system_options)
+    variables = list(variables or PEAK_DEMAND_SAVINGS_VARIABLES)
+    for name in variables:
+        tax_benefit_system.get_variable(name, check_existence = True)
+
+    stats = BatchStats()
+    start = time.time()
+    writer = open_writer(output_path)
+    try:
+        chunks = read_chunks(input_path, chunk_size, tax_benefit_system)
+        if registry is not None:
+            chunks = registry.resolve_chunks(tax_benefit_system, chunks)
+        calculated = calculate_chunks(
+            tax_benefit_system, chunks, variables, period, workers, system_options, deduplicate, trace_memory)
+        for columns, results, evaluated_rows, peak_memory in calculated:
+            missing = [name for name in passthrough if name not in columns]
+            if missing:
+                raise ValueError("Passthrough columns {} are not in '{}'.".format(', '.join(missing), input_path))
+
+            output = OrderedDict((name, columns[name]) for name in passthrough)
+            output.update(results)
+            writer.write(output)
+
+            stats.add_chunk(len(next(iter(columns.values()))), evaluated_rows, peak_memory)
+            log.info('Chunk %d done: %d rows in %.1fs.', stats.chunks, stats.rows, time.time() - start)
+    finally:
+        writer.close()
+    stats.seconds = time.time() - start
+    return stats
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description = 'Calculate PDRS variables for every row of a CSV, Parquet, Arrow or Feather file.')
+    parser.add_argument('input', help = 'CSV, Parquet, Arrow or Feather file with one column per input variable, '
+        'or directory of one .npy file per input variable')
+    parser.add_argument('output', help = 'CSV or Parquet file to write the calculated variables to')
+    parser.add_argument('-v', '--variables', nargs = '+', default = None,
+        help = 'variables to calculate (default: the PDRS peak demand savings of every activity)')
+    parser.add_argument('-p', '--period', default = DEFAULT_PERIOD, help = 'period to calculate (default: %(default)s)')
+    parser.add_argument('-c', '--chunk-size', type = int, default = DEFAULT_CHUNK_SIZE,
+        help = 'rows per simulation (default: %(default)s)')
+    parser.add_argument('--passthrough', nargs = '+', default = (),
+        help = 'input columns to copy to the output, e.g. a record identifier')
+    parser.add_argument('-j', '--workers', type = int, default = 1,
+        help = 'number of worker processes (default: %(default)s)')
+    parser.add_argument('--cache-dir', default = None,
+        help = 'directory caching the parsed parameters between runs (default: $OPENFISCA_NSW_PDRS_CACHE_DIR)')
+    parser.add_argument('--fold-constants', action = 'store_true',
+        help = 'compute variables depending only on parameters and enum inputs once per combination of inputs')
+    parser.add_argument('--dedup', action = 'store_true',
+        help = 'only simulate the distinct rows of each chunk, and copy their results to duplicate rows')
+    parser.add_argument('--compact', action = 'store_true',
+        help = 'store enums on one byte and drop intermediate variables as soon as they are no longer needed')
+    parser.add_argument('--compile', action = 'store_true',
+        help = 'run the formulas of each variable and of everything it reads as one compiled kernel')
+    parser.add_argument('--trace-memory', action = 'store_true',
+        help = 'measure the peak memory used to calculate each chunk, and report it per row')
+    parser.add_argument('--lazy', action = 'store_true',
+        help = 'only load the variables and parameters of the activities calculated')
+    parser.add_argument('--implementation-dates', action = 'store_true',
+        help = "read each row's parameters at the date of its {} column, instead of at the period".format(IMPLEMENTATION_DATE_COLUMN))
+    parser.add_argument('--registry', default = None, metavar = 'REGISTER',
+        help = "GEMS register export (CSV, Parquet, Arrow or Feather) to read the inputs of each row's brand and model from")
+    parser.add_argument('--registry-index', default = None, metavar = 'DIR',
+        help = 'directory to save the indexed register to, and to read it from while the export is unchanged')
+    parser.add_argument('--profile', default = None, metavar = 'TRACE',
+        help = 'record the time spent in each formula, and write it as a Chrome trace (or as folded stacks if '
+        'TRACE ends with .folded). Requires a single worker')
+    return parser
+
+
+def main(argv = None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.profile and args.workers > 1:
+        parser.error('--profile requires a single worker.')
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    system_options = {'cache_dir': args.cache_dir, 'fold_constants': args.fold_constants, 'compact': args.compact,
+        'compile_formulas': args.compile, 'lazy': args.lazy, 'implementation_dates': args.implementation_dates}
+
+    tax_benefit_system = None
+    registry = None
+    if args.profile or args.registry:
+        tax_benefit_system = build_tax_benefit_system(**system_options)
+    if args.registry:
+        # Imported here, as the registry reads the register with this module
+        from openfisca_nsw_pdrs_tools.gems_registry import ProductRegistry
+        registry = ProductRegistry.load(tax_benefit_system, args.registry, args.registry_index)
+
+    def run():
+        return calculate_batch(
+            args.input,
+            args.output,
+            variables = args.variables,
+            period = args.period,
+            chunk_size = args.chunk_size,
+            passthrough = args.passthrough,
+            tax_benefit_system = tax_benefit_system,
+            workers = args.workers,
+            system_options = system_options,
+            deduplicate = args.dedup,
+            trace_memory = args.trace_memory,
+            registry = registry,
+            )
+
+    if args.profile:
+        with profile(tax_benefit_system) as profiler:
+            stats = run()
+        profiler.write(args.profile)
+        log.info('%s\nProfile written to %s.', profiler.report(), args.profile)
+    else:
+        stats = run()
+    log.info('Calculated %d rows in %.1fs (%.0f rows/s).', stats.rows, stats.seconds, stats.rows_per_second)
+    if args.dedup:
+        log.info('Simulated %d distinct rows (dedup ratio %.1f).', stats.evaluated_rows, stats.dedup_ratio)
+    if args.trace_memory:
+        log.info('Peak memory: %.0f bytes per row (%.1f MB for a chunk of %d rows).',
+            stats.peak_memory_per_row, stats.peak_memory / 1e6, stats.peak_memory_rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
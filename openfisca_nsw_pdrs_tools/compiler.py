@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+
+# This file compiles the formulas of a variable and of everything it reads into one kernel.
+#
+# A simulation calculates a PDRS output by running the formula of each variable of its
+# graph in turn: each result goes through the simulation's cache, and every operation of
+# every formula allocates a new population-sized array. `compile_formulas` replaces the
+# formulas of a system by kernels. Once per parameter instant, the formula of a variable
+# and those of the variables it reads are traced: they are run on symbolic arrays
+# (`Expression`), with the parameters of that instant, which records the operations they
+# apply to the inputs as a program. The kernel then runs this program on each population,
+# without going through the simulation between variables, dropping every intermediate
+# array as soon as it is no longer read, and writing the result of arithmetic operations
+# in place into such an array rather than into a new one.
+#
+# Operations which cannot be recorded, e.g. indexing a NumPy array with a variable or
+# branching on its values, make a formula opaque: the kernel then runs it as is, on the
+# values of the variables it reads. Either way, the kernel applies the same NumPy
+# operations to the same arrays as the simulation would, so results are identical.
+
+import logging
+import numbers
+import operator
+
+import numpy as np
+
+from openfisca_core.indexed_enums import Enum, EnumArray
+from openfisca_core.parameters import ParameterNodeAtInstant, VectorialParameterNodeAtInstant
+
+from openfisca_nsw_pdrs_tools.dependencies import formula_dependencies, run_formula
+from openfisca_nsw_pdrs_tools.folding import _formula_at
+from openfisca_nsw_pdrs.lookups import compile_once
+from openfisca_nsw_pdrs_tools.paths import is_extension_variable
+
+log = logging.getLogger(__name__)
+
+# Arithmetic operations whose result can be written into one of their operands
+IN_PLACE_UFUNCS = {
+    operator.add: np.add,
+    operator.sub: np.subtract,
+    operator.mul: np.multiply,
+    operator.truediv: np.true_divide,
+    operator.pow: np.power,
+    operator.neg: np.negative,
+    np.add: np.add,
+    np.subtract: np.subtract,
+    np.multiply: np.multiply,
+    np.true_divide: np.true_divide,
+    np.power: np.power,
+    np.negative: np.negative,
+    np.maximum: np.maximum,
+    np.minimum: np.minimum,
+    np.absolute: np.absolute,
+    }
+
+# Operations always returning a new array when given one
+FRESH_RESULTS = set(IN_PLACE_UFUNCS) | set([np.where])
+
+
+class Untraceable(Exception):
+    """Raised when a formula uses a symbolic array in a way which cannot be recorded."""
+
+
+# ----- Tracing ----- #
+
+def _binary(function):
+    def method(self, other):
+        return Expression('call', function, (self, other))
+    return method
+
+
+def _reflected(function):
+    def method(self, other):
+        return Expression('call', function, (other, self))
+    return method
+
+
+def _unary(function):
+    def method(self):
+        return Expression('call', function, (self,))
+    return method
+
+
+def _untraceable(name):
+    def method(self, *args, **kwargs):
+        raise Untraceable(name)
+    return method
+
+
+class Expression(object):
+    """Symbolic array standing for a value the kernel computes at run time.
+
+    `kind` is `'input'` for an input variable, `'variable'` for the result of a formula,
+    cast as the simulation would, `'opaque'` for the raw result of a formula run as is,
+    and `'call'` for `function(*args, **kwargs)`.
+    """
+
+    __hash__ = object.__hash__
+
+    def __init__(self, kind, function = None, args = (), kwargs = None, name = None):
+        self.kind = kind
+        self.function = function
+        self.args = tuple(_unwrap(arg) for arg in args)
+        self.kwargs = dict((key, _unwrap(value)) for key, value in (kwargs or {}).items())
+        self.name = name
+
+    __add__ = _binary(operator.add)
+    __radd__ = _reflected(operator.add)
+    __sub__ = _binary(operator.sub)
+    __rsub__ = _reflected(operator.sub)
+    __mul__ = _binary(operator.mul)
+    __rmul__ = _reflected(operator.mul)
+    __truediv__ = _binary(operator.truediv)
+    __rtruediv__ = _reflected(operator.truediv)
+    __floordiv__ = _binary(operator.floordiv)
+    __rfloordiv__ = _reflected(operator.floordiv)
+    __mod__ = _binary(operator.mod)
+    __rmod__ = _reflected(operator.mod)
+    __pow__ = _binary(operator.pow)
+    __rpow__ = _reflected(operator.pow)
+    __and__ = _binary(operator.and_)
+    __rand__ = _reflected(operator.and_)
+    __or__ = _binary(operator.or_)
+    __ror__ = _reflected(operator.or_)
+    __xor__ = _binary(operator.xor)
+    __rxor__ = _reflected(operator.xor)
+    __lt__ = _binary(operator.lt)
+    __le__ = _binary(operator.le)
+    __gt__ = _binary(operator.gt)
+    __ge__ = _binary(operator.ge)
+    __eq__ = _binary(operator.eq)
+    __ne__ = _binary(operator.ne)
+    __neg__ = _unary(operator.neg)
+    __pos__ = _unary(operator.pos)
+    __abs__ = _unary(operator.abs)
+    __invert__ = _unary(operator.invert)
+    __getitem__ = _binary(operator.getitem)
+
+    # The values of a symbolic array are unknown until the kernel runs
+    __array__ = _untraceable('__array__')
+    __bool__ = _untraceable('__bool__')
+    __len__ = _untraceable('__len__')
+    __iter__ = _untraceable('__iter__')
+    __index__ = _untraceable('__index__')
+    __int__ = _untraceable('__int__')
+    __float__ = _untraceable('__float__')
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or 'out' in kwargs:
+            raise Untraceable('{}.{}'.format(ufunc.__name__, method))
+        return Expression('call', ufunc, inputs, kwargs)
+
+    def __array_function__(self, function, types, args, kwargs):
+        return Expression('call', function, args, kwargs)
+
+    def astype(self, *args, **kwargs):
+        return Expression('call', operator.methodcaller('astype', *args, **kwargs), (self,))
+
+    def __repr__(self):
+        if self.kind in ('input', 'variable', 'opaque'):
+            return '<Expression {} {}>'.format(self.kind, self.name)
+        return '<Expression {}>'.format(getattr(self.function, '__name__', self.function))
+
+
+class ParameterProxy(object):
+    """Parameter node or scale whose lookups by a symbolic array are recorded."""
+
+    def __init__(self, value):
+        self._value = value
+
+    def __getattr__(self, name):
+        attribute = getattr(self._value, name)
+        if callable(attribute):
+            return _ProxyMethod(attribute)
+        return _wrap(attribute)
+
+    def __getitem__(self, key):
+        if _contains_expression(key):
+            return Expression('call', operator.getitem, (self._value, key))
+        return _wrap(self._value[key])
+
+    def __iter__(self):
+        return iter(self._value)
+
+
+class _ProxyMethod(object):
+
+    def __init__(self, method):
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        if _contains_expression(args) or _contains_expression(kwargs):
+            return Expression('call', self.method, args, kwargs)
+        return _wrap(self.method(*args, **kwargs))
+
+
+def _wrap(value):
+    if isinstance(value, (ParameterNodeAtInstant, VectorialParameterNodeAtInstant)) or hasattr(value, 'calc'):
+        return ParameterProxy(value)
+    return value
+
+
+def _unwrap(value):
+    if isinstance(value, ParameterProxy):
+        return value._value
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(item) for item in value)
+    return value
+
+
+def _contains_expression(value):
+    if isinstance(value, Expression):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(_contains_expression(item) for item in value)
+    if isinstance(value, dict):
+        return any(_contains_expression(item) for item in value.values())
+    return False
+
+
+class TracingPopulation(object):
+    """Stand-in population whose variables are symbolic arrays."""
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __call__(self, variable_name, period, options = None):
+        if options or str(period) != str(self._tracer.period):
+            raise Untraceable('{} at {}'.format(variable_name, period))
+        return self._tracer.variable(variable_name)
+
+    def __getattr__(self, name):
+        # e.g. `count`, `members`: the population itself is only known at run time
+        raise Untraceable(name)
+
+
+class Tracer(object):
+    """Records the formulas of variables, at `period`, as `Expression`s.
+
+    `formulas` maps variable names to the formulas to trace, by start date, instead of
+    the current formulas of the variables.
+    """
+
+    def __init__(self, tax_benefit_system, formulas, period, parameters):
+        self.tax_benefit_system = tax_benefit_system
+        self.formulas = formulas
+        self.period = period
+        self.parameters = parameters
+        self.expressions = {}
+        self._tracing = set()
+
+    def variable(self, name):
+        expression = self.expressions.get(name)
+        if expression is None:
+            if name in self._tracing:
+                raise ValueError("Circular definition of '{}'.".format(name))
+            self._tracing.add(name)
+            try:
+                expression = self.expressions[name] = self._trace(name)
+            finally:
+                self._tracing.discard(name)
+        return expression
+
+    def _trace(self, name):
+        variable = self.tax_benefit_system.get_variable(name, check_existence = True)
+        formula = _formula_at(self.formulas.get(name, variable.formulas), self.period)
+        if formula is None:
+            return Expression('input', name = name)
+        # Folded formulas (see `folding`) are already faster than a trace of their original
+        if variable.value_type in (float, int, bool) and not hasattr(formula, '__wrapped__'):
+            try:
+                value = run_formula(formula, TracingPopulation(self), self.period, self._traced_parameters)
+                return Expression('variable', args = (value,), name = name)
+            except (Untraceable, TypeError, ValueError, IndexError) as error:
+                # NumPy may report a symbolic array it cannot convert as one of these errors.
+                # Recorded operations of the variables it read are kept.
+                log.debug("Running the formula of '%s' as is: %r.", name, error)
+        dependencies = formula_dependencies(formula)
+        if dependencies.opaque:
+            raise Untraceable("The variables read by '{}' are unknown.".format(name))
+        reads = dict((dependency, self.variable(dependency)) for dependency in sorted(dependencies.variables))
+        opaque = Expression('opaque', formula, (reads,), name = name)
+        return Expression('variable', args = (opaque,), name = name)
+
+    def _traced_parameters(self, instant):
+        return _wrap(self.parameters(instant))
+
+
+# ----- Kernels ----- #
+
+class Kernel(object):
+    """Program calculating `name` at `period` from its inputs, traced with the parameters of one instant."""
+
+    def __init__(self, tax_benefit_system, name, period, expression):
+        self.tax_benefit_system = tax_benefit_system
+        self.name = name
+        self.period = period
+        self.nodes = []
+        slots = {}
+        self._order(expression, slots)
+        self.arguments = [
+            (_template(node.args, slots), _template(node.kwargs, slots))
+            for node in self.nodes
+            ]
+        # Slots to drop after each node, once their last reader has run
+        last_use = {}
+        for index, (args, kwargs) in enumerate(self.arguments):
+            for slot in _slots(args) + _slots(kwargs):
+                last_use[slot] = index
+        self.releases = [[] for _ in self.nodes]
+        for slot, index in last_use.items():
+            self.releases[index].append(slot)
+        self.intermediates = sorted(
+            node.name for node in self.nodes
+            if node.kind == 'variable' and node.name != name
+            )
+        self.opaque = sorted(node.name for node in self.nodes if node.kind == 'opaque')
+
+    def _order(self, value, slots):
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                self._order(item, slots)
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._order(item, slots)
+        elif isinstance(value, Expression) and id(value) not in slots:
+            self._order(value.args, slots)
+            self._order(value.kwargs, slots)
+            slots[id(value)] = len(self.nodes)
+            self.nodes.append(value)
+
+    def describe(self):
+        """Return one line per operation of the program, for debugging."""
+        lines = []
+        for index, node in enumerate(self.nodes):
+            args, kwargs = self.arguments[index]
+            if node.kind == 'call':
+                label = getattr(node.function, '__name__', repr(node.function))
+            else:
+                label = '{} {}'.format(node.kind, node.name)
+            lines.append('{:3d} {} {}'.format(index, label, _describe(args, kwargs)))
+        return '\n'.join(lines)
+
+    def run(self, population, period, parameters):
+        """Return the value of the kernel's variable for `population`."""
+        count = population.count
+        values = [None] * len(self.nodes)
+        owned = [False] * len(self.nodes)
+        for index, node in enumerate(self.nodes):
+            args, kwargs = self.arguments[index]
+            args = _substitute(args, values)
+            kwargs = _substitute(kwargs, values)
+            releases = self.releases[index]
+            if node.kind == 'input':
+                value = population(node.name, period)
+            elif node.kind == 'variable':
+                value = _cast(args[0], self.tax_benefit_system.variables[node.name], count)
+                owned[index] = value is not args[0] or _owned(self.arguments[index][0][0], owned)
+            elif node.kind == 'opaque':
+                value = run_formula(node.function, KernelPopulation(population, args[0], count), period, parameters)
+            else:
+                value, owned[index] = _call(node.function, args, kwargs, self.arguments[index][0], owned, releases)
+            if not owned[index]:
+                # Arrays a view may share memory with must not be overwritten
+                _disown(value, self.arguments[index], values, owned)
+            values[index] = value
+            for slot in releases:
+                values[slot] = None
+                owned[slot] = False
+        return values[-1]
+
+
+class _Slot(object):
+    __slots__ = ['slot']
+
+    def __init__(self, slot):
+        self.slot = slot
+
+
+def _template(value, slots):
+    if isinstance(value, Expression):
+        return _Slot(slots[id(value)])
+    if isinstance(value, (list, tuple)):
+        return type(value)(_template(item, slots) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _template(item, slots)) for key, item in value.items())
+    return value
+
+
+def _slots(template):
+    if isinstance(template, _Slot):
+        return [template.slot]
+    if isinstance(template, (list, tuple)):
+        return [slot for item in template for slot in _slots(item)]
+    if isinstance(template, dict):
+        return [slot for item in template.values() for slot in _slots(item)]
+    return []
+
+
+def _substitute(template, values):
+    if isinstance(template, _Slot):
+        return values[template.slot]
+    if isinstance(template, (list, tuple)):
+        return type(template)(_substitute(item, values) for item in template)
+    if isinstance(template, dict):
+        return dict((key, _substitute(item, values)) for key, item in template.items())
+    return template
+
+
+def _describe(args, kwargs):
+    def label(value):
+        if isinstance(value, _Slot):
+            return '%{}'.format(value.slot)
+        if isinstance(value, (list, tuple)):
+            return '[{}]'.format(', '.join(label(item) for item in value))
+        if isinstance(value, dict):
+            return '{{{}}}'.format(', '.join('{}: {}'.format(key, label(item)) for key, item in sorted(value.items())))
+        if isinstance(value, np.ndarray):
+            return 'array{}'.format(value.shape)
+        return repr(value) if isinstance(value, (numbers.Number, str)) else type(value).__name__
+    return ' '.join([label(arg) for arg in args] + ['{}={}'.format(key, label(value)) for key, value in sorted(kwargs.items())])
+
+
+def _owned(template, owned):
+    return isinstance(template, _Slot) and owned[template.slot]
+
+
+def _disown(value, arguments, values, owned):
+    if not isinstance(value, np.ndarray):
+        return
+    for slot in _slots(arguments):
+        if owned[slot] and np.may_share_memory(value, values[slot]):
+            owned[slot] = False
+
+
+def _call(function, args, kwargs, templates, owned, releases):
+    """Return `(function(*args, **kwargs), whether the result is a new array)`, reusing a dead operand if possible."""
+    ufunc = IN_PLACE_UFUNCS.get(function)
+    if ufunc is not None and not kwargs:
+        for template, arg in zip(templates, args):
+            # A temporary the kernel allocated, which no later operation reads
+            if _owned(template, owned) and template.slot in releases and _can_hold(arg, args):
+                return ufunc(*args, out = arg), True
+    value = function(*args, **kwargs)
+    fresh = function in FRESH_RESULTS and type(value) is np.ndarray and not any(value is arg for arg in args)
+    return value, fresh
+
+
+def _can_hold(buffer, args):
+    if type(buffer) is not np.ndarray or not buffer.flags.writeable or buffer.dtype.kind != 'f':
+        return False
+    # Subclasses, e.g. `EnumArray`, may override the operation
+    if not all(type(arg) is np.ndarray or isinstance(arg, (np.generic, numbers.Number)) for arg in args):
+        return False
+    return np.result_type(*args) == buffer.dtype and np.broadcast(*args).shape == buffer.shape
+
+
+def _cast(value, variable, count):
+    # Same as `Simulation._cast_formula_result`
+    if variable.value_type == Enum and not isinstance(value, EnumArray):
+        return variable.possible_values.encode(value)
+    if not isinstance(value, np.ndarray):
+        value = np.full(count, value)
+    if value.dtype != variable.dtype:
+        return value.astype(variable.dtype)
+    return value
+
+
+class KernelPopulation(object):
+    """Population passed to opaque formulas: variables the kernel calculated are read from `values`."""
+
+    def __init__(self, population, values, count):
+        self._population = population
+        self._values = values
+        self.count = count
+
+    def __call__(self, variable_name, period, options = None):
+        if variable_name in self._values and not options:
+            return self._values[variable_name]
+        return self._population(variable_name, period, options)
+
+    def __getattr__(self, name):
+        return getattr(self._population, name)
+
+
+def trace_kernel(tax_benefit_system, name, period, parameters, formulas = None):
+    """Return the `Kernel` calculating `name` at `period`, with `parameters` (see `Simulation` formulas).
+
+    `formulas` maps variable names to the formulas to trace instead of their current ones.
+    Raises `Untraceable` if a variable read cannot be compiled.
+    """
+    tracer = Tracer(tax_benefit_system, formulas or {}, period, parameters)
+    return Kernel(tax_benefit_system, name, period, tracer.variable(name))
+
+
+# ----- Compiling a system ----- #
+
+def compilable_variables(tax_benefit_system):
+    """Return the names of the variables of this package which have numeric formulas."""
+    return sorted(
+        name for name, variable in tax_benefit_system.variables.items()
+        if variable.formulas and variable.value_type in (float, int, bool) and is_extension_variable(variable)
+        )
+
+
+def compile_formulas(tax_benefit_system, variables = None):
+    """Replace the formulas of `variables` by kernels (see `Kernel`), and return their names.
+
+    Defaults to `compilable_variables`. A kernel is traced on the first calculation at
+    each parameter instant. Formulas fall back to the original ones when a variable read
+    cannot be compiled, when the simulation already holds a value for an intermediate
+    variable, e.g. one set as an input by a test, and when parameters are not a plain
+    snapshot, e.g. in traced simulations.
+    """
+    names = compilable_variables(tax_benefit_system) if variables is None else list(variables)
+    originals = dict((name, dict(tax_benefit_system.variables[name].formulas)) for name in names)
+    for name in names:
+        variable = tax_benefit_system.variables[name]
+        for start, formula in list(variable.formulas.items()):
+            variable.formulas[start] = _compiled_formula(tax_benefit_system, originals, variable, formula)
+    return names
+
+
+def _compiled_formula(tax_benefit_system, originals, variable, original_formula):
+
+    def formula(population, period, parameters):
+        snapshot = parameters(period)
+        if not isinstance(snapshot, ParameterNodeAtInstant):
+            return run_formula(original_formula, population, period, parameters)
+
+        key = ('compiled', variable.name, id(original_formula), str(period))
+        kernel = compile_once(snapshot, key, lambda: _trace_or_none(
+            tax_benefit_system, variable.name, period, parameters, originals))
+        if not kernel or _holds_any(population, kernel.intermediates, period):
+            return run_formula(original_formula, population, period, parameters)
+        return kernel.run(population, period, parameters)
+
+    formula.__wrapped__ = original_formula
+    return formula
+
+
+def _trace_or_none(tax_benefit_system, name, period, parameters, originals):
+    try:
+        return trace_kernel(tax_benefit_system, name, period, parameters, originals)
+    except Untraceable:
+        return False
+
+
+def _holds_any(population, names, period):
+    simulation = getattr(population, 'simulation', None)
+    if simulation is None:
+        return False
+    return any(simulation.get_holder(name).get_array(period) is not None for name in names)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# This file finds what each formula reads, by static analysis of its source code.
+#
+# PDRS formulas read variables with `building('<variable name>', period)` and parameters
+# with `parameters(period).<path>`, possibly through a local alias such as
+# `params = parameters(period)`. Both patterns are recognised here. A formula which uses
+# its population in any other way (e.g. `building.members`, or passing `building` to a
+# helper), or which reads anything at another period than its own (e.g.
+# `building('<variable name>', period.last_year)`), is flagged as `opaque`, and tools
+# relying on this analysis leave it alone.
+
+import ast
+import inspect
+import textwrap
+from collections import namedtuple
+
+from openfisca_nsw_pdrs_tools.paths import is_extension_variable
+
+FormulaDependencies = namedtuple('FormulaDependencies', ['variables', 'parameters', 'opaque'])
+
+# Dependencies of a variable whose formulas cannot be analysed
+OPAQUE = FormulaDependencies(frozenset(), frozenset(), True)
+
+
+def formula_dependencies(formula):
+    """Return the `FormulaDependencies` of `formula`.
+
+    `variables` is the set of variable names the formula reads, `parameters` the set of
+    parameter paths (tuples of names, e.g. `('AC', 'AC_load_factors_table')`) it reads.
+    A path may end with a method name, e.g. `('motors', 'motors_asset_life_table', 'calc')`:
+    use `resolve_parameter_path` to match it against an actual parameter tree.
+    """
+    formula = inspect.unwrap(formula)
+    try:
+        source = textwrap.dedent(inspect.getsource(formula))
+        function = ast.parse(source).body[0]
+    except (OSError, TypeError, SyntaxError, IndexError):
+        return OPAQUE
+    if not isinstance(function, ast.FunctionDef):
+        return OPAQUE
+    return function_dependencies(function)
+
+
+def function_dependencies(function):
+    """Return the `FormulaDependencies` of the formula defined by `function`, an `ast.FunctionDef`."""
+    arguments = [argument.arg for argument in function.args.args]
+    population_name = arguments[0] if arguments else None
+    period_name = arguments[1] if len(arguments) > 1 else None
+    parameters_name = arguments[2] if len(arguments) > 2 else None
+    visitor = _FormulaVisitor(population_name, period_name, parameters_name)
+    for statement in function.body:
+        visitor.visit(statement)
+    return FormulaDependencies(frozenset(visitor.variables), frozenset(visitor.parameters), visitor.opaque)
+
+
+class _FormulaVisitor(ast.NodeVisitor):
+
+    def __init__(self, population_name, period_name, parameters_name):
+        self.population_name = population_name
+        self.period_name = period_name
+        self.parameters_name = parameters_name
+        self.aliases = {}
+        self.variables = set()
+        self.parameters = set()
+        self.opaque = False
+
+    def parameter_path(self, node):
+        """Return the parameter path `node` evaluates to, or None if it is not a parameter."""
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id == self.parameters_name and self.at_own_period(node):
+                return ()
+            return None
+        if isinstance(node, ast.Name):
+            return self.aliases.get(node.id)
+        if isinstance(node, ast.Attribute):
+            path = self.parameter_path(node.value)
+            return None if path is None else path + (node.attr,)
+        if isinstance(node, ast.Subscript):
+            key = _string_constant(node.slice)
+            path = self.parameter_path(node.value)
+            if path is None or key is None:
+                return None
+            return path + (key,)
+        return None
+
+    def visit_Assign(self, node):
+        path = self.parameter_path(node.value)
+        if path is not None and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            self.aliases[node.targets[0].id] = path
+            return
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                self.aliases.pop(target.id, None)
+        self.generic_visit(node)
+
+    def at_own_period(self, node):
+        """Return whether the last positional argument of the call `node` is the formula's own period."""
+        period = node.args[-1] if node.args else None
+        return isinstance(period, ast.Name) and period.id == self.period_name
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id == self.population_name:
+            name = _string_constant(node.args[0]) if node.args else None
+            if name is None or len(node.args) != 2 or not self.at_own_period(node):
+                self.opaque = True
+            else:
+                self.variables.add(name)
+            for argument in node.args[2:] + [keyword.value for keyword in node.keywords]:
+                self.visit(argument)
+            return
+        if isinstance(node.func, ast.Name) and node.func.id == self.parameters_name:
+            if len(node.args) != 1 or node.keywords or not self.at_own_period(node):
+                self.opaque = True
+                return
+        self.visit_expression(node)
+
+    def visit_Name(self, node):
+        # The period is only expected as the argument of a variable or parameters lookup
+        if node.id in (self.population_name, self.period_name):
+            self.opaque = True
+        elif node.id in self.aliases:
+            self.parameters.add(self.aliases[node.id])
+
+    def visit_Attribute(self, node):
+        self.visit_expression(node)
+
+    def visit_Subscript(self, node):
+        self.visit_expression(node)
+
+    def visit_expression(self, node):
+        path = self.parameter_path(node)
+        if path is not None:
+            # The longest chain is reached first: record it, not its prefixes
+            self.parameters.add(path)
+            if isinstance(node, ast.Subscript):
+                self.visit(node.slice)
+            return
+        self.generic_visit(node)
+
+
+def _string_constant(node):
+    # Python < 3.9 wraps subscripts in `ast.Index`, and < 3.8 uses `ast.Str`
+    if isinstance(node, getattr(ast, 'Index', ())):
+        node = node.value
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, getattr(ast, 'Str', ())):
+        return node.s
+    return None
+
+
+def run_formula(formula, population, period, parameters):
+    """Run `formula` as `Simulation._run_formula` does: without `parameters` if it only takes two arguments."""
+    if formula.__code__.co_argcount == 2:
+        return formula(population, period)
+    return formula(population, period, parameters)
+
+
+def variable_dependencies(variable):
+    """Return the union of the `FormulaDependencies` of all the formulas of `variable`."""
+    formulas = list(variable.formulas.values())
+    if not formulas:
+        return FormulaDependencies(frozenset(), frozenset(), False)
+    all_dependencies = [formula_dependencies(formula) for formula in formulas]
+    return FormulaDependencies(
+        frozenset().union(*(dependencies.variables for dependencies in all_dependencies)),
+        frozenset().union(*(dependencies.parameters for dependencies in all_dependencies)),
+        any(dependencies.opaque for dependencies in all_dependencies),
+        )
+
+
+def extension_variables(tax_benefit_system):
+    """Return the sorted names of the variables of `tax_benefit_system` defined by the PDRS extension."""
+    return sorted(name for name, variable in tax_benefit_system.variables.items() if is_extension_variable(variable))
+
+
+def dependency_graph(tax_benefit_system, variables = None):
+    """Return `{variable name: FormulaDependencies}` for `variables` and everything they read.
+
+    Defaults to every variable of `tax_benefit_system`.
+    """
+    graph = {}
+    pending = list(tax_benefit_system.variables if variables is None else variables)
+    while pending:
+        name = pending.pop()
+        if name in graph:
+            continue
+        graph[name] = variable_dependencies(tax_benefit_system.get_variable(name, check_existence = True))
+        pending.extend(graph[name].variables)
+    return graph
+
+
+def dependents(graph):
+    """Return `{variable name: set of the variables of graph reading it directly}`."""
+    reverse = {name: set() for name in graph}
+    for name, dependencies in graph.items():
+        for dependency in dependencies.variables:
+            reverse.setdefault(dependency, set()).add(name)
+    return reverse
+
+
+def closure(graph, names):
+    """Return the set of `names` and of all the variables they read, directly or not."""
+    seen = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            pending.extend(graph[name].variables)
+    return seen
+
+
+def downstream(graph, names):
+    """Return the set of `names` and of all the variables of `graph` reading them, directly or not."""
+    readers = dependents(graph)
+    seen = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            pending.extend(readers.get(name, ()))
+    return seen
+
+
+def topological_order(graph, names):
+    """Return `names` and their dependencies, each variable after everything it reads."""
+    order = []
+    done = set()
+
+    def visit(name):
+        if name in done:
+            return
+        done.add(name)
+        for dependency in sorted(graph[name].variables):
+            visit(dependency)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+
+def resolve_parameter_path(parameters, path):
+    """Return the longest prefix of `path` naming a parameter or node under `parameters`."""
+    node = parameters
+    resolved = ()
+    for name in path:
+        children = getattr(node, 'children', None)
+        if children is None or name not in children:
+            break
+        node = children[name]
+        resolved += (name,)
+    return resolved
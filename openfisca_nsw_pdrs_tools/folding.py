@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# This file folds the formulas which do not depend on any per-building numeric input.
+#
+# Some PDRS variables only read parameters: every building gets the same ROOA firmness
+# factor and peak demand savings. Others only read parameters and enum inputs: the AC
+# duration and firmness factors only depend on the zone and installation purpose, the
+# motors firmness factor on the motor type. Such a variable takes a handful of distinct
+# values, one per combination of its enum inputs.
+#
+# `fold_constants` finds these variables with `dependencies.dependency_graph` and wraps
+# their formulas: once per parameter instant, the original formula is evaluated on a
+# small "category grid" holding each combination of enum inputs once. A simulation then
+# only looks up each building's combination in the result. Variables reading no enum
+# input are broadcast from a single value without allocating a population-sized array.
+
+import numpy as np
+
+from openfisca_core.indexed_enums import Enum, EnumArray
+from openfisca_core.parameters import ParameterNodeAtInstant
+
+from openfisca_nsw_pdrs_tools.dependencies import dependency_graph, extension_variables, run_formula
+from openfisca_nsw_pdrs.lookups import compile_once
+
+# Variables with more combinations of enum inputs than this are not folded
+MAX_CATEGORIES = 4096
+
+
+def foldable_variables(tax_benefit_system):
+    """Return `{variable name: sorted names of its enum inputs}` for the foldable variables.
+
+    A variable is foldable if it is a PDRS variable with numeric formulas which only read
+    parameters at their own period, enum input variables and other foldable variables.
+    """
+    extension = extension_variables(tax_benefit_system)
+    graph = dependency_graph(tax_benefit_system, extension)
+    variables = tax_benefit_system.variables
+
+    def is_enum_input(name):
+        variable = variables[name]
+        return variable.value_type == Enum and not variable.formulas
+
+    candidates = set(
+        name for name in extension
+        if variables[name].formulas and variables[name].value_type in (float, int, bool) and not graph[name].opaque
+        )
+    foldable = {}
+    changed = True
+    while changed:
+        changed = False
+        for name in sorted(candidates - set(foldable)):
+            dependencies = graph[name].variables
+            if not all(is_enum_input(dependency) or dependency in foldable for dependency in dependencies):
+                continue
+            inputs = set(dependency for dependency in dependencies if is_enum_input(dependency))
+            for dependency in dependencies:
+                inputs.update(foldable.get(dependency, ()))
+            if np.prod([len(variables[input_name].possible_values) for input_name in inputs]) > MAX_CATEGORIES:
+                continue
+            foldable[name] = sorted(inputs)
+            changed = True
+    return foldable
+
+
+def fold_constants(tax_benefit_system):
+    """Wrap the formulas of the foldable variables of `tax_benefit_system`.
+
+    Returns `{variable name: enum inputs}` for the folded variables. Results are the same
+    as without folding, except that parameter-only variables are returned as read-only
+    broadcast arrays.
+    """
+    folded = foldable_variables(tax_benefit_system)
+    originals = {}
+    for name, inputs in folded.items():
+        variable = tax_benefit_system.variables[name]
+        originals[name] = dict(variable.formulas)
+        for start, formula in list(variable.formulas.items()):
+            variable.formulas[start] = _folded_formula(tax_benefit_system, originals, variable, formula, inputs)
+    return folded
+
+
+def _folded_formula(tax_benefit_system, originals, variable, original_formula, inputs):
+    input_variables = [tax_benefit_system.variables[name] for name in inputs]
+    shape = tuple(len(input_variable.possible_values) for input_variable in input_variables)
+
+    def formula(population, period, parameters):
+        snapshot = parameters(period)
+        if not isinstance(snapshot, ParameterNodeAtInstant):
+            # e.g. traced simulations, or parameters varying per building
+            return run_formula(original_formula, population, period, parameters)
+
+        key = ('folded', variable.name, id(original_formula), str(period))
+        table = compile_once(snapshot, key, lambda: _fold(
+            tax_benefit_system, originals, variable, original_formula, input_variables, shape, period, parameters))
+        if not inputs:
+            return np.broadcast_to(table[0], (population.count,))
+        codes = np.ravel_multi_index([population(name, period) for name in inputs], shape)
+        return np.take(table, codes)
+
+    formula.__wrapped__ = original_formula
+    return formula
+
+
+def _fold(tax_benefit_system, originals, variable, formula, input_variables, shape, period, parameters):
+    grid = CategoryGrid(tax_benefit_system, originals, input_variables, shape, parameters)
+    table = grid.cast(variable, run_formula(formula, grid, period, parameters))
+    table.flags.writeable = False
+    return table
+
+
+class CategoryGrid(object):
+    """Stand-in population with one member per combination of the values of enum inputs.
+
+    Members are ordered as `np.ravel_multi_index` orders the combinations, so the result
+    of a formula evaluated on the grid is indexed by each building's combination code.
+    """
+
+    def __init__(self, tax_benefit_system, originals, input_variables, shape, parameters):
+        self.tax_benefit_system = tax_benefit_system
+        self.originals = originals
+        self.parameters = parameters
+        self.count = int(np.prod(shape))
+        codes = np.indices(shape).reshape(len(shape), self.count)
+        self.columns = dict(
+            (input_variable.name, EnumArray(column.astype(input_variable.dtype), input_variable.possible_values))
+            for input_variable, column in zip(input_variables, codes)
+            )
+        self.results = {}
+
+    def __call__(self, variable_name, period, options = None):
+        if variable_name in self.columns:
+            return self.columns[variable_name]
+        if variable_name not in self.results:
+            variable = self.tax_benefit_system.get_variable(variable_name)
+            formula = _formula_at(self.originals[variable_name], period)
+            if formula is None:
+                # As in a simulation, a variable has its default value before its first formula
+                value = variable.default_value
+            else:
+                value = run_formula(formula, self, period, self.parameters)
+            self.results[variable_name] = self.cast(variable, value)
+        return self.results[variable_name]
+
+    def cast(self, variable, value):
+        value = np.asarray(value)
+        if value.ndim == 0:
+            value = np.full(self.count, value)
+        return value.astype(variable.dtype)
+
+
+def _formula_at(formulas, period):
+    # Same rule as `Variable.get_formula`: the last formula starting at or before the period
+    instant = str(period.start)
+    starts = [start for start in formulas if start <= instant]
+    return formulas[max(starts)] if starts else None
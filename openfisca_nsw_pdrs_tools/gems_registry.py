@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# This file looks the inputs of installations up in a GEMS register export.
+#
+# The power input, cooling capacity and type of an air conditioner, and the efficiency and
+# rated output of a motor, are read from the GEMS register for the installed model. A
+# `ProductRegistry` holds a register export in memory as one array per input variable,
+# keyed by brand and model, and fills these inputs in for a whole chunk of installations
+# at once: the brand and model keys of the chunk are factorised, only their distinct
+# values are looked up in a hash table of the register, and each column is then gathered
+# with a single `take`, so a million installations cost one join, not a million searches.
+#
+#     registry = ProductRegistry.load(tax_benefit_system, 'gems_air_conditioners.csv', index_path = 'gems.index')
+#     columns, found = registry.resolve(tax_benefit_system, columns)
+#
+# The export is a CSV, Parquet, Arrow or Feather file with a brand and a model column, and
+# one column per input variable, named after the variable or mapped to it by `column_map`.
+# With `index_path`, the parsed register is saved there as `.npy` files, and memory-mapped
+# by later runs as long as the export is unchanged.
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core.indexed_enums import Enum, EnumArray
+
+from openfisca_nsw_pdrs_tools.batch import enum_code_table, read_chunks, to_input_array
+
+log = logging.getLogger(__name__)
+
+BRAND_COLUMN = 'brand'
+MODEL_COLUMN = 'model'
+
+# Headers of the brand and model columns in GEMS register exports
+REGISTER_ALIASES = {
+    'Brand': BRAND_COLUMN,
+    'Model No': MODEL_COLUMN,
+    'Model_No': MODEL_COLUMN,
+    'Model Number': MODEL_COLUMN,
+    }
+
+INDEX_VERSION = 1
+INDEX_FILE = 'index.json'
+KEY_SEPARATOR = '\x1f'
+
+# Row of a model sold under several brands, when looking it up without its brand
+AMBIGUOUS = -2
+
+
+def normalise(values):
+    """Return brands or models as upper-case strings without surrounding spaces, as they are matched."""
+    return np.char.upper(np.char.strip(_strings(values)))
+
+
+def _strings(values):
+    # Object columns, e.g. Arrow string columns with nulls, hold None for missing values
+    values = np.asarray(values)
+    if values.dtype.kind == 'O':
+        return np.where(np.equal(values, None), '', values).astype(str)
+    return values.astype(str)
+
+
+def product_keys(brands, models):
+    return np.char.add(np.char.add(normalise(brands), KEY_SEPARATOR), normalise(models))
+
+
+class ProductRegistry(object):
+    """Products of a register export: their `brands` and `models`, and `columns` of input values.
+
+    `columns` maps variable names to one value per product, enum values being stored as
+    enum indices. `known` maps the names of columns with gaps in the export to a mask of
+    the products whose value is known.
+    """
+
+    def __init__(self, brands, models, columns, known = None, keys = None, key_rows = None):
+        self.brands = np.asarray(brands)
+        self.models = np.asarray(models)
+        self.columns = OrderedDict(columns)
+        self.known = dict(known or {})
+        if keys is None:
+            keys, key_rows = _first_occurrences(product_keys(self.brands, self.models))
+        self.keys = keys
+        self.key_rows = key_rows
+        self._key_index = None
+        self._model_index = None
+
+    def __len__(self):
+        return len(self.models)
+
+    # ----- Loading ----- #
+
+    @classmethod
+    def load(cls, tax_benefit_system, path, index_path = None, column_map = None):
+        """Return the registry of the register export `path`.
+
+        `column_map` maps headers of the export to variable names or to `BRAND_COLUMN` and
+        `MODEL_COLUMN`; other headers must be variable names, or are ignored. With
+        `index_path`, the registry is read from there if it was saved from the same
+        export, and saved there otherwise.
+        """
+        source_hash = _source_hash(path, column_map)
+        if index_path is not None:
+            registry = cls.load_index(tax_benefit_system, index_path, source_hash)
+            if registry is not None:
+                return registry
+
+        registry = cls.from_columns(tax_benefit_system, _read_register(tax_benefit_system, path), column_map)
+        log.info("Loaded %d products from '%s'.", len(registry), path)
+        if index_path is not None:
+            registry.save(tax_benefit_system, index_path, source_hash)
+        return registry
+
+    @classmethod
+    def from_columns(cls, tax_benefit_system, columns, column_map = None):
+        """Return the registry of the products in `columns`, a dict of header -> array."""
+        aliases = dict(REGISTER_ALIASES)
+        aliases.update(column_map or {})
+        renamed = OrderedDict((aliases.get(header, header), values) for header, values in columns.items())
+        if MODEL_COLUMN not in renamed:
+            raise ValueError("The register has no '{}' column. Map its model column with `column_map`.".format(MODEL_COLUMN))
+        models = normalise(renamed[MODEL_COLUMN])
+        brands = normalise(renamed[BRAND_COLUMN]) if BRAND_COLUMN in renamed else np.full(len(models), '')
+
+        values = OrderedDict()
+        known = {}
+        for name, column in renamed.items():
+            variable = tax_benefit_system.variables.get(name)
+            if variable is None:
+                continue
+            # Products without a value fall back to the installation's own input
+            gaps = _gaps(np.asarray(column))
+            if gaps.any():
+                known[name] = ~gaps
+            values[name] = _register_values(variable, column)
+        if not values:
+            raise ValueError('The register has no column named after an input variable. Map its columns with `column_map`.')
+        return cls(brands, models, values, known)
+
+    @classmethod
+    def load_index(cls, tax_benefit_system, index_path, source_hash = None):
+        """Return the registry saved in `index_path`, or None if it is missing or was saved from another export."""
+        try:
+            with open(os.path.join(index_path, INDEX_FILE)) as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError):
+            return None
+        if index.get('version') != INDEX_VERSION or (source_hash is not None and index.get('source_hash') != source_hash):
+            return None
+        # Enum indices are only valid for the enums they were saved with
+        for name, members in index['enums'].items():
+            variable = tax_benefit_system.variables.get(name)
+            if variable is None or list(variable.possible_values.__members__) != members:
+                return None
+
+        def load(name):
+            return np.load(os.path.join(index_path, name + '.npy'), mmap_mode = 'r')
+
+        return cls(
+            load('brands'),
+            load('models'),
+            OrderedDict((name, load(name)) for name in index['columns']),
+            dict((name, load(name + '.known')) for name in index['known']),
+            load('keys'),
+            load('key_rows'),
+            )
+
+    def save(self, tax_benefit_system, index_path, source_hash = None):
+        """Save the registry as `.npy` files in the directory `index_path`, to be read by `load_index`."""
+        index_file_path = os.path.join(index_path, INDEX_FILE)
+        if not os.path.isdir(index_path):
+            os.makedirs(index_path)
+        elif os.path.exists(index_file_path):
+            os.remove(index_file_path)
+        arrays = [('brands', self.brands), ('models', self.models), ('keys', self.keys), ('key_rows', self.key_rows)]
+        arrays += list(self.columns.items())
+        arrays += [(name + '.known', known) for name, known in self.known.items()]
+        for name, values in arrays:
+            np.save(os.path.join(index_path, name + '.npy'), np.asarray(values))
+        index = {
+            'version': INDEX_VERSION,
+            'source_hash': source_hash,
+            'columns': list(self.columns),
+            'known': sorted(self.known),
+            'enums': dict(
+                (name, list(tax_benefit_system.variables[name].possible_values.__members__))
+                for name in self.columns
+                if tax_benefit_system.variables[name].value_type == Enum
+                ),
+            }
+        # Written last, so that an interrupted save is not read back
+        with open(index_file_path, 'w') as index_file:
+            json.dump(index, index_file, indent = 2, sort_keys = True)
+
+    # ----- Looking products up ----- #
+
+    def rows(self, models, brands = None):
+        """Return the register row of each product of `models` (and `brands`), or -1 if it is not registered.
+
+        Without `brands`, a model registered under several brands is `AMBIGUOUS`.
+        """
+        # Factorise the brands and models, so that each distinct product is normalised and hashed once
+        model_names, model_codes = _factorise(models)
+        if brands is None:
+            keys = normalise(model_names)
+            codes = model_codes
+            index = self._get_model_index()
+        else:
+            brand_names, brand_codes = _factorise(brands)
+            pairs, codes = _factorise(brand_codes * len(model_names) + model_codes)
+            keys = product_keys(brand_names[pairs // len(model_names)], model_names[pairs % len(model_names)])
+            index = self._get_key_index()
+        unique_rows = np.fromiter((index.get(key, -1) for key in keys.tolist()), dtype = np.int64, count = len(keys))
+        return unique_rows[codes]
+
+    def _get_key_index(self):
+        if self._key_index is None:
+            self._key_index = dict(zip(np.asarray(self.keys).tolist(), np.asarray(self.key_rows).tolist()))
+        return self._key_index
+
+    def _get_model_index(self):
+        if self._model_index is None:
+            # One model per distinct product: a model listed several times under one brand is not ambiguous
+            product_models = np.take(self.models, self.key_rows)
+            models, rows, brands = np.unique(product_models, return_index = True, return_counts = True)
+            rows = np.where(brands > 1, AMBIGUOUS, np.take(self.key_rows, rows))
+            self._model_index = dict(zip(models.tolist(), rows.tolist()))
+        return self._model_index
+
+    def resolve(self, tax_benefit_system, columns, strict = False):
+        """Return `(columns, found)`: `columns` with the register's values of each row's product, and a mask of the rows found.
+
+        Products are looked up by the `MODEL_COLUMN` of `columns`, and by its `BRAND_COLUMN`
+        if there is one. Rows whose product is not registered, or has no value for a
+        variable, keep their own input, or the variable default value if they have none.
+        With `strict`, rows whose product is not registered raise a `ValueError`.
+        """
+        if MODEL_COLUMN not in columns:
+            raise ValueError("No '{}' column to look products up by.".format(MODEL_COLUMN))
+        models = columns[MODEL_COLUMN]
+        rows = self.rows(models, columns.get(BRAND_COLUMN))
+        found = rows >= 0
+        if strict and not found.all():
+            missing = np.unique(_strings(models)[~found])
+            raise ValueError('Products not found in the register: {}{}.'.format(
+                ', '.join(missing[:5].astype(str)), ', ...' if len(missing) > 5 else ''))
+
+        resolved = OrderedDict(columns)
+        if not len(self):
+            return resolved, found
+        safe_rows = np.where(found, rows, 0)
+        for name, values in self.columns.items():
+            variable = tax_benefit_system.variables[name]
+            matched = found & self.known[name][safe_rows] if name in self.known else found
+            resolved[name] = _merge(variable, np.take(values, safe_rows), matched, columns.get(name))
+        return resolved, found
+
+    def resolve_chunks(self, tax_benefit_system, chunks, strict = False):
+        """Yield each chunk of `chunks` with its inputs resolved (see `resolve`)."""
+        rows = matched = 0
+        for columns in chunks:
+            resolved, found = self.resolve(tax_benefit_system, columns, strict)
+            rows += len(found)
+            matched += int(found.sum())
+            yield resolved
+        if matched < rows:
+            log.warning('%d of %d rows matched no product of the register, and kept their own inputs.', rows - matched, rows)
+
+
+def _read_register(tax_benefit_system, path):
+    chunks = list(read_chunks(path, tax_benefit_system = tax_benefit_system))
+    if not chunks:
+        raise ValueError("The register '{}' is empty.".format(path))
+    return OrderedDict(
+        (name, np.concatenate([np.asarray(chunk[name]) for chunk in chunks]))
+        for name in chunks[0]
+        )
+
+
+def _source_hash(path, column_map):
+    digest = hashlib.sha256()
+    digest.update(str(INDEX_VERSION).encode())
+    digest.update(json.dumps(column_map or {}, sort_keys = True).encode())
+    with open(path, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _factorise(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'O':
+        values = _strings(values)
+    uniques, codes = np.unique(values, return_inverse = True)
+    return uniques, codes.reshape(-1)
+
+
+def _first_occurrences(keys):
+    # The first row listing a product is the one looked up
+    unique_keys, rows = np.unique(keys, return_index = True)
+    if len(unique_keys) < len(keys):
+        log.warning('%d products are listed several times in the register: their first listing is used.', len(keys) - len(unique_keys))
+    return unique_keys, rows.astype(np.int64)
+
+
+def _gaps(column):
+    if column.dtype.kind in ('U', 'S', 'O'):
+        return np.char.strip(column.astype(str)) == ''
+    if column.dtype.kind == 'f':
+        return np.isnan(column)
+    return np.zeros(len(column), dtype = bool)
+
+
+def _enum_indices(variable, values):
+    """Return the enum indices of `values`, enum names or indices, parsing each distinct name once."""
+    if isinstance(values, EnumArray) or np.asarray(values).dtype.kind in ('i', 'u'):
+        return np.asarray(to_input_array(variable, values))
+    names, inverse = np.unique(np.asarray(values).astype(str), return_inverse = True)
+    return enum_code_table(variable, names)[inverse.reshape(-1)]
+
+
+def _register_values(variable, column):
+    if variable.value_type == Enum:
+        return _enum_indices(variable, column)
+    values = np.asarray(to_input_array(variable, column))
+    if values.dtype.kind == 'f':
+        return values.astype(variable.dtype, copy = False)
+    return values
+
+
+def _merge(variable, values, matched, given):
+    """Return the input array of `variable`: `values` where `matched`, else `given` or the default value."""
+    if variable.value_type == Enum:
+        fallback = variable.default_value.index if given is None else _enum_indices(variable, given)
+        return EnumArray(np.where(matched, values, fallback).astype(variable.dtype), variable.possible_values)
+    fallback = variable.default_value if given is None else to_input_array(variable, given)
+    return np.where(matched, values, fallback).astype(variable.dtype, copy = False)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# This file keeps a simulation live while its inputs are edited.
+#
+# An `IncrementalSimulation` holds one simulation of a loaded portfolio. Updating an
+# input column, or some of its rows, only drops the variables downstream of that input
+# in the dependency graph (see `dependencies`): the next calculation re-runs their
+# formulas and reuses everything else. Changing `PDRS__Air_Conditioner__power_input`, for
+# instance, re-runs the AC peak demand savings formula but neither the firmness nor the
+# duration factor, which do not read it.
+#
+# The dependency graph only spans the variables calculated and what they read, so that a
+# formula which cannot be analysed elsewhere in the system does not make every update drop
+# everything.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core import periods
+from openfisca_core.indexed_enums import Enum, EnumArray
+
+from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD, PEAK_DEMAND_SAVINGS_VARIABLES, build_simulation, to_input_array
+from openfisca_nsw_pdrs_tools.dependencies import closure, dependency_graph, downstream
+
+
+class IncrementalSimulation(object):
+    """Simulation of `columns` whose inputs can be updated in place.
+
+    `variables` are the outputs expected to be calculated, by default the peak demand
+    savings; calculating others extends the dependency graph to them.
+    `formula_runs` counts the formulas run since the simulation was built, and
+    `last_formula_runs` the names of the variables whose formula the last `calculate` ran.
+    """
+
+    def __init__(self, tax_benefit_system, columns, period = DEFAULT_PERIOD, variables = None):
+        self.tax_benefit_system = tax_benefit_system
+        self.period = periods.period(period)
+        self.simulation = build_simulation(tax_benefit_system, columns, self.period)
+        self.graph = {}
+        self.opaque = False
+        self._extend_graph(PEAK_DEMAND_SAVINGS_VARIABLES if variables is None else variables)
+        self.formula_runs = 0
+        self.last_formula_runs = set()
+
+    def calculate(self, variables):
+        """Return `{variable name: array}` for `variables`, re-running only the dropped formulas."""
+        if isinstance(variables, str):
+            variables = [variables]
+        self._extend_graph(variables)
+        candidates = [name for name in closure(self.graph, variables) if self.tax_benefit_system.variables[name].formulas]
+        missing = set(name for name in candidates if not self._is_calculated(name))
+
+        results = OrderedDict((name, self.simulation.calculate(name, self.period)) for name in variables)
+
+        self.last_formula_runs = set(name for name in missing if self._is_calculated(name))
+        self.formula_runs += len(self.last_formula_runs)
+        return results
+
+    def update_input(self, name, values, rows = None):
+        """Set the input `name` to `values`, for all rows or only for the `rows` indices.
+
+        Values may be given as in a batch input file, e.g. enum names. Returns the set of
+        variables dropped, to be recalculated when next needed.
+        """
+        return self.update_inputs({name: values}, rows)
+
+    def update_inputs(self, values_by_name, rows = None):
+        """Same as `update_input`, for several inputs `{name: values}` at once."""
+        for name, values in values_by_name.items():
+            variable = self.tax_benefit_system.get_variable(name, check_existence = True)
+            column = _to_column(variable, values)
+            if rows is not None:
+                updated = self.simulation.calculate(name, self.period).copy()
+                updated[rows] = column
+                column = updated
+            self.simulation.delete_arrays(name)
+            self.simulation.set_input(name, self.period, column)
+        return self.invalidate(values_by_name)
+
+    def invalidate(self, names):
+        """Drop the calculated variables downstream of the variables `names`, and return them."""
+        if self.opaque:
+            # The variables an opaque formula reads are not in the graph: drop everything
+            stale = set(name for name, variable in self.tax_benefit_system.variables.items() if variable.formulas)
+        else:
+            stale = downstream(self.graph, names) - set(names)
+        for name in stale:
+            self.simulation.delete_arrays(name)
+        return stale
+
+    def _extend_graph(self, variables):
+        missing = [name for name in variables if name not in self.graph]
+        if missing:
+            self.graph.update(dependency_graph(self.tax_benefit_system, missing))
+            # If one of their formulas cannot be analysed, any input may affect any variable
+            self.opaque = any(dependencies.opaque for dependencies in self.graph.values())
+
+    def _is_calculated(self, name):
+        return self.simulation.get_holder(name).get_array(self.period) is not None
+
+
+def _to_column(variable, values):
+    if isinstance(values, EnumArray):
+        return values
+    values = np.asarray(values)
+    if variable.value_type == Enum:
+        if values.dtype.kind in ('U', 'S', 'O'):
+            return variable.possible_values.encode(to_input_array(variable, values))
+        return EnumArray(values.astype(variable.dtype), variable.possible_values)
+    return to_input_array(variable, values)
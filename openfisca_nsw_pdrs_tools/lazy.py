@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+# This file loads the PDRS variables and parameters on demand.
+#
+# Loading the extension imports every variables module and parses every parameter file,
+# even in a process which only calculates one activity. `install_lazy_extension` instead
+# registers the variables from a manifest, which `build_manifest` reads from the source of
+# the variables modules without importing them: the name of each variable, its module,
+# its activity group (the subdirectory of `variables/` it is defined in, e.g.
+# `PDRS_motors`), its `activity-group` metadata, and the parameters its formulas read.
+#
+# A variables module is only imported when one of its variables is first looked up, and
+# a top-level parameter node (e.g. `motors/`) is only parsed when a variable reading it
+# is loaded, so that a motors-only process never parses the AC or ROOA parameters.
+
+import ast
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from openfisca_core.parameters import ParameterNode, load_parameter_file
+
+from openfisca_nsw_pdrs_tools.dependencies import function_dependencies
+from openfisca_nsw_pdrs_tools.paths import PARAMETERS_DIR, VARIABLES_DIR
+
+log = logging.getLogger(__name__)
+
+PARAMETER_EXTENSIONS = ('.yaml', '.yml')
+
+# `parameters` of a variable whose formulas may read any parameter
+ALL_PARAMETERS = None
+
+ManifestEntry = namedtuple('ManifestEntry', ['name', 'path', 'group', 'activity_group', 'parameters'])
+
+
+# ----- Manifest ----- #
+
+def build_manifest(directory = VARIABLES_DIR):
+    """Return `{variable name: ManifestEntry}` for the variables defined in the modules under `directory`.
+
+    `parameters` is the set of top-level parameter nodes (e.g. `'AC'`) the formulas of a
+    variable read, or `ALL_PARAMETERS` if they cannot be analysed (see `dependencies`).
+    """
+    manifest = OrderedDict()
+    for root, dir_names, file_names in os.walk(directory):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith(('.', '_')))
+        group = os.path.relpath(root, directory).split(os.sep)[0]
+        group = '' if group == '.' else group
+        for file_name in sorted(file_names):
+            if file_name.endswith('.py') and not file_name.startswith('_'):
+                for entry in _module_entries(os.path.join(root, file_name), group):
+                    manifest[entry.name] = entry
+    return manifest
+
+
+def _module_entries(path, group):
+    with open(path, 'rb') as source_file:
+        tree = ast.parse(source_file.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and any(_base_name(base) == 'Variable' for base in node.bases):
+            yield ManifestEntry(node.name, path, group, _metadata(node).get('activity-group'), _parameter_roots(node))
+
+
+def _base_name(node):
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return getattr(node, 'id', None)
+
+
+def _metadata(class_node):
+    for statement in class_node.body:
+        if isinstance(statement, ast.Assign) and any(getattr(target, 'id', None) == 'metadata' for target in statement.targets):
+            try:
+                return ast.literal_eval(statement.value)
+            except ValueError:
+                return {}
+    return {}
+
+
+def _parameter_roots(class_node):
+    roots = set()
+    for statement in class_node.body:
+        if isinstance(statement, ast.FunctionDef) and statement.name.startswith('formula'):
+            dependencies = function_dependencies(statement)
+            if dependencies.opaque or any(not path for path in dependencies.parameters):
+                return ALL_PARAMETERS
+            roots.update(path[0] for path in dependencies.parameters)
+    return frozenset(roots)
+
+
+def parameter_roots(directory = PARAMETERS_DIR):
+    """Return `{top-level parameter name: path}` of the nodes and files of `directory`."""
+    roots = OrderedDict()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            roots[name] = path
+        elif name.endswith(PARAMETER_EXTENSIONS) and name != 'index.yaml':
+            roots[os.path.splitext(name)[0]] = path
+    return roots
+
+
+# ----- Lazy loading ----- #
+
+class LazyVariables(dict):
+    """Variables of a tax and benefit system, loading the manifest's variables on first lookup.
+
+    Looking a variable up, e.g. with `get_variable`, imports its module. Checking whether
+    a variable exists does not. Iterating loads every variable.
+    """
+
+    def __init__(self, loader, variables):
+        dict.__init__(self, variables)
+        self.loader = loader
+
+    def _load(self, name):
+        # While another thread loads its module, `load_module` waits for it
+        if not dict.__contains__(self, name) and name in self.loader.manifest:
+            self.loader.load_module(self.loader.manifest[name].path)
+
+    def __getitem__(self, name):
+        self._load(name)
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default = None):
+        self._load(name)
+        return dict.get(self, name, default)
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.loader.manifest
+
+    def __iter__(self):
+        self.loader.load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.loader.pending)
+
+    def keys(self):
+        self.loader.load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.loader.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.loader.load_all()
+        return dict.items(self)
+
+    def __deepcopy__(self, memo):
+        # e.g. `TaxBenefitSystem.clone`: copies are loaded eagerly
+        self.loader.load_all()
+        return copy.deepcopy(dict(self), memo)
+
+
+class LazyLoader(object):
+    """Imports the variables modules and parses the parameter nodes of `manifest` on demand."""
+
+    def __init__(self, tax_benefit_system, manifest, roots):
+        self.tax_benefit_system = tax_benefit_system
+        self.manifest = manifest
+        self.roots = roots
+        self.pending = set(manifest)
+        self.loaded_parameters = set()
+        self._lock = threading.RLock()
+
+    def load_module(self, path):
+        """Import the variables module `path`, and parse the parameters its variables read."""
+        with self._lock:
+            entries = [entry for entry in self.manifest.values() if entry.path == path and entry.name in self.pending]
+            if not entries:
+                return
+            needed = set()
+            for entry in entries:
+                needed |= set(self.roots) if entry.parameters is ALL_PARAMETERS else entry.parameters
+            # Parameters first: a formula may run as soon as its variable is registered
+            self.load_parameters(needed)
+            self.pending.difference_update(entry.name for entry in entries)
+            log.debug('Loading the variables of %s.', path)
+            self.tax_benefit_system.add_variables_from_file(path)
+
+    def load_parameters(self, names):
+        """Parse the top-level parameter nodes `names` which are not loaded yet."""
+        with self._lock:
+            names = sorted(name for name in names if name in self.roots and name not in self.loaded_parameters)
+            if not names:
+                return
+            parameters = self.tax_benefit_system.parameters
+            for name in names:
+                path = self.roots[name]
+                if os.path.isdir(path):
+                    node = ParameterNode(name, directory_path = path)
+                else:
+                    node = load_parameter_file(path, name)
+                parameters.add_child(name, node)
+                self.loaded_parameters.add(name)
+            _clear_parameter_snapshots(self.tax_benefit_system)
+
+    def load_group(self, group):
+        """Load the variables of the activity `group`: a subdirectory of `variables/`, or an `activity-group` metadata value."""
+        paths = sorted(set(
+            entry.path for entry in self.manifest.values()
+            if group in (entry.group, entry.activity_group)
+            ))
+        if not paths:
+            raise ValueError("Unknown activity group '{}'.".format(group))
+        for path in paths:
+            self.load_module(path)
+
+    def load_all(self):
+        with self._lock:
+            for path in sorted(set(self.manifest[name].path for name in self.pending)):
+                self.load_module(path)
+
+    def groups(self):
+        """Return the activity groups of the manifest, and whether each one is fully loaded."""
+        groups = OrderedDict()
+        for entry in self.manifest.values():
+            groups[entry.group] = groups.get(entry.group, True) and entry.name not in self.pending
+        return groups
+
+
+def _clear_parameter_snapshots(tax_benefit_system):
+    # Snapshots taken before a node was added do not have it
+    # (a `ParameterSnapshotCache`, or the memoised method of recent OpenFisca versions)
+    get_parameters_at_instant = tax_benefit_system.get_parameters_at_instant
+    if hasattr(get_parameters_at_instant, 'cache_clear'):
+        get_parameters_at_instant.cache_clear()
+    tax_benefit_system._parameters_at_instant_cache = {}
+
+
+_lazy_classes = {}
+
+
+def _lazy_class(system_class):
+    """Return a subclass of `system_class` whose copies, e.g. made by the test runner, are loaded eagerly."""
+    lazy_class = _lazy_classes.get(system_class)
+    if lazy_class is None:
+
+        def clone(self):
+            # `clone` copies the parameters before the variables: load them first
+            self.variables.loader.load_all()
+            new = system_class.clone(self)
+            new.__class__ = system_class
+            return new
+
+        lazy_class = _lazy_classes[system_class] = type('Lazy' + system_class.__name__, (system_class,), {'clone': clone})
+    return lazy_class
+
+
+def install_lazy_extension(tax_benefit_system, groups = ()):
+    """Register the PDRS variables and parameters in `tax_benefit_system`, to be loaded on first use.
+
+    This replaces `tax_benefit_system.load_extension('openfisca_nsw_pdrs')`. The variables
+    of the activity `groups` are loaded right away. Returns the `LazyLoader`.
+    """
+    loader = LazyLoader(tax_benefit_system, build_manifest(), parameter_roots())
+    tax_benefit_system.variables = LazyVariables(loader, tax_benefit_system.variables)
+    tax_benefit_system.__class__ = _lazy_class(type(tax_benefit_system))
+    for group in groups:
+        loader.load_group(group)
+    return loader
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# This file propagates the uncertainty of inputs and parameters to the PDRS outputs.
+#
+# `monte_carlo` draws `samples` variants of a population: uncertain input columns (e.g. a
+# measured `PDRS__Air_Conditioner__power_input`) are perturbed row by row, and uncertain
+# parameters (e.g. the ROOA `AVERAGE_SUMMER_DEMAND`) take one value per sample. Several
+# samples are tiled into a single population, so that the existing formulas evaluate
+# them all in one vectorised pass, with at most `max_rows` rows per simulation.
+#
+# Statistics are accumulated chunk by chunk: the per-row mean, standard deviation,
+# minimum and maximum, and the portfolio total of each sample. Per-row percentiles and
+# the samples themselves require keeping every sample, and are only computed on request.
+#
+#     summaries = monte_carlo(tax_benefit_system, columns, 'PDRS__ROOA__peak_demand_savings', 1000,
+#         parameters = {'ROOA_fridge.ROOA_related_constants.AVERAGE_SUMMER_DEMAND': Normal(0.1, relative = True)})
+#     summaries['PDRS__ROOA__peak_demand_savings'].total_percentiles()
+
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core import periods
+from openfisca_core.indexed_enums import Enum, EnumArray
+
+from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD, build_simulation, to_input_array
+from openfisca_nsw_pdrs_tools.overlays import VaryingParameterOverlay, get_parameter
+
+DEFAULT_MAX_ROWS = 1000000
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+# ----- Distributions ----- #
+
+class Normal(object):
+    """Normal noise of standard deviation `sd` around the base value, or `sd` times it if `relative`."""
+
+    def __init__(self, sd, relative = False):
+        self.sd = sd
+        self.relative = relative
+
+    def sample(self, random, base):
+        noise = self.sd * random.standard_normal(np.shape(base))
+        return base * (1 + noise) if self.relative else base + noise
+
+
+class Uniform(object):
+    """Uniform noise between `low` and `high` around the base value, or relative to it if `relative`."""
+
+    def __init__(self, low, high, relative = False):
+        self.low = low
+        self.high = high
+        self.relative = relative
+
+    def sample(self, random, base):
+        noise = random.uniform(self.low, self.high, np.shape(base))
+        return base * (1 + noise) if self.relative else base + noise
+
+
+class Triangular(object):
+    """Triangular noise between `low` and `high`, peaking at `mode`, around the base value, or relative to it if `relative`."""
+
+    def __init__(self, low, mode, high, relative = False):
+        self.low = low
+        self.mode = mode
+        self.high = high
+        self.relative = relative
+
+    def sample(self, random, base):
+        noise = random.triangular(self.low, self.mode, self.high, np.shape(base))
+        return base * (1 + noise) if self.relative else base + noise
+
+
+# ----- Summaries ----- #
+
+class MonteCarloSummary(object):
+    """Statistics of one variable over the samples of a Monte Carlo run.
+
+    `mean`, `std`, `min` and `max` hold one value per row. `totals` holds the sum over all
+    rows of each sample. `samples` (samples x rows) is only set if requested.
+    """
+
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        self.sample_count = 0
+        self._mean = np.zeros(count)
+        # Sum of the squared deviations from the mean, updated chunk by chunk (Chan et al.)
+        self._m2 = np.zeros(count)
+        self.min = np.full(count, np.inf)
+        self.max = np.full(count, -np.inf)
+        self.totals = []
+        self.samples = None
+        self._kept = None
+
+    def add(self, values, keep = False):
+        """Add `values`, of shape (samples, rows)."""
+        values = np.asarray(values, dtype = float)
+        previous_count, added_count = self.sample_count, len(values)
+        self.sample_count += added_count
+        added_mean = values.mean(axis = 0)
+        delta = added_mean - self._mean
+        self._mean += delta * (added_count / self.sample_count)
+        self._m2 += np.square(values - added_mean).sum(axis = 0) + np.square(delta) * (previous_count * added_count / self.sample_count)
+        np.minimum(self.min, values.min(axis = 0), out = self.min)
+        np.maximum(self.max, values.max(axis = 0), out = self.max)
+        self.totals.extend(values.sum(axis = 1).tolist())
+        if keep:
+            if self._kept is None:
+                self._kept = []
+            self._kept.append(values.astype(np.float32))
+
+    def finish(self):
+        self.totals = np.array(self.totals)
+        if self._kept is not None:
+            self.samples = np.concatenate(self._kept)
+            self._kept = None
+        return self
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2 / self.sample_count)
+
+    def row_percentiles(self, percentiles = DEFAULT_PERCENTILES):
+        """Return the `percentiles` of each row, as an array of shape (percentiles, rows)."""
+        if self.samples is None:
+            raise ValueError('Per-row percentiles require the samples: run monte_carlo with keep_samples = True.')
+        return np.percentile(self.samples, percentiles, axis = 0)
+
+    def total_percentiles(self, percentiles = DEFAULT_PERCENTILES):
+        """Return `{percentile: value}` of the portfolio total."""
+        return OrderedDict(zip(percentiles, np.percentile(self.totals, percentiles).tolist()))
+
+    def to_dict(self, percentiles = DEFAULT_PERCENTILES):
+        """Return the portfolio-wide statistics."""
+        return OrderedDict([
+            ('variable', self.name),
+            ('rows', self.count),
+            ('samples', self.sample_count),
+            ('total_mean', float(np.mean(self.totals))),
+            ('total_std', float(np.std(self.totals))),
+            ('total_percentiles', self.total_percentiles(percentiles)),
+            ])
+
+
+# ----- Sampling ----- #
+
+def monte_carlo(tax_benefit_system, columns, variables, samples, inputs = None, parameters = None,
+        period = DEFAULT_PERIOD, seed = 0, max_rows = DEFAULT_MAX_ROWS, keep_samples = False):
+    """Calculate `variables` over `samples` random variants of the population in `columns`.
+
+    `inputs` maps input variable names to distributions (e.g. `Normal(0.05, relative =
+    True)`), applied to each row's value. `parameters` maps dotted parameter paths to
+    distributions, applied to the parameter value once per sample. Sample `i` is drawn
+    from a generator seeded with `(seed, i)`, so results do not depend on `max_rows`.
+
+    Returns `{variable name: MonteCarloSummary}`.
+    """
+    if isinstance(variables, str):
+        variables = [variables]
+    inputs = OrderedDict(sorted((inputs or {}).items()))
+    parameters = OrderedDict(sorted((parameters or {}).items()))
+    period = periods.period(period)
+
+    base_columns = _base_columns(tax_benefit_system, columns, inputs)
+    count = len(next(iter(base_columns.values())))
+    snapshot = tax_benefit_system.get_parameters_at_instant(period.start)
+    base_parameters = dict(
+        (path, _parameter_value(tax_benefit_system, snapshot, path))
+        for path in parameters
+        )
+
+    summaries = OrderedDict((name, MonteCarloSummary(name, count)) for name in variables)
+    samples_per_chunk = max(1, max_rows // max(count, 1))
+    for first in range(0, samples, samples_per_chunk):
+        sample_indices = range(first, min(first + samples_per_chunk, samples))
+        drawn_inputs = dict((name, []) for name in inputs)
+        drawn_parameters = dict((path, []) for path in parameters)
+        for index in sample_indices:
+            random = np.random.RandomState([seed, index])
+            for name, distribution in inputs.items():
+                drawn_inputs[name].append(distribution.sample(random, base_columns[name]))
+            for path, distribution in parameters.items():
+                drawn_parameters[path].append(np.full(count, distribution.sample(random, base_parameters[path])))
+
+        tiles = len(sample_indices)
+        chunk_columns = OrderedDict(
+            (name, np.concatenate(drawn_inputs[name]) if name in inputs else _tile(values, tiles))
+            for name, values in base_columns.items()
+            )
+        simulation = build_simulation(tax_benefit_system, chunk_columns, period)
+        if parameters:
+            simulation.tax_benefit_system = VaryingParameterOverlay(tax_benefit_system, dict(
+                (path, np.concatenate(values)) for path, values in drawn_parameters.items()))
+        for name, summary in summaries.items():
+            values = simulation.calculate(name, period)
+            summary.add(np.asarray(values).reshape(tiles, count), keep_samples)
+
+    return OrderedDict((name, summary.finish()) for name, summary in summaries.items())
+
+
+def _base_columns(tax_benefit_system, columns, inputs):
+    base_columns = OrderedDict()
+    for name, values in columns.items():
+        variable = tax_benefit_system.variables.get(name)
+        if variable is None:
+            continue
+        values = values if isinstance(values, EnumArray) else to_input_array(variable, values)
+        if name in inputs and (variable.value_type in (Enum, str, bool) or np.asarray(values).dtype.kind not in 'iuf'):
+            raise ValueError("Only numeric inputs can be uncertain, not '{}'.".format(name))
+        base_columns[name] = values
+    missing = [name for name in inputs if name not in base_columns]
+    if missing:
+        raise ValueError('Uncertain inputs {} are not in the columns.'.format(', '.join(missing)))
+    return base_columns
+
+
+def _parameter_value(tax_benefit_system, snapshot, path):
+    get_parameter(tax_benefit_system.parameters, path)
+    value = snapshot
+    for name in path.split('.'):
+        value = value[name]
+    return value
+
+
+def _tile(values, tiles):
+    if isinstance(values, EnumArray):
+        return EnumArray(np.tile(np.asarray(values), tiles), values.possible_values)
+    return np.tile(values, tiles)
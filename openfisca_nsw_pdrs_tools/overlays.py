@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# This file lets a simulation read parameters with some of their values overridden.
+#
+# A `ParameterOverlay` stands in for a tax and benefit system: it forwards everything to
+# the system it wraps, except `get_parameters_at_instant`, which reads a copy of the
+# parameters with the overridden values. Installing an overlay as the
+# `tax_benefit_system` of a live simulation changes the parameters its next formulas
+# read, without building a reform or a new simulation, and leaves the arrays already
+# calculated in place.
+#
+# A `VaryingParameterOverlay` goes further and gives some parameters one value per row,
+# e.g. one sampled value per Monte Carlo sample (see `monte_carlo`).
+
+import numpy as np
+
+from openfisca_core import periods
+from openfisca_core.parameters import Parameter
+
+# Overrides without a start date apply at every instant
+EARLIEST_INSTANT = periods.instant('0001-01-01')
+
+
+def to_instant(instant):
+    """Return `instant` (an `Instant`, a `Period` or a string) as an `Instant`."""
+    if isinstance(instant, periods.Period):
+        return instant.start
+    if isinstance(instant, periods.Instant):
+        return instant
+    return periods.instant(instant)
+
+
+def get_parameter(parameters, path):
+    """Return the `Parameter` at the dotted `path` (e.g. `'AC.AC_load_factors_table.residential'`)."""
+    node = parameters
+    for name in path.split('.'):
+        children = getattr(node, 'children', None)
+        if children is None or name not in children:
+            raise ValueError("'{}' is not a parameter.".format(path))
+        node = children[name]
+    if not isinstance(node, Parameter):
+        raise ValueError("'{}' is a parameter node, not a parameter: override its parameters one by one.".format(path))
+    return node
+
+
+def override_parameters(parameters, overrides, start = None):
+    """Return a copy of `parameters` with the values of `overrides` from `start` onwards.
+
+    `overrides` maps dotted parameter paths to values. Without `start`, the values apply
+    at every instant.
+    """
+    parameters = parameters.clone()
+    start = EARLIEST_INSTANT if start is None else to_instant(start)
+    for path, value in overrides.items():
+        get_parameter(parameters, path).update(start = start, value = value)
+    return parameters
+
+
+class ParameterOverlay(object):
+    """Proxy of `tax_benefit_system` whose formulas read `overrides` instead of the actual values."""
+
+    def __init__(self, tax_benefit_system, overrides, start = None):
+        self.tax_benefit_system = tax_benefit_system
+        self.overrides = dict(overrides)
+        self.parameters = override_parameters(tax_benefit_system.parameters, self.overrides, start)
+        self._snapshots = {}
+
+    def get_parameters_at_instant(self, instant):
+        instant = to_instant(instant)
+        snapshot = self._snapshots.get(instant)
+        if snapshot is None:
+            snapshot = self._snapshots[instant] = self.parameters.get_at_instant(str(instant))
+        return snapshot
+
+    def __getattr__(self, name):
+        return getattr(self.tax_benefit_system, name)
+
+
+class VaryingParameterNode(object):
+    """Parameter node at instant in which some parameters hold one value per row.
+
+    `values` maps paths relative to `node` (tuples of names) to arrays. Formulas read these
+    parameters by name, e.g. `parameters(period).ROOA_fridge.ROOA_related_constants.LOAD_FACTOR`,
+    and get an array instead of a single value. Nodes holding no such parameter are
+    returned as they are, so they can still be looked up by enum. Tables compiled by
+    `lookups` look the cells holding one value per row up row by row.
+    """
+
+    def __init__(self, node, values):
+        self._node = node
+        self._values = values
+
+    def _child(self, name):
+        if (name,) in self._values:
+            return self._values[(name,)]
+        child = self._node[name]
+        nested = dict((path[1:], value) for path, value in self._values.items() if path[0] == name)
+        return VaryingParameterNode(child, nested) if nested else child
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._child(name)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._child(key)
+        raise ValueError('Parameters with one value per row ({}) cannot be looked up by enum: read them by name.'.format(
+            ', '.join(sorted('.'.join(path) for path in self._values))))
+
+    def __iter__(self):
+        return iter(self._node)
+
+    def per_row(self, build, enums = ()):
+        """Return `build(node)` for the underlying node, e.g. a table compiled by `lookups`.
+
+        `enums` are the axes of an enum table: the cells of the table holding one value per
+        row are then looked up row by row, in a `VaryingTable`. Scales cannot hold one value
+        per row, and are returned as they are.
+        """
+        result = build(self._node)
+        cells = {}
+        for path, values in self._values.items():
+            index = _enum_index(path, enums)
+            if index is not None:
+                cells[index] = values
+        return VaryingTable(result, cells) if cells else result
+
+
+def _enum_index(path, enums):
+    # Position of the table cell at `path`, or None if `path` is not a cell of the table
+    if not enums or len(path) != len(enums):
+        return None
+    index = []
+    for name, enum in zip(path, enums):
+        names = [item.name for item in enum]
+        if name not in names:
+            return None
+        index.append(names.index(name))
+    return tuple(index)
+
+
+class VaryingTable(object):
+    """Table compiled by `lookups.enum_table`, some of whose cells hold one value per row."""
+
+    def __init__(self, table, cells):
+        self.table = table
+        self.cells = cells
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        values = self.table[key]
+        for index, cell_values in self.cells.items():
+            rows = np.logical_and.reduce([np.asarray(component) == position for component, position in zip(key, index)])
+            values = np.where(rows, cell_values, values)
+        return values
+
+
+class VaryingParameterOverlay(object):
+    """Proxy of `tax_benefit_system` whose formulas read one value per row for some parameters.
+
+    `values` maps dotted parameter paths to arrays of one value per row. Folded variables
+    (see `folding`) fall back to their original formulas under such an overlay.
+    """
+
+    def __init__(self, tax_benefit_system, values):
+        self.tax_benefit_system = tax_benefit_system
+        for path in values:
+            get_parameter(tax_benefit_system.parameters, path)
+        self.values = dict((tuple(path.split('.')), value) for path, value in values.items())
+
+    def get_parameters_at_instant(self, instant):
+        return VaryingParameterNode(self.tax_benefit_system.get_parameters_at_instant(instant), self.values)
+
+    def __getattr__(self, name):
+        return getattr(self.tax_benefit_system, name)
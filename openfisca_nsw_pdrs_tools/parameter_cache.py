@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# This file memoises the parameter snapshots formulas get from `parameters(period)`.
+#
+# `install_parameter_cache` replaces the `get_parameters_at_instant` method of one tax
+# and benefit system, which is what OpenFisca passes to formulas as `parameters`, with a
+# bounded, thread-safe LRU cache keyed by instant. Every simulation of that system, in
+# any thread, then shares the same snapshots.
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from openfisca_core import periods
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+DEFAULT_MAXSIZE = 32
+
+
+class ParameterSnapshotCache(object):
+    """Least recently used cache of the parameters of a tax and benefit system, by instant."""
+
+    def __init__(self, tax_benefit_system, maxsize = DEFAULT_MAXSIZE):
+        self.tax_benefit_system = tax_benefit_system
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, instant):
+        if isinstance(instant, periods.Period):
+            instant = instant.start
+        elif not isinstance(instant, periods.Instant):
+            instant = periods.instant(instant)
+
+        with self._lock:
+            snapshot = self._snapshots.get(instant)
+            if snapshot is not None:
+                self.hits += 1
+                self._snapshots.move_to_end(instant)
+                return snapshot
+
+            self.misses += 1
+            snapshot = self.tax_benefit_system.parameters.get_at_instant(str(instant))
+            self._snapshots[instant] = snapshot
+            if len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last = False)
+            return snapshot
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._snapshots))
+
+    def cache_clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self.hits = self.misses = 0
+
+
+def install_parameter_cache(tax_benefit_system, maxsize = DEFAULT_MAXSIZE):
+    """Make `tax_benefit_system` resolve parameters through a `ParameterSnapshotCache`.
+
+    Returns the cache, whose `cache_info()` reports hits and misses. Parameters modified
+    after the cache is installed must be followed by a `cache_clear()`.
+    """
+    cache = ParameterSnapshotCache(tax_benefit_system, maxsize)
+    tax_benefit_system.get_parameters_at_instant = cache
+    return cache
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+# This file locates the PDRS extension, whose directory holds nothing but the variables,
+# parameters and tests: OpenFisca loads every Python module under it as a variables file.
+
+import os
+import sys
+
+import openfisca_nsw_pdrs
+
+EXTENSION_NAME = 'openfisca_nsw_pdrs'
+EXTENSION_DIR = os.path.dirname(os.path.abspath(openfisca_nsw_pdrs.__file__))
+PARAMETERS_DIR = os.path.join(EXTENSION_DIR, 'parameters')
+VARIABLES_DIR = os.path.join(EXTENSION_DIR, 'variables')
+
+# Modules of the bulk calculation tools
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_extension_variable(variable):
+    """Return whether `variable` is defined by a module under the extension directory."""
+    path = getattr(sys.modules.get(type(variable).__module__), '__file__', None)
+    return path is not None and os.path.abspath(path).startswith(EXTENSION_DIR + os.sep)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# This file records where the time of a calculation goes, formula by formula.
+#
+# A `Profiler` wraps the formulas of the PDRS variables of a tax and benefit system, and
+# the `get_parameters_at_instant` method formulas get as `parameters`. Each formula run and
+# each `parameters(period)` lookup is recorded as a call, nested under the formula which
+# triggered it, so the recorded calls form the dependency tree actually evaluated.
+# Variables read from the cache or from inputs do not run a formula and do not appear.
+#
+# The calls can be summarised per variable, or exported as a Chrome trace (to open in
+# chrome://tracing, Perfetto or speedscope) or as folded stacks (for flamegraph.pl):
+#
+#     with profile(tax_benefit_system) as profiler:
+#         simulation.calculate('PDRS__Air_Conditioner__peak_demand_savings', '2021')
+#     profiler.write_chrome_trace('trace.json')
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from openfisca_nsw_pdrs_tools.dependencies import run_formula
+from openfisca_nsw_pdrs_tools.paths import is_extension_variable
+
+PARAMETERS_CALL_NAME = 'parameters(period)'
+
+
+class Call(object):
+    """One formula run or parameters lookup, with the calls it triggered."""
+
+    __slots__ = ['name', 'period', 'thread', 'start', 'seconds', 'rows', 'result_bytes', 'allocated_bytes', 'children']
+
+    def __init__(self, name, period, thread, start):
+        self.name = name
+        self.period = period
+        self.thread = thread
+        self.start = start
+        self.seconds = 0.0
+        self.rows = 0
+        self.result_bytes = 0
+        self.allocated_bytes = None
+        self.children = []
+
+    @property
+    def self_seconds(self):
+        return self.seconds - sum(child.seconds for child in self.children)
+
+    def to_dict(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('period', self.period),
+            ('seconds', self.seconds),
+            ('self_seconds', self.self_seconds),
+            ('rows', self.rows),
+            ('result_bytes', self.result_bytes),
+            ('allocated_bytes', self.allocated_bytes),
+            ('children', [child.to_dict() for child in self.children]),
+            ])
+
+
+class Stats(object):
+    """Totals of the calls of one formula, or of the parameters lookups."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.rows = 0
+        self.result_bytes = 0
+        self.allocated_bytes = 0
+
+    def add(self, call):
+        self.calls += 1
+        self.seconds += call.seconds
+        self.self_seconds += call.self_seconds
+        self.rows += call.rows
+        self.result_bytes += call.result_bytes
+        self.allocated_bytes += call.allocated_bytes or 0
+
+    def to_dict(self):
+        return OrderedDict((key, getattr(self, key)) for key in (
+            'name', 'calls', 'seconds', 'self_seconds', 'rows', 'result_bytes', 'allocated_bytes'))
+
+
+class Profiler(object):
+    """Records the formula runs and parameters lookups of one tax and benefit system.
+
+    `seconds` are inclusive of nested calls, `self_seconds` exclude them. With
+    `trace_memory`, `allocated_bytes` is the growth of the memory traced by `tracemalloc`
+    during a call, i.e. what the call allocated and did not free.
+    """
+
+    def __init__(self, tax_benefit_system, trace_memory = False):
+        self.tax_benefit_system = tax_benefit_system
+        self.trace_memory = trace_memory
+        self.calls = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original_formulas = None
+        self._original_parameters = None
+        self._started_tracemalloc = False
+
+    # ----- Installing ----- #
+
+    def install(self):
+        if self._original_formulas is not None:
+            return
+        self._original_formulas = {}
+        for name, variable in self.tax_benefit_system.variables.items():
+            if not variable.formulas or not is_extension_variable(variable):
+                continue
+            self._original_formulas[name] = dict(variable.formulas)
+            for start, formula in list(variable.formulas.items()):
+                variable.formulas[start] = self._profiled_formula(name, formula)
+
+        # Instance attribute set by e.g. `install_parameter_cache`, if any
+        self._original_parameters = self.tax_benefit_system.__dict__.get('get_parameters_at_instant')
+        self.tax_benefit_system.get_parameters_at_instant = self._profiled_parameters(
+            self.tax_benefit_system.get_parameters_at_instant)
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def uninstall(self):
+        if self._original_formulas is None:
+            return
+        for name, formulas in self._original_formulas.items():
+            self.tax_benefit_system.variables[name].formulas.update(formulas)
+        self._original_formulas = None
+
+        if self._original_parameters is None:
+            del self.tax_benefit_system.get_parameters_at_instant
+        else:
+            self.tax_benefit_system.get_parameters_at_instant = self._original_parameters
+        self._original_parameters = None
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _profiled_formula(self, name, formula):
+
+        # OpenFisca always passes `parameters` to this wrapper, which passes it on only if `formula` takes it
+        def profiled_formula(population, period, parameters):
+            call = self._enter(name, period)
+            result = None
+            try:
+                result = run_formula(formula, population, period, parameters)
+                return result
+            finally:
+                self._exit(call, result)
+
+        profiled_formula.__wrapped__ = formula
+        return profiled_formula
+
+    def _profiled_parameters(self, get_parameters_at_instant):
+
+        def profiled_parameters(instant):
+            call = self._enter(PARAMETERS_CALL_NAME, instant)
+            try:
+                return get_parameters_at_instant(instant)
+            finally:
+                self._exit(call, None)
+
+        return profiled_parameters
+
+    def _enter(self, name, period):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        call = Call(name, str(period), threading.get_ident(), time.perf_counter())
+        if self.trace_memory:
+            call.allocated_bytes = tracemalloc.get_traced_memory()[0]
+        if stack:
+            stack[-1].children.append(call)
+        else:
+            with self._lock:
+                self.calls.append(call)
+        stack.append(call)
+        return call
+
+    def _exit(self, call, result):
+        call.seconds = time.perf_counter() - call.start
+        if call.allocated_bytes is not None:
+            call.allocated_bytes = tracemalloc.get_traced_memory()[0] - call.allocated_bytes
+        if result is not None:
+            call.rows = int(np.size(result))
+            call.result_bytes = int(getattr(result, 'nbytes', 0))
+        self._local.stack.pop()
+
+    # ----- Reporting ----- #
+
+    def iter_calls(self):
+        """Yield `(stack, call)` for every recorded call, `stack` being the names of its callers."""
+        with self._lock:
+            pending = [((), call) for call in reversed(self.calls)]
+        while pending:
+            stack, call = pending.pop()
+            yield stack, call
+            pending.extend(((stack + (call.name,)), child) for child in reversed(call.children))
+
+    def stats(self):
+        """Return `{name: Stats}` for every formula and for the parameters lookups, slowest first."""
+        stats = {}
+        for _, call in self.iter_calls():
+            if call.name not in stats:
+                stats[call.name] = Stats(call.name)
+            stats[call.name].add(call)
+        return OrderedDict(
+            (name, stats[name])
+            for name in sorted(stats, key = lambda name: stats[name].self_seconds, reverse = True)
+            )
+
+    def report(self):
+        """Return the stats as a text table."""
+        lines = ['{:<55} {:>7} {:>10} {:>10} {:>12} {:>14}'.format(
+            'name', 'calls', 'seconds', 'self', 'rows', 'result bytes')]
+        for stats in self.stats().values():
+            lines.append('{:<55} {:>7} {:>10.4f} {:>10.4f} {:>12} {:>14}'.format(
+                stats.name, stats.calls, stats.seconds, stats.self_seconds, stats.rows, stats.result_bytes))
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        with self._lock:
+            calls = list(self.calls)
+        return OrderedDict([
+            ('stats', [stats.to_dict() for stats in self.stats().values()]),
+            ('calls', [call.to_dict() for call in calls]),
+            ])
+
+    def chrome_trace(self):
+        """Return the calls in the Chrome trace event format, as a JSON-serialisable dict."""
+        pid = os.getpid()
+        events = []
+        for _, call in self.iter_calls():
+            events.append(OrderedDict([
+                ('name', call.name),
+                ('cat', 'parameters' if call.name == PARAMETERS_CALL_NAME else 'formula'),
+                ('ph', 'X'),
+                ('ts', (call.start - self.origin) * 1e6),
+                ('dur', call.seconds * 1e6),
+                ('pid', pid),
+                ('tid', call.thread),
+                ('args', OrderedDict([
+                    ('period', call.period),
+                    ('rows', call.rows),
+                    ('result_bytes', call.result_bytes),
+                    ('allocated_bytes', call.allocated_bytes),
+                    ])),
+                ]))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def folded_stacks(self):
+        """Return the calls as folded stacks: one `caller;...;name self-microseconds` line per stack."""
+        totals = OrderedDict()
+        for stack, call in self.iter_calls():
+            key = ';'.join(stack + (call.name,))
+            totals[key] = totals.get(key, 0) + call.self_seconds
+        return ''.join('{} {}\n'.format(key, int(round(seconds * 1e6))) for key, seconds in totals.items())
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+    def write_folded_stacks(self, path):
+        with open(path, 'w') as stacks_file:
+            stacks_file.write(self.folded_stacks())
+
+    def write(self, path):
+        """Write a folded stacks file if `path` ends with `.folded`, else a Chrome trace."""
+        if os.path.splitext(path)[1].lower() == '.folded':
+            self.write_folded_stacks(path)
+        else:
+            self.write_chrome_trace(path)
+
+
+@contextmanager
+def profile(tax_benefit_system, trace_memory = False):
+    """Profile the calculations run with `tax_benefit_system` within the `with` block.
+
+    Yields the `Profiler`, whose records remain available after the block.
+    """
+    profiler = Profiler(tax_benefit_system, trace_memory)
+    profiler.install()
+    try:
+        yield profiler
+    finally:
+        profiler.uninstall()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+# This file serves PDRS calculations asynchronously, batching concurrent requests together.
+#
+# A `CalculationService` accepts scenarios from any number of concurrent requests. Scenarios
+# asking for the same variables and period are queued together for up to `batch_window`
+# seconds (or until `max_batch_size` of them are queued), then calculated in one vectorised
+# simulation by a pool of worker processes. The workers are started and warmed up with the
+# service: where processes are forked, they inherit the tax and benefit system built by the
+# service instead of each loading their own.
+#
+# `create_app` exposes the service over HTTP with aiohttp, an optional dependency:
+#
+#     pip install openfisca_nsw_pdrs[service]
+#     openfisca-pdrs-serve --port 8000 --workers 4 --batch-window-ms 5
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from openfisca_nsw_pdrs_tools import batch
+from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+from openfisca_nsw_pdrs_tools.web_api import ScenarioError, calculate_scenarios, check_variables
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_WINDOW = 0.005
+DEFAULT_MAX_BATCH_SIZE = 10000
+DEFAULT_MAX_QUEUE_DEPTH = 100000
+LATENCY_SAMPLES = 10000
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class ServiceOverloaded(Exception):
+    """Raised when a scenario is submitted while `max_queue_depth` scenarios are pending."""
+
+
+def _calculate_scenarios_in_worker(scenarios, variables, period):
+    return calculate_scenarios(batch._worker_tax_benefit_system, scenarios, variables, period)
+
+
+def _warm_up_worker():
+    # Runs in each worker once it has built (or inherited) its tax and benefit system
+    return batch._worker_tax_benefit_system is not None
+
+
+class ServiceMetrics(object):
+    """Counters, queue depth and latencies of a `CalculationService`."""
+
+    def __init__(self):
+        self.scenarios = 0
+        self.batches = 0
+        self.rejected = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latencies = deque(maxlen = LATENCY_SAMPLES)
+        self.batch_sizes = deque(maxlen = LATENCY_SAMPLES)
+
+    def to_dict(self):
+        """Return the metrics, with latency percentiles in milliseconds over the last scenarios."""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'scenarios': self.scenarios,
+            'batches': self.batches,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            'latency_ms': dict(
+                ('p{}'.format(percentile), float(np.percentile(latencies, percentile)) if len(latencies) else None)
+                for percentile in LATENCY_PERCENTILES
+                ),
+            }
+
+
+class CalculationService(object):
+    """Calculates scenarios in micro-batches on a pool of warm worker processes.
+
+    Use it from a running event loop: `await service.start()`, then `await
+    service.calculate(scenario, variables, period)` from any number of tasks.
+    """
+
+    def __init__(self, workers = DEFAULT_WORKERS, batch_window = DEFAULT_BATCH_WINDOW,
+            max_batch_size = DEFAULT_MAX_BATCH_SIZE, max_queue_depth = DEFAULT_MAX_QUEUE_DEPTH,
+            system_options = None):
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_queue_depth = max_queue_depth
+        self.system_options = system_options or {}
+        self.metrics = ServiceMetrics()
+        self.tax_benefit_system = None
+        self._executor = None
+        # Scenarios waiting for their batch, and the timer flushing it, by (variables, period)
+        self._pending = {}
+        self._timers = {}
+        # Batches sent to the workers and not answered yet
+        self._batches = set()
+
+    async def start(self):
+        self.tax_benefit_system = build_tax_benefit_system(**self.system_options)
+        # Forked workers inherit the system already built here instead of building their own.
+        previous, batch._worker_tax_benefit_system = batch._worker_tax_benefit_system, self.tax_benefit_system
+        try:
+            self._executor = ProcessPoolExecutor(
+                self.workers, initializer = batch._init_worker, initargs = (self.system_options,))
+            # One task per worker starts every worker now rather than on the first requests
+            warm_ups = [self._executor.submit(_warm_up_worker) for _ in range(self.workers)]
+        finally:
+            batch._worker_tax_benefit_system = previous
+        await asyncio.gather(*(asyncio.wrap_future(warm_up) for warm_up in warm_ups))
+        log.info('Calculation service started with %d warm workers.', self.workers)
+
+    async def stop(self):
+        """Calculate the pending scenarios, then stop the workers."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions = True)
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Waiting for the workers to exit must not block the event loop
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def calculate(self, scenario, variables = None, period = DEFAULT_PERIOD):
+        """Return the `{variable name: value}` results of one `{input variable name: value}` scenario.
+
+        Raises a `ScenarioError` if `variables` are not variable names of the system.
+        """
+        # Checked before the variables key the queue: a malformed list fails this request only
+        variables = check_variables(self.tax_benefit_system, variables)
+        if self.metrics.queue_depth >= self.max_queue_depth:
+            self.metrics.rejected += 1
+            raise ServiceOverloaded('{} scenarios are already pending.'.format(self.metrics.queue_depth))
+
+        start = time.perf_counter()
+        key = (tuple(variables), str(period))
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((scenario, future))
+        self.metrics.queue_depth += 1
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.metrics.queue_depth)
+
+        if len(self._pending[key]) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.batch_window, self._flush, key)
+
+        try:
+            return await future
+        finally:
+            self.metrics.queue_depth -= 1
+            self.metrics.scenarios += 1
+            self.metrics.latencies.append(time.perf_counter() - start)
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        requests = self._pending.pop(key, [])
+        if requests:
+            task = asyncio.ensure_future(self._run_batch(key, requests))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, key, requests):
+        variables, period = key
+        self.metrics.batches += 1
+        self.metrics.batch_sizes.append(len(requests))
+        scenarios = [scenario for scenario, _ in requests]
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            for _, future in requests:
+                self._fail(future, RuntimeError('The calculation service is not running.'))
+            return
+        try:
+            results = await loop.run_in_executor(
+                self._executor, _calculate_scenarios_in_worker, scenarios, list(variables), period)
+        except ScenarioError as error:
+            if len(requests) == 1:
+                self._fail(requests[0][1], error)
+                return
+            # One invalid scenario must not fail the others: calculate each on its own
+            await asyncio.gather(*(self._run_batch(key, [request]) for request in requests))
+            return
+        except Exception as error:
+            for _, future in requests:
+                self._fail(future, error)
+            return
+
+        for (_, future), result in zip(requests, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, future, error):
+        self.metrics.errors += 1
+        if not future.done():
+            future.set_exception(error)
+
+
+# ----- HTTP interface ----- #
+
+def create_app(service):
+    """Return an aiohttp application serving `service`.
+
+    `POST /calculate/batch` takes the same payload as the web API endpoint of the same name
+    (see `web_api`); its scenarios are batched with those of concurrent requests.
+    `GET /metrics` returns the `ServiceMetrics`.
+    """
+    # aiohttp is an optional dependency: it is only needed to serve the service over HTTP.
+    try:
+        from aiohttp import web
+    except ImportError:
+        raise ImportError("The calculation service requires aiohttp. Install it with `pip install openfisca_nsw_pdrs[service]`.")
+
+    async def calculate_batch(request):
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            return web.json_response({'error': 'The request body must be a JSON object.'}, status = 400)
+        scenarios = payload.get('scenarios', [])
+        if not isinstance(scenarios, list) or not all(isinstance(scenario, dict) for scenario in scenarios):
+            return web.json_response({'error': 'Scenarios must be a list of objects mapping input variables to values.'}, status = 400)
+        variables = payload.get('variables')
+        period = str(payload.get('period', DEFAULT_PERIOD))
+
+        try:
+            variables = check_variables(service.tax_benefit_system, variables)
+            results = await asyncio.gather(*(service.calculate(scenario, variables, period) for scenario in scenarios))
+        except ScenarioError as error:
+            return web.json_response({'error': str(error)}, status = 400)
+        except ServiceOverloaded as error:
+            return web.json_response({'error': str(error)}, status = 503)
+        return web.json_response({'period': period, 'results': results})
+
+    async def get_metrics(request):
+        return web.json_response(service.metrics.to_dict())
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.stop()
+
+    app = web.Application()
+    app.router.add_post('/calculate/batch', calculate_batch)
+    app.router.add_get('/metrics', get_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description = 'Serve PDRS calculations, batching concurrent requests.')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type = int, default = 8000, help = 'port to listen on (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type = int, default = DEFAULT_WORKERS,
+        help = 'number of worker processes (default: %(default)s)')
+    parser.add_argument('--batch-window-ms', type = float, default = DEFAULT_BATCH_WINDOW * 1000,
+        help = 'how long scenarios wait for others to batch with (default: %(default)s)')
+    parser.add_argument('--max-batch-size', type = int, default = DEFAULT_MAX_BATCH_SIZE,
+        help = 'scenarios calculated together at most (default: %(default)s)')
+    parser.add_argument('--max-queue-depth', type = int, default = DEFAULT_MAX_QUEUE_DEPTH,
+        help = 'pending scenarios above which requests are rejected (default: %(default)s)')
+    parser.add_argument('--cache-dir', default = None,
+        help = 'directory caching the parsed parameters between runs (default: $OPENFISCA_NSW_PDRS_CACHE_DIR)')
+    parser.add_argument('--fold-constants', action = 'store_true',
+        help = 'compute variables depending only on parameters and enum inputs once per combination of inputs')
+    parser.add_argument('--lazy', action = 'store_true',
+        help = 'only load the variables and parameters of the activities calculated')
+    return parser
+
+
+def main(argv = None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    service = CalculationService(
+        workers = args.workers,
+        batch_window = args.batch_window_ms / 1000,
+        max_batch_size = args.max_batch_size,
+        max_queue_depth = args.max_queue_depth,
+        system_options = {'cache_dir': args.cache_dir, 'fold_constants': args.fold_constants, 'lazy': args.lazy},
+        )
+    app = create_app(service)
+    from aiohttp import web
+    web.run_app(app, host = args.host, port = args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# This file recalculates variables over a population for many candidate parameter values.
+#
+# `sweep` builds one simulation for the population, then calculates the requested
+# variables once per scenario of a parameter grid, with a `ParameterOverlay` installed as
+# the simulation's tax and benefit system. Between scenarios, only the variables reading
+# a swept parameter, directly or not, are dropped from the simulation: the others, such
+# as the AC baseline power input or the existing motor efficiency when only the
+# contribution factor is swept, are calculated once and reused by every scenario.
+#
+#     scenarios, results = sweep(tax_benefit_system, columns, 'PDRS__ROOA__peak_demand_savings', {
+#         'PDRS_wide_constants.CONTRIBUTION_FACTOR': [0.8, 1, 1.2],
+#         'PDRS_wide_constants.DAILY_PEAK_WINDOW_HOURS': [5, 6],
+#         })
+#     results['PDRS__ROOA__peak_demand_savings']  # shape (6, population size)
+
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core import periods
+
+from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD, build_simulation, to_output_array
+from openfisca_nsw_pdrs_tools.dependencies import dependency_graph, downstream, resolve_parameter_path
+from openfisca_nsw_pdrs_tools.overlays import ParameterOverlay, get_parameter
+
+# Scenario key holding the period to calculate, to sweep over dates as well as values
+PERIOD_KEY = 'period'
+
+
+def parameter_grid(grid):
+    """Return the list of scenarios of `grid`, each a `{parameter path: value}` dict.
+
+    `grid` is either a list of scenarios, returned as is, or a `{parameter path: candidate
+    values}` dict, whose scenarios are all the combinations of candidate values, in the
+    order of `itertools.product`.
+    """
+    if isinstance(grid, dict):
+        paths = list(grid)
+        return [OrderedDict(zip(paths, values)) for values in itertools.product(*(grid[path] for path in paths))]
+    return [OrderedDict(scenario) for scenario in grid]
+
+
+def swept_variables(tax_benefit_system, variables, paths):
+    """Return the variables among `variables` and their dependencies which depend on `paths`.
+
+    `paths` are dotted parameter paths, or `PERIOD_KEY`, on which every variable reading
+    a parameter depends. If a formula cannot be analysed, every variable with a formula
+    is returned.
+    """
+    graph = dependency_graph(tax_benefit_system, variables)
+    if any(dependencies.opaque for dependencies in graph.values()):
+        return set(name for name in graph if tax_benefit_system.variables[name].formulas)
+
+    swept_paths = [tuple(path.split('.')) for path in paths if path != PERIOD_KEY]
+
+    def reads_swept_parameter(dependencies):
+        if PERIOD_KEY in paths:
+            return bool(dependencies.parameters)
+        for path in dependencies.parameters:
+            read = resolve_parameter_path(tax_benefit_system.parameters, path)
+            if any(read == swept[:len(read)] or swept == read[:len(swept)] for swept in swept_paths):
+                return True
+        return False
+
+    stale = [name for name, dependencies in graph.items() if reads_swept_parameter(dependencies)]
+    return downstream(graph, stale)
+
+
+def sweep(tax_benefit_system, columns, variables, grid, period = DEFAULT_PERIOD, start = None):
+    """Calculate `variables` for every row of `columns` and every scenario of `grid`.
+
+    Returns `(scenarios, results)`: the scenarios of `parameter_grid(grid)`, and an
+    `OrderedDict` mapping each variable to an array of shape (scenarios, rows). A
+    scenario may set `PERIOD_KEY` to calculate another period than `period`. Overridden
+    values apply from `start` onwards, or at every instant without `start`.
+    """
+    if isinstance(variables, str):
+        variables = [variables]
+    scenarios = parameter_grid(grid)
+    paths = set().union(*scenarios) if scenarios else set()
+    for path in paths - set([PERIOD_KEY]):
+        get_parameter(tax_benefit_system.parameters, path)
+
+    simulation = build_simulation(tax_benefit_system, columns, period)
+    stale = swept_variables(tax_benefit_system, variables, paths)
+    results = OrderedDict((name, []) for name in variables)
+    for scenario in scenarios:
+        overrides = dict((path, value) for path, value in scenario.items() if path != PERIOD_KEY)
+        scenario_period = periods.period(scenario.get(PERIOD_KEY, period))
+        for name in stale:
+            simulation.get_holder(name).delete_arrays()
+
+        simulation.tax_benefit_system = ParameterOverlay(tax_benefit_system, overrides, start)
+        try:
+            for name in variables:
+                results[name].append(to_output_array(simulation.calculate(name, scenario_period)))
+        finally:
+            simulation.tax_benefit_system = tax_benefit_system
+
+    return scenarios, OrderedDict((name, np.stack(values) if values else np.empty((0, 0))) for name, values in results.items())
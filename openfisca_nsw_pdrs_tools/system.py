@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# This file builds the tax and benefit system used by the bulk calculation tools.
+#
+# The PDRS variables use the entities defined in openfisca_nsw_base, so the system is
+# built the same way `make test` builds it: the NSW base country package, with the
+# `openfisca_nsw_pdrs` package loaded on top of it as an extension.
+
+
+from openfisca_nsw_pdrs_tools import compiler, folding, system_cache
+from openfisca_nsw_pdrs_tools.compact import compact_system
+from openfisca_nsw_pdrs_tools.lazy import install_lazy_extension
+from openfisca_nsw_pdrs_tools.parameter_cache import install_parameter_cache
+from openfisca_nsw_pdrs_tools.paths import EXTENSION_DIR, EXTENSION_NAME, PARAMETERS_DIR, VARIABLES_DIR  # noqa: F401
+from openfisca_nsw_pdrs_tools.timeline import use_implementation_dates
+
+
+def build_tax_benefit_system(cache_dir = None, parameter_cache_size = None, fold_constants = False, compact = False,
+        compile_formulas = False, lazy = False, implementation_dates = False):
+    """Return the NSW base tax and benefit system with the PDRS extension loaded.
+
+    If `cache_dir` (or the `OPENFISCA_NSW_PDRS_CACHE_DIR` environment variable) is set,
+    the PDRS parameters are read from an on-disk cache instead of their YAML files
+    whenever the `parameters/` and `variables/` directories are unchanged.
+
+    If `parameter_cache_size` is set, parameter snapshots are memoised by instant in a
+    `ParameterSnapshotCache` of that size, available as `get_parameters_at_instant`.
+
+    If `lazy` is set, each PDRS variables module and top-level parameter node is only
+    loaded when first used (see `lazy`), and `cache_dir` is ignored. The options below
+    go through every variable, and so load them all.
+
+    If `fold_constants` is set, variables which only depend on parameters and enum inputs
+    are computed once per instant and looked up per building (see `folding`).
+
+    If `compile_formulas` is set, the formulas of the PDRS variables are replaced by
+    kernels running the formulas of everything they read at once (see `compiler`).
+
+    If `compact` is set, enum variables are stored on one byte, and the batch tools
+    evict intermediate variables once they are no longer needed (see `compact`).
+
+    If `implementation_dates` is set, the batch tools read the parameters of each row at
+    the date of its `implementation_date` column (see `timeline`).
+    """
+    from openfisca_nsw_base import CountryTaxBenefitSystem as BaseTaxBenefitSystem
+
+    tax_benefit_system = BaseTaxBenefitSystem()
+    cache_dir = system_cache.get_cache_dir(cache_dir)
+    if lazy:
+        install_lazy_extension(tax_benefit_system)
+    elif cache_dir is None:
+        tax_benefit_system.load_extension(EXTENSION_NAME)
+    else:
+        # Same steps as `TaxBenefitSystem.load_extension`, with cached parameters.
+        tax_benefit_system.add_variables_from_directory(EXTENSION_DIR)
+        parameters = system_cache.load_parameters(PARAMETERS_DIR, [PARAMETERS_DIR, VARIABLES_DIR], cache_dir)
+        tax_benefit_system.parameters.merge(parameters)
+
+    if parameter_cache_size:
+        install_parameter_cache(tax_benefit_system, parameter_cache_size)
+    if fold_constants:
+        folding.fold_constants(tax_benefit_system)
+    if compile_formulas:
+        compiler.compile_formulas(tax_benefit_system)
+    if compact:
+        compact_system(tax_benefit_system)
+    if implementation_dates:
+        use_implementation_dates(tax_benefit_system)
+    return tax_benefit_system
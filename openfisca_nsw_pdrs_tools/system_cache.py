@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# This file caches the PDRS parameter tree on disk, to cut the start-up time of processes
+# which build the tax and benefit system, e.g. serverless workers and batch workers.
+#
+# The cache is keyed by a content hash of the `parameters/` and `variables/` directories,
+# so editing, adding or removing any file under them invalidates it. Variables themselves
+# are not pickled: their classes live in modules OpenFisca names after the system loading
+# them, so they are re-imported on each start, from the `__pycache__` bytecode Python
+# keeps next to each variables file.
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from openfisca_core.parameters import ParameterNode
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR_ENVIRONMENT_VARIABLE = 'OPENFISCA_NSW_PDRS_CACHE_DIR'
+CACHE_FILE_PREFIX = 'parameters-'
+HASHED_EXTENSIONS = ('.py', '.yaml', '.yml')
+
+
+def get_cache_dir(cache_dir = None):
+    """Return the cache directory to use, or None if caching is disabled."""
+    return cache_dir or os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE) or None
+
+
+def content_hash(*directories):
+    """Return a hash of the name and content of every source file under `directories`."""
+    digest = hashlib.sha256()
+    digest.update(_environment_key().encode())
+    for directory in directories:
+        for root, dir_names, file_names in os.walk(directory):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if not file_name.endswith(HASHED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(path, os.path.dirname(directory)).encode())
+                with open(path, 'rb') as source_file:
+                    digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+def _environment_key():
+    # Pickles depend on the Python and OpenFisca-Core versions which wrote them.
+    try:
+        import pkg_resources
+        core_version = pkg_resources.get_distribution('OpenFisca-Core').version
+    except Exception:
+        core_version = 'unknown'
+    return 'python-{}.{} openfisca-core-{}'.format(sys.version_info[0], sys.version_info[1], core_version)
+
+
+def load_parameters(parameters_dir, key_directories, cache_dir):
+    """Return the `ParameterNode` of `parameters_dir`, read from `cache_dir` when possible.
+
+    On a cache miss the YAML files are parsed and the resulting tree is written to the
+    cache, replacing any entry left by a previous version of the files.
+    """
+    key = content_hash(*key_directories)
+    cache_path = os.path.join(cache_dir, CACHE_FILE_PREFIX + key + '.pickle')
+
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                return pickle.load(cache_file)
+        except Exception:
+            log.warning("Ignoring unreadable parameter cache '%s'.", cache_path, exc_info = True)
+
+    parameters = ParameterNode(directory_path = parameters_dir)
+    try:
+        _write_cache(cache_dir, cache_path, parameters)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # e.g. a parameter holding an object pickle cannot serialise: the parsed tree is still valid
+        log.warning("Could not write the parameter cache to '%s'.", cache_dir, exc_info = True)
+    return parameters
+
+
+def _write_cache(cache_dir, cache_path, parameters):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file first so that concurrent processes never read a partial cache.
+    file_descriptor, temporary_path = tempfile.mkstemp(dir = cache_dir, suffix = '.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temporary_file:
+            pickle.dump(parameters, temporary_file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+    for file_name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file_name)
+        if file_name.startswith(CACHE_FILE_PREFIX) and path != cache_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
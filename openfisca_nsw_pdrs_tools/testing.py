@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# This file holds the helpers shared by the Python tests and the benchmarks: synthetic
+# `Building` populations with realistic distributions of the AC, motors and appliance
+# inputs, and tax and benefit systems built once per process.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from openfisca_core.indexed_enums import EnumArray
+
+from openfisca_nsw_pdrs_tools.batch import open_writer
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+SEED = 20210101
+
+# Share of each enum value in the synthetic populations, in enum declaration order
+ENUM_DISTRIBUTIONS = {
+    'PDRS__Air_Conditioner__AC_type': {
+        'type_1': 0.06, 'type_2': 0.03, 'type_3': 0.02, 'type_4': 0.03, 'type_5': 0.08,
+        'type_6': 0.45, 'type_7': 0.18, 'type_8': 0.05, 'type_9': 0.04, 'type_10': 0.06,
+        },
+    'PDRS__Appliance__installation_type': {'new': 0.35, 'replacement': 0.65},
+    'PDRS__Appliance__zone_type': {'hot': 0.20, 'average': 0.60, 'cold': 0.20},
+    'PDRS__Appliance__installation_purpose': {'residential': 0.70, 'commercial': 0.30},
+    'PDRS__motors__number_of_poles': {'poles_2': 0.20, 'poles_4': 0.55, 'poles_6': 0.20, 'poles_8': 0.05},
+    'PDRS__motors__motor_type': {'refrigeration': 0.40, 'ventilation': 0.60},
+    }
+
+
+def generate_population(tax_benefit_system, count, seed = SEED):
+    """Return `{input variable name: array}` for `count` synthetic buildings."""
+    random = np.random.RandomState(seed)
+    columns = OrderedDict()
+    for name, distribution in ENUM_DISTRIBUTIONS.items():
+        variable = tax_benefit_system.get_variable(name, check_existence = True)
+        names = [item.name for item in variable.possible_values]
+        probabilities = [distribution[item_name] for item_name in names]
+        codes = random.choice(len(names), size = count, p = probabilities)
+        columns[name] = EnumArray(codes.astype(variable.dtype), variable.possible_values)
+
+    # Most air conditioners are small split systems, a few are large commercial units
+    cooling_capacity = np.clip(random.lognormal(np.log(7), 0.8, count), 1.5, 150)
+    columns['PDRS__Air_Conditioner__cooling_capacity'] = cooling_capacity
+    columns['PDRS__Air_Conditioner__power_input'] = cooling_capacity / random.uniform(2.8, 4.5, count)
+
+    columns['PDRS__motors__new_motor_rated_output'] = np.clip(random.lognormal(np.log(15), 1.2, count), 0.73, 185)
+    columns['PDRS__motors__new_efficiency'] = random.uniform(88, 97, count)
+    # The efficiency of the replaced motor is often unknown, and defaults to the baseline
+    old_efficiency = random.uniform(78, 94, count)
+    columns['PDRS__motors__old_efficiency'] = np.where(random.rand(count) < 0.4, -999, old_efficiency)
+    return columns
+
+
+def write_population(path, columns):
+    """Write `columns` to the CSV or Parquet file `path`, as a batch input file."""
+    writer = open_writer(path)
+    try:
+        writer.write(columns)
+    finally:
+        writer.close()
+
+
+_systems = {}
+
+
+def shared_system(**system_options):
+    """Return a tax and benefit system built with `system_options`, built once per process.
+
+    Callers must not change the system they get: use `build_tax_benefit_system` for that.
+    """
+    key = tuple(sorted(system_options.items()))
+    tax_benefit_system = _systems.get(key)
+    if tax_benefit_system is None:
+        tax_benefit_system = _systems[key] = build_tax_benefit_system(**system_options)
+    return tax_benefit_system
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# This file lets each row of a simulation read the parameters in force at its own
+# implementation date.
+#
+# The PDRS variables are `ETERNITY` variables whose formulas read `parameters(period)`
+# once for the whole population, so installations carried out under different versions
+# of the parameters would otherwise need one simulation per version. A `Timeline` holds
+# the sorted start dates of every parameter value: the version in force at a date is
+# found with `np.searchsorted`, for all rows at once. A `TimelineOverlay` stands in for
+# the tax and benefit system, and gives formulas a `TimelineNode` holding one snapshot
+# per version in use: reading a parameter gives a single value if it is the same in all
+# versions, otherwise an array of each row's own value. Tables compiled by `lookups` are
+# stacked along a leading version axis, and looked up with each row's version.
+#
+# A single simulation can then calculate installations from several years:
+#
+#     openfisca-pdrs-batch installations.csv savings.csv --implementation-dates
+
+import threading
+import weakref
+
+import numpy as np
+
+from openfisca_core.parameters import ParameterNodeAtInstant, VectorialParameterNodeAtInstant
+
+IMPLEMENTATION_DATE_COLUMN = 'implementation_date'
+
+# The largest int float32 holds exactly, along with all ints below it
+FLOAT32_EXACT_INT_MAX = 2 ** 24
+
+# Systems whose batch calculations read the implementation date of each row
+_dated_systems = weakref.WeakSet()
+
+
+def use_implementation_dates(tax_benefit_system):
+    """Mark `tax_benefit_system` so that the batch tools read each row's parameters at its `implementation_date`."""
+    _dated_systems.add(tax_benefit_system)
+
+
+def uses_implementation_dates(tax_benefit_system):
+    return tax_benefit_system in _dated_systems
+
+
+def to_dates(values):
+    """Return `values` (ISO date strings or `datetime64`s) as a `datetime64[D]` array."""
+    values = np.asarray(values)
+    if values.dtype.kind in ('O', 'S'):
+        values = values.astype(str)
+    if values.dtype.kind == 'U' and (values == '').any():
+        raise ValueError("Every row needs an implementation date: '{}' has empty cells.".format(IMPLEMENTATION_DATE_COLUMN))
+    dates = values.astype('datetime64[D]')
+    if np.isnat(dates).any():
+        raise ValueError("Every row needs an implementation date: '{}' has missing values.".format(IMPLEMENTATION_DATE_COLUMN))
+    return dates
+
+
+def parameter_starts(node):
+    """Return the set of start dates (ISO strings) of the values of the parameters under `node`."""
+    starts = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        starts.update(value.instant_str for value in getattr(node, 'values_list', ()))
+        pending.extend(getattr(node, 'children', {}).values())
+        pending.extend(getattr(node, 'brackets', ()))
+    return starts
+
+
+class Timeline(object):
+    """Sorted start dates of the parameter values of `tax_benefit_system`.
+
+    The parameters in force at a date are those of the latest start on or before it: the
+    versions of the parameters are numbered after their start dates.
+    """
+
+    def __init__(self, tax_benefit_system):
+        self.tax_benefit_system = tax_benefit_system
+        loader = getattr(tax_benefit_system.variables, 'loader', None)
+        if loader is not None:
+            # Lazy system (see `lazy`): a row may read any parameter
+            loader.load_parameters(loader.roots)
+        self.starts = np.array(sorted(parameter_starts(tax_benefit_system.parameters)), dtype = 'datetime64[D]')
+
+    def versions(self, dates):
+        """Return `(instants, codes)`: the start instants of the versions in force at `dates`, and each row's version among them."""
+        dates = to_dates(dates)
+        indices = np.searchsorted(self.starts, dates, side = 'right') - 1
+        if len(indices) and indices.min() < 0:
+            raise ValueError('Implementation dates before {} have no parameters: got {}.'.format(
+                self.starts[0] if len(self.starts) else 'any parameter', dates.min()))
+        used, codes = np.unique(indices, return_inverse = True)
+        return [str(self.starts[index]) for index in used], codes.reshape(-1)
+
+
+_timelines = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_timeline(tax_benefit_system):
+    """Return the `Timeline` of `tax_benefit_system`, built once per system."""
+    with _lock:
+        timeline = _timelines.get(tax_benefit_system)
+        if timeline is None:
+            timeline = _timelines[tax_benefit_system] = Timeline(tax_benefit_system)
+    return timeline
+
+
+# ----- Reading parameters per row ----- #
+
+def select(values, codes):
+    """Return each row's value: `values[codes[i]]` for a value per version, or `values[codes[i]][i]` for an array per version."""
+    arrays = np.broadcast_arrays(*[np.asarray(value) for value in values])
+    if arrays[0].ndim == 0:
+        return np.array(values, dtype = _scalar_dtype(values))[codes]
+    return np.stack(arrays)[codes, np.arange(len(codes))]
+
+
+def _scalar_dtype(values):
+    # NumPy computes with a Python float or int at the precision of the array it meets, e.g.
+    # float32 for OpenFisca float variables. Per-row values are stored so that they promote
+    # the same way: otherwise float64 values would change the results of float32 formulas.
+    # No array dtype promotes like a Python int, so ints are stored as floats which hold them
+    # exactly: float32 gives the same results with float32 variables, and int arithmetic gives
+    # float values rather than wrapping around as a narrow int type would.
+    if all(type(value) is float for value in values):
+        return np.float32
+    if all(type(value) is int for value in values):
+        if max(abs(value) for value in values) <= FLOAT32_EXACT_INT_MAX:
+            return np.float32
+        return np.float64
+    return None
+
+
+def combine(values, codes):
+    """Combine `values`, one per version, into what a row-wise formula reads."""
+    first = values[0]
+    if isinstance(first, (ParameterNodeAtInstant, VectorialParameterNodeAtInstant)):
+        if all(value is first for value in values):
+            return first
+        return TimelineNode(values, codes)
+    if all(_equal(value, first) for value in values[1:]):
+        return first
+    if hasattr(first, 'calc'):
+        return TimelineScale(values, codes)
+    return select(values, codes)
+
+
+def _equal(a, b):
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, np.ndarray):
+        return a.shape == b.shape and bool(np.all(a == b))
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_equal(a[key], b[key]) for key in a)
+    if hasattr(a, '__dict__'):
+        return _equal(vars(a), vars(b))
+    return bool(np.all(a == b))
+
+
+class TimelineNode(object):
+    """Parameter node at instant holding one snapshot per version, and each row's version in `codes`.
+
+    Parameters are read by name or by enum, as from a `ParameterNodeAtInstant`, and give
+    one value per row wherever the versions differ.
+    """
+
+    def __init__(self, nodes, codes):
+        self._nodes = nodes
+        self._codes = codes
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return combine([getattr(node, name) for node in self._nodes], self._codes)
+
+    def __getitem__(self, key):
+        return combine([node[key] for node in self._nodes], self._codes)
+
+    def __iter__(self):
+        return iter(self._nodes[0])
+
+    def per_version(self, build):
+        """Return `build(node)` for the snapshot of each version, e.g. a table compiled by `lookups`.
+
+        Identical results are returned once. Arrays are stacked into a `TimelineTable`, and
+        scales into a `TimelineScale`.
+        """
+        results = [build(node) for node in self._nodes]
+        first = results[0]
+        if all(_equal(result, first) for result in results[1:]):
+            return first
+        if isinstance(first, np.ndarray):
+            return TimelineTable(np.stack(results), self._codes)
+        return TimelineScale(results, self._codes)
+
+
+class TimelineTable(object):
+    """Tables of each version stacked along a leading axis, indexed by each row's version first."""
+
+    def __init__(self, table, codes):
+        self.table = table
+        self.codes = codes
+
+    def __getitem__(self, key):
+        return self.table[(self.codes,) + (key if isinstance(key, tuple) else (key,))]
+
+
+class TimelineScale(object):
+    """Scales of each version: `calc` evaluates every row against its own version's scale."""
+
+    def __init__(self, scales, codes):
+        self.scales = scales
+        self.codes = codes
+
+    def calc(self, *args, **kwargs):
+        return select([scale.calc(*args, **kwargs) for scale in self.scales], self.codes)
+
+
+class TimelineOverlay(object):
+    """Proxy of `tax_benefit_system` whose formulas read each row's parameters at its own implementation date.
+
+    `dates` holds one implementation date per row. Formulas read the same parameters
+    whatever the period they are calculated for. Folded and compiled variables (see
+    `folding` and `compiler`) fall back to their original formulas when the rows span
+    several versions of the parameters.
+    """
+
+    def __init__(self, tax_benefit_system, dates):
+        self.tax_benefit_system = tax_benefit_system
+        self.instants, self.codes = get_timeline(tax_benefit_system).versions(dates)
+        self._parameters = None
+
+    def get_parameters_at_instant(self, instant):
+        if self._parameters is None:
+            snapshots = [self.tax_benefit_system.get_parameters_at_instant(start) for start in self.instants]
+            self._parameters = snapshots[0] if len(snapshots) == 1 else TimelineNode(snapshots, self.codes)
+        return self._parameters
+
+    def __getattr__(self, name):
+        return getattr(self.tax_benefit_system, name)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# This file adds a batch calculation endpoint to the OpenFisca web API.
+#
+# `POST /calculate/batch` takes many independent scenarios, e.g. the AC, motors and ROOA
+# forms submitted by the front-end, packs them into a single `Building` population and
+# calculates the requested variables for all of them in one simulation:
+#
+#     {
+#         "period": "2021",
+#         "variables": ["PDRS__Air_Conditioner__peak_demand_savings"],
+#         "scenarios": [
+#             {"PDRS__Air_Conditioner__cooling_capacity": 7.1, "PDRS__Appliance__zone_type": "hot", ...},
+#             ...
+#             ]
+#     }
+#
+# Each scenario maps input variable names to a single value, using enum names such as
+# `type_6`. Inputs missing from a scenario take their default value. The response holds
+# one `{variable name: value}` result per scenario, in the same order.
+#
+# Serve it, for example, with:
+#
+#     gunicorn "openfisca_nsw_pdrs_tools.web_api:create_app()"
+
+import math
+
+import numpy as np
+
+from openfisca_core import periods
+from openfisca_core.indexed_enums import Enum
+
+from openfisca_nsw_pdrs_tools.batch import DEFAULT_PERIOD, PEAK_DEMAND_SAVINGS_VARIABLES, calculate_columns, to_input_array
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+
+DEFAULT_MAX_SCENARIOS = 10000
+
+
+class ScenarioError(ValueError):
+    """Raised when a batch calculation payload is invalid."""
+
+
+def check_variables(tax_benefit_system, variables):
+    """Return `variables`, a variable name or a list of names, as a list, by default the peak demand savings.
+
+    Raises a `ScenarioError` if it is neither, or names an unknown variable.
+    """
+    if isinstance(variables, str):
+        variables = [variables]
+    if variables is not None and (
+            not isinstance(variables, (list, tuple)) or not all(isinstance(name, str) for name in variables)):
+        raise ScenarioError('Variables must be a variable name or a list of variable names.')
+    variables = list(variables or PEAK_DEMAND_SAVINGS_VARIABLES)
+    for name in variables:
+        if name not in tax_benefit_system.variables:
+            raise ScenarioError("Unknown variable '{}'.".format(name))
+    return variables
+
+
+def calculate_scenarios(tax_benefit_system, scenarios, variables = None, period = DEFAULT_PERIOD):
+    """Calculate `variables` for each of `scenarios` in one vectorised simulation.
+
+    `scenarios` is a list of `{input variable name: value}` dicts. Returns a list of
+    `{variable name: value}` dicts, one per scenario. Results which are not finite numbers
+    are None.
+    """
+    variables = check_variables(tax_benefit_system, variables)
+    try:
+        period = periods.period(period)
+    except (ValueError, TypeError):
+        raise ScenarioError("Invalid period '{}'.".format(period))
+    if not isinstance(scenarios, list) or not all(isinstance(scenario, dict) for scenario in scenarios):
+        raise ScenarioError('Scenarios must be a list of objects mapping input variables to values.')
+    if not scenarios:
+        return []
+
+    columns = {}
+    for name in sorted(set().union(*scenarios)):
+        variable = tax_benefit_system.variables.get(name)
+        if variable is None:
+            raise ScenarioError("Unknown variable '{}'.".format(name))
+        columns[name] = _to_column(variable, [scenario.get(name) for scenario in scenarios])
+
+    results = calculate_columns(tax_benefit_system, columns, variables, period, count = len(scenarios))
+    values = [_to_json_values(results[name]) for name in variables]
+    return [dict(zip(variables, row)) for row in zip(*values)]
+
+
+def _to_json_values(array):
+    # JSON has no NaN nor infinity: such results are sent as null
+    return [None if isinstance(value, float) and not math.isfinite(value) else value for value in array.tolist()]
+
+
+def _to_column(variable, values):
+    # Values are passed as strings, like CSV cells: missing values become empty cells, which
+    # take the variable default value.
+    if variable.value_type == Enum:
+        names = [item.name for item in variable.possible_values]
+        invalid = [value for value in values if value is not None and value not in names]
+        if invalid:
+            raise ScenarioError("Invalid value '{}' for '{}': expected one of {}.".format(
+                invalid[0], variable.name, ', '.join(names)))
+    if any(isinstance(value, (dict, list)) for value in values):
+        raise ScenarioError("Invalid value for '{}': expected a single value per scenario.".format(variable.name))
+
+    column = np.array(['' if value is None else str(value) for value in values])
+    try:
+        return to_input_array(variable, column)
+    except ValueError:
+        raise ScenarioError("Invalid value for '{}': expected a {}.".format(variable.name, variable.value_type.__name__))
+
+
+def create_app(tax_benefit_system = None, max_scenarios = DEFAULT_MAX_SCENARIOS, **kwargs):
+    """Return the OpenFisca web API application, with the `/calculate/batch` endpoint added.
+
+    `tax_benefit_system` defaults to `build_tax_benefit_system()`. Other keyword arguments
+    are passed to `openfisca_web_api.app.create_app`.
+    """
+    # Flask and the web API are only needed when serving
+    from flask import jsonify, request
+    from openfisca_web_api.app import create_app as create_openfisca_app
+
+    if tax_benefit_system is None:
+        tax_benefit_system = build_tax_benefit_system()
+    app = create_openfisca_app(tax_benefit_system, **kwargs)
+
+    @app.route('/calculate/batch', methods = ['POST'])
+    def calculate_batch():
+        payload = request.get_json(silent = True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'The request body must be a JSON object.'}), 400
+        scenarios = payload.get('scenarios', [])
+        if isinstance(scenarios, list) and len(scenarios) > max_scenarios:
+            return jsonify({'error': 'Too many scenarios: at most {} are accepted.'.format(max_scenarios)}), 413
+        period = payload.get('period', DEFAULT_PERIOD)
+
+        try:
+            results = calculate_scenarios(tax_benefit_system, scenarios, payload.get('variables'), period)
+        except ScenarioError as error:
+            return jsonify({'error': str(error)}), 400
+        return jsonify({'period': str(period), 'results': results})
+
+    return app
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+# This file runs the YAML tests of the PDRS, faster than `openfisca test` does.
+#
+# The tax and benefit system is built once, and shared by every test file: worker
+# processes forked to run the test files in parallel inherit it. Each test file is keyed
+# by a hash of its own content, of the source files of the variables it references and of
+# everything they read, directly or not, and of the parameter files these variables read.
+# Files whose key is unchanged since they last passed are skipped:
+#
+#     openfisca-pdrs-test openfisca_nsw_pdrs/tests/ --workers 4
+#
+# The modules of the extension which are not variables (e.g. `lookups`), those of the
+# tools (e.g. `folding`) and the versions of Python, OpenFisca-Core and openfisca_nsw_base
+# are part of every key, so changing any of them runs every test again.
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import yaml
+
+from openfisca_nsw_pdrs_tools import batch
+from openfisca_nsw_pdrs_tools.dependencies import closure, dependency_graph, resolve_parameter_path
+from openfisca_nsw_pdrs_tools.paths import EXTENSION_DIR, PARAMETERS_DIR, TOOLS_DIR, VARIABLES_DIR
+from openfisca_nsw_pdrs_tools.system import build_tax_benefit_system
+from openfisca_nsw_pdrs_tools.system_cache import HASHED_EXTENSIONS, content_hash
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = '.openfisca-test-cache.json'
+TEST_EXTENSIONS = ('.yaml', '.yml')
+
+
+def find_test_files(paths):
+    """Return the YAML files among `paths` and under the directories of `paths`, sorted."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dir_names, file_names in os.walk(path):
+                files.update(os.path.join(root, name) for name in file_names if name.endswith(TEST_EXTENSIONS))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def referenced_variables(tax_benefit_system, path):
+    """Return the names of the variables set or checked by the tests of the YAML file `path`."""
+    with open(path) as test_file:
+        tests = yaml.safe_load(test_file)
+    if isinstance(tests, dict):
+        tests = [tests]
+    names = set()
+    for test in tests or []:
+        for key in ('input', 'output'):
+            _collect_variables(tax_benefit_system, test.get(key), names)
+    return names
+
+
+def _collect_variables(tax_benefit_system, values, names):
+    # Inputs and outputs are keyed by variable, or by entity then variable.
+    if not isinstance(values, dict):
+        return
+    for key, value in values.items():
+        if key in tax_benefit_system.variables:
+            names.add(key)
+        else:
+            _collect_variables(tax_benefit_system, value, names)
+
+
+class TestKeys(object):
+    """Content hashes keying the test files run against `tax_benefit_system`, built with `system_options`."""
+
+    def __init__(self, tax_benefit_system, system_options = None):
+        self.tax_benefit_system = tax_benefit_system
+        self.system_options = system_options or {}
+        self.graph = dependency_graph(tax_benefit_system)
+        # If a formula cannot be analysed, it may read any variable or parameter
+        self.opaque = any(dependencies.opaque for dependencies in self.graph.values())
+        self._file_hashes = {}
+        self.common_key = self._common_key()
+
+    def _common_key(self):
+        digest = hashlib.sha256()
+        # Hashing no directory gives a hash of the Python and OpenFisca-Core versions
+        digest.update(content_hash().encode())
+        digest.update(_distribution_version('openfisca_nsw_base').encode())
+        digest.update(json.dumps(self.system_options, sort_keys = True).encode())
+        for directory in (EXTENSION_DIR, TOOLS_DIR):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.py'):
+                    digest.update(self._file_hash(os.path.join(directory, name)).encode())
+        return digest.hexdigest()
+
+    def key(self, path):
+        """Return the key of the test file `path`."""
+        digest = hashlib.sha256()
+        digest.update(self.common_key.encode())
+        digest.update(self._file_hash(path).encode())
+        for source in sorted(self.source_files(path)):
+            digest.update(os.path.relpath(source, EXTENSION_DIR).encode())
+            digest.update(self._file_hash(source).encode())
+        return digest.hexdigest()
+
+    def source_files(self, path):
+        """Return the variable and parameter files the tests of `path` depend on."""
+        if self.opaque:
+            return set(_source_files(VARIABLES_DIR) + _source_files(PARAMETERS_DIR))
+        names = closure(self.graph, referenced_variables(self.tax_benefit_system, path))
+        files = set()
+        for name in names:
+            files.add(_variable_file(self.tax_benefit_system.variables[name]))
+            for parameter_path in self.graph[name].parameters:
+                resolved = resolve_parameter_path(self.tax_benefit_system.parameters, parameter_path)
+                files.update(_parameter_files(resolved))
+        files.discard(None)
+        return files
+
+    def _file_hash(self, path):
+        file_hash = self._file_hashes.get(path)
+        if file_hash is None:
+            if os.path.isdir(path):
+                file_hash = content_hash(path)
+            else:
+                with open(path, 'rb') as source_file:
+                    file_hash = hashlib.sha256(source_file.read()).hexdigest()
+            self._file_hashes[path] = file_hash
+        return file_hash
+
+
+def _distribution_version(name):
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution(name).version
+    except Exception:
+        return 'unknown'
+
+
+def _variable_file(variable):
+    module = sys.modules.get(type(variable).__module__)
+    path = getattr(module, '__file__', None)
+    return os.path.abspath(path) if path else None
+
+
+def _source_files(directory):
+    return [
+        os.path.join(root, name)
+        for root, dir_names, file_names in os.walk(directory)
+        for name in file_names
+        if name.endswith(HASHED_EXTENSIONS)
+        ]
+
+
+def _parameter_files(path):
+    """Return the files under `parameters/` holding the parameter or node at `path`.
+
+    A node is either a directory or a YAML file; a parameter may be a key of its parent's
+    file. Paths outside `parameters/`, e.g. parameters of openfisca_nsw_base, give nothing.
+    """
+    directory = PARAMETERS_DIR
+    if not path:
+        return [directory]
+    for name in path:
+        candidate = os.path.join(directory, name)
+        if os.path.isdir(candidate):
+            directory = candidate
+            continue
+        for extension in TEST_EXTENSIONS:
+            if os.path.isfile(candidate + extension):
+                return [candidate + extension]
+        # The parameter is defined in the index file of its parent node, or elsewhere
+        index = os.path.join(directory, 'index.yaml')
+        return [index] if os.path.isfile(index) else []
+    return [directory]
+
+
+# ----- Cache ----- #
+
+def load_cache(path):
+    """Return `{test file: key}` of the test files which last passed, from the JSON file `path`."""
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    with open(path, 'w') as cache_file:
+        json.dump(cache, cache_file, indent = 2, sort_keys = True)
+
+
+# ----- Running ----- #
+
+def run_test_file(tax_benefit_system, path, options = None):
+    """Run the tests of `path`, and return `(passed, output)`, the output being pytest's."""
+    from openfisca_core.tools.test_runner import run_tests
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            exit_code = run_tests(tax_benefit_system, [path], options or {})
+        except Exception:
+            log.exception('Error running %s.', path)
+            exit_code = -1
+    return exit_code == 0, output.getvalue()
+
+
+def _run_test_file_in_worker(path, options):
+    return run_test_file(batch._worker_tax_benefit_system, path, options)
+
+
+class TestRun(object):
+    """Outcome of `run_test_files`: the paths of the test files passed, failed and skipped."""
+
+    def __init__(self):
+        self.passed = []
+        self.failed = []
+        self.skipped = []
+        self.seconds = 0.0
+
+    @property
+    def success(self):
+        return not self.failed
+
+
+def run_test_files(paths, workers = 1, cache_path = DEFAULT_CACHE_PATH, use_cache = True, options = None,
+        tax_benefit_system = None, system_options = None, output = None):
+    """Run the YAML tests under `paths`, skipping the files unchanged since they last passed.
+
+    With several `workers`, test files are run in parallel by a pool of processes, which
+    inherit the tax and benefit system when they are forked. The output of each test file
+    which fails is written to `output` (defaults to the standard output). Returns a
+    `TestRun`. With `use_cache` off, every file is run, but the cache is still updated.
+    """
+    output = output or sys.stdout
+    system_options = system_options or {}
+    start = time.time()
+    if tax_benefit_system is None:
+        tax_benefit_system = build_tax_benefit_system(**system_options)
+
+    keys = TestKeys(tax_benefit_system, system_options)
+    cache = load_cache(cache_path) if cache_path else {}
+    run = TestRun()
+    pending = []
+    for path in find_test_files(paths):
+        key = keys.key(path)
+        cache_key = os.path.relpath(path)
+        if use_cache and cache.get(cache_key) == key:
+            run.skipped.append(path)
+        else:
+            pending.append((path, cache_key, key))
+            cache.pop(cache_key, None)
+
+    for (path, cache_key, key), (passed, test_output) in zip(pending, _run(
+            tax_benefit_system, [path for path, _, _ in pending], workers, options, system_options)):
+        if passed:
+            run.passed.append(path)
+            cache[cache_key] = key
+        else:
+            run.failed.append(path)
+            output.write(test_output)
+        log.debug('%s %s.', 'Passed' if passed else 'FAILED', path)
+
+    if cache_path:
+        save_cache(cache_path, cache)
+    run.seconds = time.time() - start
+    return run
+
+
+def _run(tax_benefit_system, paths, workers, options, system_options):
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield run_test_file(tax_benefit_system, path, options)
+        return
+
+    # Forked workers inherit the system already built here instead of building their own.
+    previous, batch._worker_tax_benefit_system = batch._worker_tax_benefit_system, tax_benefit_system
+    try:
+        pool = multiprocessing.Pool(min(workers, len(paths)), initializer = batch._init_worker, initargs = (system_options,))
+    finally:
+        batch._worker_tax_benefit_system = previous
+
+    try:
+        results = [pool.apply_async(_run_test_file_in_worker, (path, options)) for path in paths]
+        for result in results:
+            yield result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description = 'Run the PDRS YAML tests in parallel, skipping those unchanged since they last passed.')
+    parser.add_argument('paths', nargs = '*', default = [os.path.join(EXTENSION_DIR, 'tests')],
+        help = 'YAML test files or directories (default: the PDRS tests)')
+    parser.add_argument('-j', '--workers', type = int, default = multiprocessing.cpu_count(),
+        help = 'number of worker processes (default: %(default)s)')
+    parser.add_argument('--cache', default = DEFAULT_CACHE_PATH,
+        help = 'JSON file keeping the hashes of the test files which passed (default: %(default)s)')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'run every test file, even unchanged ones')
+    parser.add_argument('-n', '--name-filter', default = None,
+        help = 'only run the tests whose name or keywords contain this string')
+    parser.add_argument('--fold-constants', action = 'store_true',
+        help = 'run the tests against the system with folded constants')
+    parser.add_argument('--compact', action = 'store_true',
+        help = 'run the tests against the compact system, with enums stored on one byte')
+    parser.add_argument('--compile', action = 'store_true',
+        help = 'run the tests against the system with compiled formulas')
+    parser.add_argument('--verbose', action = 'store_true', help = 'log each test file run')
+    return parser
+
+
+def main(argv = None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    options = {'name_filter': args.name_filter} if args.name_filter else {}
+    # The name filter only runs some tests of a file: do not record such runs as passed
+    cache_path = None if args.name_filter else args.cache
+    run = run_test_files(
+        args.paths,
+        workers = args.workers,
+        cache_path = cache_path,
+        use_cache = not args.no_cache,
+        options = options,
+        system_options = {'fold_constants': args.fold_constants, 'compact': args.compact, 'compile_formulas': args.compile},
+        )
+    log.info('%d test files passed, %d failed, %d skipped as unchanged in %.1fs.',
+        len(run.passed), len(run.failed), len(run.skipped), run.seconds)
+    for path in run.failed:
+        log.error('FAILED %s', path)
+    return 0 if run.success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -31,7 +31,21 @@ setup(
             "flake8 >=3.5.0,<3.8.0",
             "flake8-print",
             "pycodestyle >=2.3.0,<2.6.0",  # To avoid incompatibility with flake
-            ]
+            ],
+        "parquet": [
+            "pyarrow",
+            ],
+        "service": [
+            "aiohttp",
+            ],
+        },
+    entry_points = {
+        "console_scripts": [
+            "openfisca-pdrs-aggregate = openfisca_nsw_pdrs_tools.aggregation:main",
+            "openfisca-pdrs-batch = openfisca_nsw_pdrs_tools.batch:main",
+            "openfisca-pdrs-serve = openfisca_nsw_pdrs_tools.service:main",
+            "openfisca-pdrs-test = openfisca_nsw_pdrs_tools.yaml_tests:main",
+            ],
         },
     packages=find_packages(),
     )